@@ -1,7 +1,7 @@
 from datetime import datetime
 import time
 import os.path
-import yaml
+import config  # settings of the 'seacanairy_settings.yaml' file
 import logging
 import sys
 import threading
@@ -9,14 +9,26 @@ import threading
 # --------------------------------------------------
 # I2C
 # --------------------------------------------------
-from smbus2 import SMBus
 from sys import exit
-
-# emplacement variable
-bus = SMBus(1)
+import i2c_bus  # the I²C bus is shared with the CO2 sensor and the flow meter
+import metrics  # retries and back-off (see 'metrics.py')
+import streams  # columns of the -data.csv file
 
 # attributed canals and associated emplacements variable
 address = 0b1110110
+i2c_bus.register(address, "AFE board (ADC)")
+
+# Columns in the -data.csv file: (header, item of the dictionary of 'get_data()', kind)
+streams.register("AFE", [("temperature (°C)", "temperature", "number"),
+                         ("temperature (mV)", "temperature raw", "number"),
+                         ("NO2 (ppm)", "NO2 ppm", "number"), ("NO2 main (mV)", "NO2 main", "number"),
+                         ("NO2 aux (mV)", "NO2 aux", "number"),
+                         ("OX (ppm)", "OX ppm", "number"), ("OX main (mV)", "OX main", "number"),
+                         ("OX aux (mV)", "OX aux", "number"),
+                         ("SO2 (ppm)", "SO2 ppm", "number"), ("SO2 main (mV)", "SO2 main", "number"),
+                         ("SO2 aux (mV)", "SO2 aux", "number"),
+                         ("CO2 (ppm)", "CO ppm", "number"), ("CO2 main (mV)", "CO main", "number"),
+                         ("CO2 aux (mV)", "CO aux", "number")])
 
 # --------------------------------------------------------
 # YAML SETTINGS
@@ -25,13 +37,11 @@ address = 0b1110110
 # Get current directory
 current_working_directory = str(os.getcwd())
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)
-    file.close()
+settings = config.load()  # same settings object for all the modules (see 'config.py')
 
-store_debug_messages = settings['AFE Board']['Store debug messages (important increase of logs)']
+store_debug_messages = settings.AFE.store_debug_messages
 
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
 # calibration = settings['AFE Board']['Calibration']
 
@@ -149,10 +159,10 @@ def getADCreading(adc_address, adc_channel):
     while attempts < 4:
 
         try:
-            bus.write_byte(adc_address, adc_channel)
+            i2c_bus.write_byte(adc_address, adc_channel)
             # print("Reading tension...                                         ", end='\r')
-            time.sleep(sleep)
-            reading = bus.read_i2c_block_data(adc_address, adc_channel, lange)
+            time.sleep(sleep)  # conversion of the ADC, the other devices can use the bus meanwhile
+            reading = i2c_bus.read_i2c_block_data(adc_address, adc_channel, lange)
             # ----------- Start conversion for the Channel Data ----------
             valor = ((((reading[0] & 0x3F)) << 16)) + ((reading[1] << 8)) + (((reading[2] & 0xE0)))
             # add a debug function
@@ -180,7 +190,8 @@ def getADCreading(adc_address, adc_channel):
             logger.error("Error in the i2c transmission (" + str(sys.exc_info())
                          + "), trying again... (" + str(attempts) + "/3)")
             attempts += 1  # increment of reading_trials
-            time.sleep(1)  # if transmission fails, wait a bit to try again (sensor is maybe busy)
+            metrics.count("AFE", metrics.RETRIES)
+            metrics.backoff("AFE", 1)  # if transmission fails, wait a bit to try again (sensor is maybe busy)
 
     return False
 
@@ -333,6 +344,65 @@ def get_CO():
     return CO2_to_return
 
 
+# Electrodes of the AFE board and the ADC channel on which they are connected, in the order they are read
+electrodes = [
+    ("NO2 main", channel1),
+    ("NO2 aux", channel2),
+    ("OX main", channel3),
+    ("OX aux", channel4),
+    ("SO2 main", channel5),
+    ("SO2 aux", channel6),
+    ("CO main", channel7),
+    ("CO aux", channel8),
+    ("temperature raw", channel0)
+]
+
+
+def read_electrode(channel):
+    """
+    Read the tension of one electrode of the AFE board
+    :param channel: ADC channel of the electrode (see 'electrodes')
+    :return: tension (mV) or "error"
+    """
+    volts = getADCreading(address, channel)
+    if volts is False:
+        return "error"
+    return round(ch0_mult * volts, 5)
+
+
+def average_readings(readings):
+    """
+    Average the readings of the electrodes, the readings in error are not taken into account
+    :param readings: List[Dictionary{'NO2 main', 'NO2 aux', ..., 'temperature raw'}] (see 'electrodes')
+    :return: Dictionary{'NO2 main', 'NO2 aux', 'OX main', 'OX aux',
+                'SO2 main', 'SO2 aux', 'CO main', 'CO aux',
+                'temperature raw'}
+    """
+    averaged = {}
+    for name, channel in electrodes:
+        values = [reading[name] for reading in readings if reading[name] != "error"]
+        if len(values) == 0:
+            logger.critical("All the readings of " + str(name) + " failed")
+            averaged[name] = "error"
+        else:
+            averaged[name] = sum(values) / len(values)
+    return averaged
+
+
+def print_data(data):
+    """
+    Show the data of the AFE board on the screen
+    :param data: Dictionary returned by 'apply_calibration()'
+    :return: nothing
+    """
+    print("\t\tppm\t|\tmain (mV)\t\t|\taux (mV)")
+    print("NO2:\t", data["NO2 ppm"], "\t|\t", data["NO2 main"], "\t|\t", data["NO2 aux"])
+    print("OX:\t", data["OX ppm"], "\t|\t", data["OX main"], "\t|\t", data["OX aux"])
+    print("SO2:\t", data["SO2 ppm"], "\t|\t", data["SO2 main"], "\t|\t", data["SO2 aux"])
+    print("CO:\t", data["CO ppm"], "\t|\t", data["CO main"], "\t|\t", data["CO aux"])
+    print("Temperature:\t", data["temperature"], "\t|\t", data["temperature raw"])
+
+
 def apply_calibration(dictionary):
     dictionary.update({
         'NO2 ppm': "-",
@@ -360,12 +430,7 @@ def get_data():
     data.update(get_CO())
     data.update(get_temp())
     data = apply_calibration(data)
-    print("\t\tppm\t|\tmain (mV)\t\t|\taux (mV)")
-    print("NO2:\t", data["NO2 ppm"],"\t|\t", data["NO2 main"], "\t|\t", data["NO2 aux"])
-    print("OX:\t", data["OX ppm"], "\t|\t", data["OX main"], "\t|\t", data["OX aux"])
-    print("SO2:\t", data["SO2 ppm"], "\t|\t", data["SO2 main"], "\t|\t", data["SO2 aux"])
-    print("CO:\t", data["CO ppm"], "\t|\t", data["CO main"], "\t|\t", data["CO aux"])
-    print("Temperature:\t", data["temperature"], "\t|\t", data["temperature raw"])
+    print_data(data)
 
     return data
 
@@ -497,12 +562,7 @@ def get_averaged_data():
 
     data = apply_calibration(thread_data)
 
-    print("\t\tppm\t|\tmain (mV)\t\t|\taux (mV)")
-    print("NO2:\t", data["NO2 ppm"],"\t|\t", data["NO2 main"], "\t|\t", data["NO2 aux"])
-    print("OX:\t", data["OX ppm"], "\t|\t", data["OX main"], "\t|\t", data["OX aux"])
-    print("SO2:\t", data["SO2 ppm"], "\t|\t", data["SO2 main"], "\t|\t", data["SO2 aux"])
-    print("CO:\t", data["CO ppm"], "\t|\t", data["CO main"], "\t|\t", data["CO aux"])
-    print("Temperature:\t", data["temperature"], "\t|\t", data["temperature raw"])
+    print_data(data)
 
     return data
 
@@ -17,15 +17,26 @@ import sys
 import os
 
 # smbus2 is the new smbus, allow more than 32 bits writing/reading
-from smbus2 import SMBus, i2c_msg
-# 'SMBus' is the general driver for i2c communication
+from smbus2 import i2c_msg
 # 'i2c_msg' allow to make i2c write followed by i2c read WITHOUT any STOP byte (see sensor documentation)
 
+# the I²C bus is shared with the AFE board and the flow meter (one SMBus for all the drivers)
+import i2c_bus
+
 # logging
 import logging
 
 # yaml settings
-import yaml
+import config  # settings of the 'seacanairy_settings.yaml' file
+
+# retries, checksum failures and back-off (see 'metrics.py')
+import metrics
+
+# columns of the -data.csv file
+import streams
+
+# CRC8 of the frames
+import checksum
 
 # progress bar during sampling
 from progress.bar import IncrementalBar
@@ -33,8 +44,12 @@ from progress.bar import IncrementalBar
 # I²C address of the CO2 device
 CO2_address = 0x33  # i2c address by default, can be changed (see sensor doc)
 
-# emplacement variable
-bus = SMBus(1)  # make it easier to read/write to the sensor (bus.read or bus.write...)
+i2c_bus.register(CO2_address, "CO2 sensor")
+
+# Columns in the -data.csv file: (header, item of the dictionary of 'get_data()', kind)
+streams.register("CO2", [("Relative Humidity (%RH)", "relative humidity", "number"),
+                         ("Temperature (°C)", "temperature", "number"), ("Pressure (hPa)", "pressure", "number"),
+                         ("CO2 average (ppm)", "average", "number"), ("CO2 instant (ppm)", "instant", "number")])
 
 # --------------------------------------------------------
 # YAML SETTINGS
@@ -42,17 +57,15 @@ bus = SMBus(1)  # make it easier to read/write to the sensor (bus.read or bus.wr
 # Get current directory
 current_working_directory = str(os.getcwd())
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)
-    file.close()  # close the file after use
+settings = config.load()  # same settings object for all the modules (see 'config.py')
 
-store_debug_messages = settings['CO2 sensor']['Store debug messages (important increase of logs)']
+store_debug_messages = settings.CO2.store_debug_messages
 
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
-measurement_delay = settings['CO2 sensor']['Amount of time required for the sensor to take the measurement']
+measurement_delay = settings.CO2.measurement_delay
 
-max_attempts = settings['CO2 sensor']['Number of reading attempts']
+max_attempts = settings.CO2.max_attempts
 
 # --------------------------------------------------------
 # LOGGING SETTINGS
@@ -134,30 +147,11 @@ def loading_bar(name, delay):
 
 def digest(buf):
     """
-    Calculate the CRC8 checksum (based on the CO2 documentation example)
+    Calculate the CRC8 checksum (based on the CO2 documentation example, initial value 0xFF, see 'checksum.crc8()')
     :param buf: List of bytes to digest [bytes to digest]
     :return: checksum
     """
-    # Translation of the C++ code given in the documentation
-    crcVal = 0xff
-    _from = 0  # the first item in a list is named 0
-    _to = len(buf)  # if there are two items in the list, then len() return 1 --> range(0, 1) = 2 loops
-
-    for i in range(_from, _to):
-        curVal = buf[i]
-
-        for j in range(0, 8):  # C++ stops when J is not < 8 --> same for python in range
-            if ((crcVal ^ curVal) & 0x80) != 0:
-                crcVal = (crcVal << 1) ^ 0x31
-
-            else:
-                crcVal = (crcVal << 1)
-
-            curVal = (curVal << 1)  # this line is in the "for j" loop, not in the "for i" loop
-
-    checksum = crcVal & 0xff  # keep only the 8 last bits
-
-    return checksum
+    return checksum.crc8(buf, 0xFF)
 
 
 def check(checksum, data):
@@ -176,10 +170,11 @@ def check(checksum, data):
         logger.error("Checksum is wrong, sensor checksum: " + str(checksum) +
                      ", seacanairy checksum: " + str(calculation) +
                      ", bytes returned:" + str(data) + str(checksum))
+        metrics.count("CO2", metrics.CHECKSUM_FAILURES)
         if data[0] and data[1] == 0:
             logger.debug("Sensor returned 0 values, it is not ready, waiting a little bit")
             print("Sensor not ready, waiting...", end='\r')
-            time.sleep(3)
+            metrics.backoff("CO2", 3)
         return False
 
 
@@ -192,9 +187,8 @@ def status(print_information=True):
     """
     logger.debug("Reading sensor status")
     try:
-        with SMBus(1) as bus:
-            # reading = read_from_custom_memory(0x71, 1)
-            reading = bus.read_byte_data(CO2_address, 0x71)
+        # reading = read_from_custom_memory(0x71, 1)
+        reading = i2c_bus.read_byte_data(CO2_address, 0x71)
         # see documentation for the following decryption
         CO2_status = reading & 0b00001000
         temperature_status = reading & 0b00000010
@@ -247,8 +241,7 @@ def getRHT():
 
         while reading_trials <= max_attempts:  # reading loop, will try again if the i2c communication fails
             try:  # SMBUS stop working in case of error, avoid the software to crash in case of i2c error
-                with SMBus(1) as bus:
-                    bus.i2c_rdwr(write, read)
+                i2c_bus.i2c_rdwr(write, read)
                 break  # break the loop if the try has not failed at the previous line, jump to the process of data
 
             except:  # what happens if the i2c fails
@@ -260,7 +253,8 @@ def getRHT():
                 logger.error("i2c failure (" + str(sys.exc_info())
                              + "), trying again... (" + str(reading_trials + 1) + "/" + str(max_attempts) + ")")
                 reading_trials += 1  # increment of reading_trials
-                time.sleep(3)  # if transmission fails, wait a bit to try again (sensor is maybe busy)
+                metrics.count("CO2", metrics.RETRIES)
+                metrics.backoff("CO2", 3)  # if transmission fails, wait a bit to try again (sensor is maybe busy)
 
         # process the data given by the sensor
         reading = list(read)
@@ -291,7 +285,8 @@ def getRHT():
                 attempts += 1
                 logger.warning("Error in the data received (wrong checksum), reading data again... ("
                                + str(attempts) + "/" + str(max_attempts) + ")")
-                time.sleep(4)  # avoid to close i2c communication
+                metrics.count("CO2", metrics.RETRIES)
+                metrics.backoff("CO2", 4)  # avoid to close i2c communication
 
 
 def getCO2P():
@@ -320,8 +315,7 @@ def getCO2P():
 
         while reading_trials <= max_attempts:  # reading loop, will try again if the i2c communication fails
             try:  # SMBUS stop working in case of error, avoid the software to crash in case of i2c error
-                with SMBus(1) as bus:
-                    bus.i2c_rdwr(write, read)
+                i2c_bus.i2c_rdwr(write, read)
                 break  # break the loop if the try has not failed at the previous line, jump to the process of data
 
             except:  # what happens if the i2c fails
@@ -334,7 +328,8 @@ def getCO2P():
                 logger.error("i2c failure, trying again... (" + str(sys.exc_info()) + ")")
                 reading_trials += 1  # increment of reading_trials
                 print("Waiting 3 seconds...", end='\r')
-                time.sleep(3)  # if I²C comm fails, wait a little bit and try again (sensor is maybe busy)
+                metrics.count("CO2", metrics.RETRIES)
+                metrics.backoff("CO2", 3)  # if I²C comm fails, wait a little bit and try again (sensor is maybe busy)
 
         # process the data given by the sensor
         reading = list(read)
@@ -367,7 +362,8 @@ def getCO2P():
                 attempts += 1
                 logger.warning("Error in the data received (wrong checksum), reading data again... (" +
                                str(attempts) + "/" + str(max_attempts) + ")")
-                time.sleep(3)  # avoid too close i2c communication
+                metrics.count("CO2", metrics.RETRIES)
+                metrics.backoff("CO2", 3)  # avoid too close i2c communication
 
 
 def get_data():
@@ -419,7 +415,7 @@ def internal_timestamp(new_timestamp=None):
     else:  # if user doesn't write anything between the brackets
         reading = read_from_custom_memory(0x00, 2)
 
-    if reading is not False:  # read_from_custom_memory() returns False in case of error...
+    if reading:  # read_from_custom_memory() returns False and write_to_custom_memory() None in case of error...
         # ...Python crash if it tries to make calculations with a boolean (True or False)
         measuring_time_interval = (reading[1] + reading[0] * 256) / 10
         if new_timestamp is None:  # adapt the message in function of the wishes of the user (here he want to read)
@@ -534,12 +530,11 @@ def read_from_custom_memory(index, number_of_bytes):
 
     while attempts < 4:
         try:
-            with SMBus(1) as bus:
-                bus.i2c_rdwr(write)
-            read = i2c_msg.read(CO2_address, number_of_bytes)
-            with SMBus(1) as bus:
-                bus.i2c_rdwr(read)
-                break  # break the trial loop if the above has not failed
+            with i2c_bus.session(CO2_address):  # no other device between the index and the reading
+                i2c_bus.i2c_rdwr(write)
+                read = i2c_msg.read(CO2_address, number_of_bytes)
+                i2c_bus.i2c_rdwr(read)
+            break  # break the trial loop if the above has not failed
         except:  # if i2c communication fails
             if attempts >= 3:
                 logger.warning("i2c communication failed 3 times while writing to customer memory, skipping reading")
@@ -568,10 +563,9 @@ def write_to_custom_memory(index, *bytes_to_write):
     cycle = 1  # trial counter for i2c communication
 
     try:
-        with SMBus(1) as bus:
-            write = i2c_msg.write(CO2_address, [0x71, 0x54, index, *bytes_to_write, crc8])  # see sensor doc
-            bus.i2c_rdwr(write)
-            logger.debug("i2c writing succeeded")
+        write = i2c_msg.write(CO2_address, [0x71, 0x54, index, *bytes_to_write, crc8])  # see sensor doc
+        i2c_bus.i2c_rdwr(write)
+        logger.debug("i2c writing succeeded")
             # i2c writing function worked, and sensor didn't replied a NACK on the SCK line
             # (see i2c working principle/theory)
 
@@ -9,7 +9,6 @@ from datetime import datetime, timezone
 
 import serial  # UART libraries, to install this library: pip3 install pyserial
 import time
-import yaml
 import logging
 # import RPi.GPIO as GPIO
 import sys
@@ -19,16 +18,33 @@ import os.path
 # YAML SETTINGS
 # --------------------------------------------------------
 
+import config  # settings of the 'seacanairy_settings.yaml' file
+
+import metrics  # retries and checksum failures (see 'metrics.py')
+
+import streams  # columns of the -data.csv file
+
+import checksum  # XOR of the NMEA lines
+
+# Columns in the -data.csv file: (header, item of the dictionary of 'get_position()', kind)
+# the dates, the position and the fix information are stored as texts (f-e "51°13.4529' N")
+streams.register("GPS", [("Date and time (UTC)", "current time", "text"),
+                         ("GPS fix date and time (UTC)", "fix date and time", "text"),
+                         ("latitude", "latitude", "text"), ("longitude", "longitude", "text"),
+                         ("SOG (kts)", "SOG", "number"), ("COG", "COG", "number"),
+                         ("horizontal dilution of precision", "horizontal precision", "number"),
+                         ("accuracy", "accuracy", "text"), ("altitude (m)", "altitude", "text"),
+                         ("WGS84 correction (m)", "WGS84 correction", "text"), ("fix type", "fix status", "text"),
+                         ("GPS status", "status", "text")])
+
 # Get current directory
 current_working_directory = str(os.getcwd())
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)
-    file.close()
+settings = config.load()  # same settings object for all the modules (see 'config.py')
 
-store_debug_messages = settings['GPS']['Store debug messages (important increase of logs)']
+store_debug_messages = settings.GPS.store_debug_messages
 
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
 # --------------------------------------------------------
 # LOGGING SETTINGS
@@ -99,11 +115,10 @@ else:  # if this file is considered as a library (if you execute 'seacanairy.py'
 # GPIO.output(25, GPIO.LOW)
 
 
-def get_raw_reading(close_UART=True):
+def open_UART():
     """
-    Get raw GPS reading via UART
-    Read all the lines available on the UART port
-    :return: raw data from the GPS
+    Open the UART port connected to the GPS
+    :return: True if succeeded, False if failed
     """
     global ser
     port = '/dev/ttyAMA0'
@@ -113,24 +128,33 @@ def get_raw_reading(close_UART=True):
         logger.debug("Port used for UART communication is: " + str(port))
         ser = serial.Serial(port=port, baudrate=9600)
         print("Starting UART communication...", end='\r')
-        time.sleep(1)
-        ser.flush()
-        try:
-            print("Synchronizing...                          ", end='\r')
-            ser.read_all()  # delete all corrupted data
-            ser.flush()  # flush the buffer
-            time.sleep(1)
-            reading = ser.read_all()
-            if close_UART:
-                ser.close()  # avoid unnecessary port closing if second reading is requested
-        except:
-            logger.critical("Failed to read GPS data on UART port " + str(port) + " (" + str(sys.exc_info()) + ")")
-            ser.close()
-            return False  # indicate error
+        return True
     except:
         logger.critical("Failed to initiate UART port " + str(port) + " (" + str(sys.exc_info()) + ")")
         return False  # indicate error
 
+
+def synchronize_UART():
+    """
+    Delete all the corrupted data waiting on the UART port
+    Next reading must come at least one second later, so that the GPS sends a full set of NMEA lines
+    :return: nothing
+    """
+    ser.flush()
+    print("Synchronizing...                          ", end='\r')
+    ser.read_all()  # delete all corrupted data
+    ser.flush()  # flush the buffer
+
+
+def read_UART(close_UART=True):
+    """
+    Read all the lines available on the UART port
+    :param close_UART: False to keep the port open (if a second reading is requested)
+    :return: raw data from the GPS
+    """
+    reading = ser.read_all()
+    if close_UART:
+        ser.close()  # avoid unnecessary port closing if second reading is requested
     reading = str(reading, 'utf-8', errors='replace')  # convert the text sent in b'...' format into readable format...
     # it will also skip the line where the GPS propose it (see NMEA protocol)
     # 'replace' = replace the unencodable unicode to a question mark
@@ -138,6 +162,38 @@ def get_raw_reading(close_UART=True):
     return reading
 
 
+def close_UART():
+    """
+    Close the UART port if it has been opened
+    :return: nothing
+    """
+    try:
+        ser.close()
+    except NameError:  # the port has never been opened
+        pass
+
+
+def get_raw_reading(close_UART=True):
+    """
+    Get raw GPS reading via UART
+    Read all the lines available on the UART port
+    :return: raw data from the GPS
+    """
+    if not open_UART():
+        return False  # indicate error
+    time.sleep(1)
+    try:
+        synchronize_UART()
+        time.sleep(1)
+        reading = read_UART(close_UART)
+    except:
+        logger.critical("Failed to read GPS data on UART port (" + str(sys.exc_info()) + ")")
+        ser.close()
+        return False  # indicate error
+
+    return reading
+
+
 def lat_long_decode(raw_position, compas):
     """
     Decode longitude and latitude data from NMEA into readable format
@@ -259,16 +315,8 @@ def digest(string_line):
     :param NMEAstring: line of data transmitted by the GPS
     :return:
     """
-    calc_cksum = 0
-    NMEAstring = string_line[1:-3]
-    for s in NMEAstring:
-        # it is XOR of each Unicode integer representation
-        calc_cksum ^= ord(s)
-
-    calc_cksum = str(hex(calc_cksum))[2:]  # get hex representation
-    calc_cksum = calc_cksum.upper()  # convert the lowercase to uppercase (abc to ABC)
-    # if not, Python does not recognize this string as an hexadecimal
-    return calc_cksum
+    # XOR of each character, as 2 hexadecimal digits in uppercase like the checksum of the line (f-e "0A")
+    return "%02X" % checksum.NMEA(string_line[1:-3])
 
 
 def check(NMEA_line):
@@ -278,29 +326,25 @@ def check(NMEA_line):
     :param NMEA_line: one line of data transmitted by the GPS
     :return: True (data are corrects), False (data are not corrects)
     """
-    calc = digest(NMEA_line)
-    checksum = NMEA_line[-2:]  # extract the checksum, the two last characters
-    if calc == checksum:
+    if checksum.NMEA_check(NMEA_line):
         logger.debug("Checksum is correct")
         return True
     else:
-        logger.warning("Checksum is not correct: calculation is " + str(calc) + " | sensor's checksum is " + str(checksum))
+        logger.warning("Checksum is not correct: calculation is " + str(digest(NMEA_line)) +
+                       " | sensor's checksum is " + str(NMEA_line[-2:]))
         logger.warning("NMEA line was: " + str(NMEA_line))
+        metrics.count("GPS", metrics.CHECKSUM_FAILURES)
         return False
 
 
-def get_position():
+def error_position():
     """
-    Get position and all other data from the GPS
+    Create the dictionary returned in case of error (every item is "error")
+    you must return all those items to avoid bugs in seacanairy.py (f-e looking for an item which doesn't exist)
     :return:    Dictionary{fix time, fix date, fix date and time, latitude, longitude, SOG, COG, status,
                 horizontal precision, altitude, WGS84 correction, current time, accuracy}
     """
-    logger.debug("Get position")
-
-    global ser
-    attempts = 1
-
-    to_return = {
+    return {
         "fix date and time": "error",
         "fix date": "error",
         "fix time": "error",
@@ -315,34 +359,33 @@ def get_position():
         "current time": "error",
         "fix status": "error",
         "accuracy": "error"
-    }  # you must return all those items to avoid bugs in seacanairy.py (f-e looking for an item which doesn't exist)
+    }
 
-    while attempts <= 4:
-        reading = get_raw_reading(close_UART=False)
-        if not reading:  # if it failed to read UART, it returns False
-            logger.critical("Unable to read GPS sensor, skipping reading")
-            ser.close()  # if no more reading necessary, close UART port
-            return to_return  # return a dictionary full of "error"
-        else:
-            try:  # avoid errors because of 'I don't know why the sensor sometimes delete items in the NMEA at random'
-                data = decode_NMEA(reading)  # decode the raw reading
-                to_return.update(data)  # update the dictionary with the data the function got
-                logger.debug("'to_return' is:\r" + str(to_return))
-                # At each trial, it will update the dictionary
-            except:
-                logger.error("There were an error while decoding NMEA protocol (" + str(str(sys.exc_info())) + ")")
-
-            if "error" in to_return.values():  # if the dictionary contains an error, try again
-                attempts += 1
-                if attempts >= 4:  # if the system has tried 3 times to read the data but that there are still errors
-                    logger.error("Tried 3 times to get full GPS data, still a value 'error'")
-                    ser.close()  # if no more reading necessary, close UART port
-                    break  # exit the loop and print the data anyway
-                logger.warning("Data missing in GPS transmission, reading again (" + str(attempts) + "/3)")
-            else:  # if there are no errors, then exit the loop and proceed
-                ser.close()  # if no more reading necessary, close UART port
-                break
 
+def process_reading(reading, to_return):
+    """
+    Decode a raw reading and update the dictionary with the data found
+    :param reading: raw reading returned by 'get_raw_reading()'
+    :param to_return: dictionary to update (see 'error_position()')
+    :return: True if the dictionary is complete, False if there is still an "error" item
+    """
+    try:  # avoid errors because of 'I don't know why the sensor sometimes delete items in the NMEA at random'
+        data = decode_NMEA(reading)  # decode the raw reading
+        to_return.update(data)  # update the dictionary with the data the function got
+        logger.debug("'to_return' is:\r" + str(to_return))
+        # At each trial, it will update the dictionary
+    except:
+        logger.error("There were an error while decoding NMEA protocol (" + str(str(sys.exc_info())) + ")")
+
+    return "error" not in to_return.values()
+
+
+def finish_position(to_return):
+    """
+    Add the date to the current time and show the position on the screen
+    :param to_return: dictionary completed by 'process_reading()'
+    :return: the same dictionary
+    """
     to_return["current time"] = to_return["fix date"] + " " + to_return["current time"]
 
     print("Current time:\t", to_return["current time"])
@@ -360,6 +403,40 @@ def get_position():
     return to_return
 
 
+def get_position():
+    """
+    Get position and all other data from the GPS
+    :return:    Dictionary{fix time, fix date, fix date and time, latitude, longitude, SOG, COG, status,
+                horizontal precision, altitude, WGS84 correction, current time, accuracy}
+    """
+    logger.debug("Get position")
+
+    attempts = 1
+
+    to_return = error_position()
+
+    while attempts <= 4:
+        reading = get_raw_reading(close_UART=False)
+        if not reading:  # if it failed to read UART, it returns False
+            logger.critical("Unable to read GPS sensor, skipping reading")
+            close_UART()  # if no more reading necessary, close UART port
+            return to_return  # return a dictionary full of "error"
+        else:
+            if process_reading(reading, to_return):  # if there are no errors, then exit the loop and proceed
+                close_UART()  # if no more reading necessary, close UART port
+                break
+            else:  # if the dictionary contains an error, try again
+                attempts += 1
+                if attempts >= 4:  # if the system has tried 3 times to read the data but that there are still errors
+                    logger.error("Tried 3 times to get full GPS data, still a value 'error'")
+                    close_UART()  # if no more reading necessary, close UART port
+                    break  # exit the loop and print the data anyway
+                logger.warning("Data missing in GPS transmission, reading again (" + str(attempts) + "/3)")
+                metrics.count("GPS", metrics.RETRIES)
+
+    return finish_position(to_return)
+
+
 if __name__ == '__main__':
     print("GPS.py is running alone")
     get_position()
@@ -14,8 +14,38 @@ from progress.bar import IncrementalBar  # beautiful progress bar during samplin
 
 import logging  # save logger messages into memory
 
-# yaml settings
-import yaml  # read user settings
+import config  # settings of the 'seacanairy_settings.yaml' file
+
+import metrics  # retries, checksum failures and back-off (see 'metrics.py')
+
+import streams  # columns of the -data.csv file
+
+import checksum  # CRC16 of the histogram
+
+import recovery  # adaptive recovery of the SPI errors
+
+# Columns of the OPC-N3 in the -data.csv file: (header, item of the dictionary of 'get_data()', kind)
+streams.register("OPC-N3",
+                 [("PM 1 (μg/m³)", "PM 1", "number"), ("PM 2.5 (μg/m³)", "PM 2.5", "number"),
+                  ("PM 10 (μg/m³)", "PM 10", "number"), ("Temperature OPC (°C)", "temperature", "number"),
+                  ("Relative Humidity OPC (%RH)", "relative humidity", "number"),
+                  ("sampling time OPC (sec)", "sampling time", "number"),
+                  ("sample flow rate OPC (ml/s)", "sample flow rate", "number")] +
+                 [("bin " + str(i), "bin " + str(i), "number") for i in range(0, 24)] +
+                 [("bin " + str(i) + " MToF", "bin " + str(i) + " MToF", "number") for i in [1, 3, 5, 7]] +
+                 [("reject count glitch", "reject count glitch", "number"),
+                  ("reject count long TOF", "reject count long TOF", "number"),
+                  ("reject count ratio", "reject count ratio", "number"),
+                  ("reject count out of range", "reject count out of range", "number"),
+                  ("fan revolution count", "fan revolution count", "number"),
+                  ("laser status", "laser status", "number")])
+
+# Columns added to those of the OPC-N3 in streaming mode (see 'aggregate()'): number of histograms read since the
+# previous sampling cycle, minimum and maximum PM of those histograms
+streams.register("OPC-N3 stream",
+                 [("histograms streamed", "histograms", "number")] +
+                 [(PM + " " + bound + " (μg/m³)", PM + " " + bound, "number") for PM in ["PM 1", "PM 2.5", "PM 10"]
+                  for bound in ["min", "max"]])
 
 # --------------------------------------------------------
 # YAML SETTINGS
@@ -24,21 +54,19 @@ import yaml  # read user settings
 # Get current directory
 current_working_directory = str(os.getcwd())
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)
-    file.close()
+settings = config.load()  # same settings object for all the modules (see 'config.py')
 
-store_debug_messages = settings['CO2 sensor']['Store debug messages (important increase of logs)']
+store_debug_messages = settings.OPCN3.store_debug_messages
 
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
-OPC_flushing_time = settings['OPC-N3 sensor']['Flushing time']
+OPC_flushing_time = settings.OPCN3.flushing_time
 
-OPC_sampling_time = settings['OPC-N3 sensor']['Sampling time']
+OPC_sampling_time = settings.OPCN3.sampling_time
 
-take_new_sample_if_checksum_is_wrong = \
-    settings['OPC-N3 sensor'][
-        'Take a new measurement if checksum is wrong (avoid shorter sampling periods when errors)']
+take_new_sample_if_checksum_is_wrong = settings.OPCN3.take_new_sample_if_checksum_is_wrong
+
+recovery_budget = settings.OPCN3.recovery_budget
 
 
 # --------------------------------------------------------
@@ -90,6 +118,12 @@ else:  # if this file is considered as a library (if you execute 'seacanairy.py'
     # no need to add a handler, because there is already one in seacanairy.py
     logger = set_logger(message_level, log_file)
 
+# Statistics of the error recovery of this OPC-N3 kept between two starts (see 'recovery.py')
+if __name__ == '__main__':
+    recovery_file = None
+else:
+    recovery_file = current_working_directory + "/" + project_name + "/" + project_name + "-OPCN3-recovery.json"
+
 # ----------------------------------------------
 # SPI CONFIGURATION
 # ----------------------------------------------
@@ -113,6 +147,29 @@ wait_10_milli = 0.015  # 15 ms
 wait_10_micro = 1e-06
 wait_reset_SPI_buffer = 3  # seconds
 time_available_for_initiate_transmission = 10  # seconds - timeout for SPI response
+wait_busy = 0.02  # seconds, first waiting time after a busy answer, doubled each time (>= 10 ms with the jitter)
+wait_busy_max = 0.1  # seconds
+busy_timeout = 1  # seconds of busy answers before considering that the handshake failed
+
+# Failures of the SPI communication, recovered by 'SPI_recovery' (see 'recovery.py')
+BUSY = "busy"  # 0x31 answered during 'busy_timeout'
+CS_FAULT = "SS line fault"  # 0xE6, 0x63 or 0x00 answered
+UNEXPECTED = "unexpected answer"
+BAD_FRAME = "bad frame"  # wrong checksum or length of the histogram
+
+# Strategies which can be used after a failed handshake {strategy: seconds to wait}
+handshake_strategies = {recovery.REREAD: 0, recovery.BACKOFF: wait_busy, recovery.RESET: wait_reset_SPI_buffer}
+
+SPI_recovery = recovery.Recovery("OPC-N3", recovery_budget, recovery_file)
+
+# Histogram frame sent by the OPC-N3 after the 0x30 command, 86 bytes, little-endian:
+# 24 bins (16 bits), MToF of the bins 1, 3, 5 and 7 (1 byte), sampling time, sample flow rate, temperature,
+# relative humidity (16 bits), PM 1, PM 2.5, PM 10 (IEEE 754 floats), reject counts glitch, long TOF, ratio and
+# out of range, fan revolution count, laser status (16 bits), checksum (CRC16 of the 84 previous bytes)
+histogram_frame = struct.Struct('<24H4B4H3f6HH')
+histogram_request = [0x00] * histogram_frame.size  # bytes clocking the frame out, the same list for each reading
+histogram_buffer = bytearray(histogram_frame.size)  # frame of the last reading, the same buffer for each reading
+histogram_view = memoryview(histogram_buffer)  # checksum and decoding without copying the frame
 
 
 # if the sensor is disconnected, it can happen that the RPi wait for its answer, which never comes...
@@ -142,10 +199,11 @@ def initiate_transmission(command_byte):
     """
     Initiate SPI transmission to the OPC-N3
     First loop of the Flow Chart
+    The failures (busy for too long, SS line fault, unexpected answer) are recovered by 'SPI_recovery'
     :return: TRUE when power state has been initiated
     """
-    attempts = 1  # sensor is busy loop
-    cycle = 1  # SPI buffer reset loop (going to the right on the flowchart)
+    busy_since = None  # first busy answer of the current attempt
+    busy_answers = 0
 
     logger.debug("Initiate transmission with command byte " + str(hex(command_byte)))
 
@@ -160,254 +218,244 @@ def initiate_transmission(command_byte):
         # spi.xfer() means write a byte AND READ AT THE SAME TIME
 
         if reading == [243]:  # SPI ready = 0xF3 = 243
+            metrics.count("OPC-N3", metrics.READY)
+            SPI_recovery.succeed("handshake")
             time.sleep(wait_10_micro)
             return True  # indicate that the initiation succeeded
 
         if reading == [49]:  # SPI busy = 0x31 = 49
-            time.sleep(wait_10_milli)
-            attempts += 1
+            metrics.count("OPC-N3", metrics.BUSY)
+            if busy_since is None:
+                busy_since = time.monotonic()
+            if time.monotonic() - busy_since < busy_timeout:
+                metrics.backoff("OPC-N3", recovery.jittered(wait_busy, busy_answers, wait_busy_max))
+                busy_answers += 1
+                continue
+            logger.error("OPC-N3 busy during more than " + str(busy_timeout) + " second")
+            failure = BUSY
 
         elif reading == [230] or reading == [99] or reading == [0]:
             # During developing, I noticed that these were the answers given by the sensor when the CS line was
             # facing troubles.
             # This comes from personal experiment and not from the official documentation
             # To resolve it, try connecting the CS line directly to the ground (current setting)
-            logger.critical("Problem with the SS (Slave Select) line "
-                            "(error code " + str(hex(reading[0])) + "), skipping")
-            cycle += 1
+            logger.critical("Problem with the SS (Slave Select) line (error code " + str(hex(reading[0])) + ")")
             logger.debug("Check that SS line is well kept DOWN (0V) during transmission."
                          " Try again by connecting SS Line of sensor to Ground")
-            print("Waiting SPI Buffer reset", end='\r')
-            time.sleep(wait_reset_SPI_buffer)
-            return False
+            failure = CS_FAULT
 
         else:
-            logger.critical(
-                "Failed to initiate transmission (unexpected code returned: " + str(hex(reading[0])) + ") (" + str(
-                    cycle) + "/3)")
-            print("Waiting SPI Buffer reset", end='\r')
-            time.sleep(wait_reset_SPI_buffer)
-            cycle += 1  # increment of attempts
-
-        if attempts > 60:
-            # it is recommended to use > 20 in the Alphasense documentation
-            # After experiment it seems that 60 is a good value
-            # (does not take too much time, and let some chance to the sensor to answer READY)
-            logger.error("Failed 60 times to initiate control of power state, reset OPC-N3 SPI buffer, trying again")
-            # cs_high()
-            print("Waiting SPI Buffer reset", end='\r')
-            time.sleep(wait_reset_SPI_buffer)  # time for spi buffer to reset
-
-            attempts = 1  # reset the "SPI busy" loop
-            cycle += 1  # increment of the SPI reset loop
-            # cs_low()
-
-        if cycle >= 3:
-            logger.critical("Failed to initiate transmission (reset 3 times SPI, still error)")
+            logger.critical("Failed to initiate transmission (unexpected code returned: " + str(hex(reading[0])) +
+                            ")")
+            failure = UNEXPECTED
+
+        busy_since = None
+        busy_answers = 0
+        plan = SPI_recovery.fail("handshake", failure, handshake_strategies)
+        if plan is None:
+            logger.critical("Failed to initiate transmission (" + failure + " not recovered)")
             return False
-
+        strategy, delay = plan
+        metrics.count("OPC-N3", metrics.RETRIES)
+        if delay > 0:
+            print("Waiting SPI Buffer reset" if strategy == recovery.RESET else "Waiting before trying again",
+                  end='\r')
+            metrics.backoff("OPC-N3", delay)
+
+    SPI_recovery.abandon("handshake")
     logger.critical("Transmission initiation timeout (> "
                     + str(time_available_for_initiate_transmission) + " secs)")
     return False  # function depending on initiate_transmission function will not continue, indicate error
 
 
-def fan_off():
+class PowerState:
+    """
+    Last known power state of the OPC-N3, None = unknown (see 'read_power_status()')
+    The power commands which would not change anything are skipped (see 'switch()')
+    """
+
+    def __init__(self):
+        self.fan = None
+        self.laser = None
+        self.fan_DAC = None  # fan potentiometer given by the power status (0 to 255)
+        self.laser_DAC = None  # laser potentiometer (0 to 255)
+        self.laser_switch = None
+        self.gain = None  # 1 = high gain
+        self.auto_gain_toggle = None
+        self.fan_speed = None  # value of the fan potentiometer written by 'set_fan_speed()'
+        self.fan_started = None  # 'time.monotonic()' at which the fan has been started
+        self.transitions = {}  # {"fan on"...: {"count", "seconds" (total), "last" (seconds)}}
+        self.skipped = {}  # {"fan on"...: number of commands skipped, the fan or the laser was already in that state}
+
+    def update(self, response):
+        """
+        :param response: List[6 bytes answered to the 0x13 command]
+        :return: nothing
+        """
+        self.fan = {0: False, 1: True}.get(response[0])  # None if the answer is not valid
+        self.laser = {0: False, 1: True}.get(response[1])
+        self.fan_DAC = response[2]
+        self.laser_DAC = response[3]
+        self.laser_switch = response[4] == 1
+        self.gain = response[5] & 0x01
+        self.auto_gain_toggle = response[5] & 0x02
+
+    def forget(self):
+        """
+        The state is unknown (transmission problem, the sensor may have been restarted)
+        :return: nothing
+        """
+        self.fan = self.laser = self.fan_DAC = self.laser_DAC = self.laser_switch = None
+        self.gain = self.auto_gain_toggle = self.fan_speed = self.fan_started = None
+
+    def record(self, transition, duration):
+        """
+        :param transition: f-e "fan on"
+        :param duration: seconds from the command to the confirmation
+        :return: nothing
+        """
+        statistics = self.transitions.setdefault(transition, {"count": 0, "seconds": 0, "last": 0})
+        statistics["count"] += 1
+        statistics["seconds"] += duration
+        statistics["last"] = duration
+        logger.debug(transition.capitalize() + " in " + str(round(duration, 3)) + " seconds")
+
+
+power = PowerState()
+
+# Second byte of the power state command (0x03) of each transition
+power_options = {("fan", True): 0x03, ("fan", False): 0x02, ("laser", True): 0x07, ("laser", False): 0x06}
+fan_start_delay = 0.6  # seconds, the fan must run > 600 ms before the laser is started
+power_poll_interval = 0.02  # seconds, first interval between two readings of the power status, doubled each time
+power_poll_max_interval = 0.5  # seconds
+power_poll_timeout = 2  # seconds
+
+
+def read_power_status():
+    """
+    Read the DAC and power status (0x13) once and keep it in 'power'
+    :return: List[fan, laser, fan DAC, laser DAC, laser switch, gain and auto gain toggle], False if the transmission
+             failed
+    """
+    if not initiate_transmission(0x13):
+        power.forget()
+        return False
+    response = spi.xfer([0x13, 0x13, 0x13, 0x13, 0x13, 0x13])
+    power.update(response)
+    return response
+
+
+def poll_power_status(item, expected):
     """
-    Turn OFF the fan of the OPC-N3
-    :return: FALSE
+    Read the power status until the fan or the laser is in the expected state, the interval between two readings
+    starts short and is doubled each time
+    :param item: 'fan' or 'laser'
+    :param expected: True (on) or False (off)
+    :return: True if the expected state has been read before 'power_poll_timeout'
     """
-    print("Turning fan OFF", end='\r')
-    logger.debug("Turning fan OFF")
-    attempts = 1
-
-    while attempts < 4:
-        # logger.debug("attempts = " + str(attempts))  # disable to reduce the amount of time between spi.xfer
-        if initiate_transmission(0x03):
-            reading = spi.xfer([0x02])
-            # cs_high()
-            # spi.close()  # close the serial port to let it available for another device
-            # Avoid opening and closing ports too ofter.
-            # Avoid getting "too much files opened" error after long running time
-            if reading == [0x03]:  # official answer of the OPC-N3
-                print("Fan is OFF                ")
-                # time.sleep(0.5)  # avoid too close communication (AND let some time to the OPC-N3 to stop the fan)
-                return False
-            else:
-                time.sleep(1)  # let some time to the OPC-N3 (to try to stop the fan)
-                reading = read_DAC_power_status('fan')
-                if reading == 0:
-                    return False
-                elif reading == 1:
-                    attempts += 1
-                    logger.warning("Failed to stop the fan, trying again...")
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-                else:
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-            if attempts >= 3:
-                logger.critical("Failed 3 consecutive times to stop the fan")
-                return True
-        else:
-            logger.critical("Failed to stop the fan (transmission problem)")
+    interval = power_poll_interval
+    stop = time.monotonic() + power_poll_timeout
+    while True:
+        if read_power_status() is not False and getattr(power, item) == expected:
             return True
-    return True
+        if time.monotonic() + interval > stop:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, power_poll_max_interval)
+
+
+def switch(item, on):
+    """
+    Switch the fan or the laser of the OPC-N3 on or off, the command is skipped if it is already in that state
+    If the sensor doesn't give the official answer (0x03), the transition is confirmed by polling the power status
+    :param item: 'fan' or 'laser'
+    :param on: True to switch on, False to switch off
+    :return: state after the transition (True = on), the opposite of 'on' if it failed
+    """
+    transition = item + (" on" if on else " off")
+    state = "ON" if on else "OFF"
+    if getattr(power, item) == on:
+        logger.debug(item.capitalize() + " is already " + state + ", command skipped")
+        power.skipped[transition] = power.skipped.get(transition, 0) + 1
+        return on
+
+    print("Turning " + item + " " + state, end='\r')
+    logger.debug("Turning " + item + " " + state)
+    if item == "laser" and on and power.fan_started is not None:
+        remaining = fan_start_delay - (time.monotonic() - power.fan_started)
+        if remaining > 0:  # let the fan start
+            time.sleep(remaining)
+
+    started = time.monotonic()
+    for attempt in range(1, 4):
+        if not initiate_transmission(0x03):
+            logger.critical("Failed to turn the " + item + " " + state + " (transmission problem)")
+            power.forget()
+            return not on
+        reading = spi.xfer([power_options[(item, on)]])
+        if reading == [0x03] or poll_power_status(item, on):  # official answer of the OPC-N3, or state confirmed
+            if reading != [0x03]:
+                logger.info("Wrong answer received after SPI writing, but " + item + " is well " + state)
+            setattr(power, item, on)
+            if item == "fan":
+                power.fan_started = time.monotonic() if on else None
+            power.record(transition, time.monotonic() - started)
+            print(item.capitalize() + " is " + state + "                ")
+            return on
+        logger.error("Failed to turn the " + item + " " + state + ", trying again (" + str(attempt) + "/3)")
+        metrics.count("OPC-N3", metrics.RETRIES)
+
+    logger.critical("Failed 3 consecutive times to turn the " + item + " " + state)
+    return not on
 
 
-def fan_on():
+def fan_off():
     """
-    Turn ON the fan of the OPC-N3 ON.
-    :return: TRUE
+    Turn OFF the fan of the OPC-N3 (see 'switch()')
+    :return: FALSE if the fan is OFF (command confirmed, or skipped because the fan was already OFF),
+             TRUE if it failed
     """
-    print("Turning fan ON", end='\r')
-    logger.debug("Turning fan ON")
+    return switch("fan", False)
 
-    attempts = 1
 
-    while attempts < 4:
-        # logger.debug("attempts = " + str(attempts))  # disable to reduce the amount of time between spi.xfer
-        if initiate_transmission(0x03):
-            logger.debug("attempts = " + str(attempts))
-            reading = spi.xfer([0x03])
-            # cs_high()
-            # spi.close()  # close the serial port to let it available for another device
-            # Avoid opening and closing ports too ofter.
-            # Avoid getting "too much files opened" error after long running time
-            time.sleep(0.6)  # wait > 600 ms to let the fan start
-            if reading == [0x03]:  # official answer of the OPC-N3
-                print("Fan is ON               ")
-                time.sleep(0.5)  # avoid too close communication
-                return True  # indicate that fan has started
-            else:
-                time.sleep(1)  # let time to the OPC-N3 to try to start the fan
-                reading = read_DAC_power_status('fan')
-                if reading == 1:
-                    return True  # indicate that fan has started
-                elif reading == 0:
-                    logger.error("Failed to start the fan...")
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-                else:
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-            if attempts >= 3:
-                log = "Failed 3 consecutive times to start the fan"
-                logger.critical(log)
-                return False  # indicate that fan is OFF
-        else:
-            logger.critical("Failed to start the fan (transmission problem)")
-            return False
-    return True
+def fan_on():
+    """
+    Turn ON the fan of the OPC-N3 ON (see 'switch()')
+    :return: TRUE if the fan is ON (command confirmed, or skipped because the fan was already ON),
+             FALSE if it failed
+    """
+    return switch("fan", True)
 
 
 def laser_on():
     """
-    Turn ON the laser of the OPC-N3.
-    :return: TRUE
+    Turn ON the laser of the OPC-N3 (see 'switch()')
+    :return: TRUE if the laser is ON (command confirmed, or skipped because the laser was already ON),
+             FALSE if it failed
     """
-    print("Turning laser ON", end='\r')
-    logger.debug("Turning laser ON")
-    attempts = 0
-
-    while attempts < 4:
-        # logger.debug("attempts = " + str(attempts))  # disable to reduce the amount of time between spi.xfer
-        if initiate_transmission(0x03):
-            reading = spi.xfer([0x07])
-            # cs_high()
-            # spi.close()  # close the serial port to let it available for another device
-            # Avoid opening and closing ports too ofter.
-            # Avoid getting "too much files opened" error after long running time
-            if reading == [0x03]:
-                print("Laser is ON           ")
-                time.sleep(.5)  # avoid too close communication
-                return True  # indicate that the laser is ON
-            else:
-                time.sleep(1)  # let time to the OPC-N3 to try to start the laser
-                reading = read_DAC_power_status('laser')
-                if reading == 1:
-                    logger.info("Wrong answer received after SPI writing, but laser is well on")
-                    return True  # indicate that the laser is ON
-                elif reading == 0:
-                    logger.error("Failed to start the laser, trying again...")
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-                else:
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-            if attempts >= 3:
-                logger.critical("Failed 3 consecutive times to start the laser")
-                return False  # indicate that laser is still off
-        else:
-            logger.critical("Failed to start the laser (transmission problem)")
-            return False
-    return False
+    return switch("laser", True)
 
 
 def laser_off():
     """
-    Turn the laser of the OPC-N3 OFF.
-    :return: FALSE
+    Turn the laser of the OPC-N3 OFF (see 'switch()')
+    :return: FALSE if the laser is OFF (command confirmed, or skipped because the laser was already OFF),
+             TRUE if it failed
     """
-    print("Turning the laser OFF", end='\r')
-    logger.debug("Turning laser OFF")
-    attempts = 0
-
-    while attempts < 4:
-        # logger.debug("attempts = " + str(attempts))  # disable to reduce the amount of time between spi.xfer
-        if initiate_transmission(0x03):
-            reading = spi.xfer([0x06])
-            # cs_high()
-            # spi.close()  # close the serial port to let it available for another device
-            # Avoid opening and closing ports too ofter.
-            # Avoid getting "too much files opened" error after long running time
-            if reading == [0x03]:
-                print("Laser is OFF                    ")
-                # time.sleep(1)  # avoid too close communication
-                return False
-            else:
-                time.sleep(1)  # let time to the OPC-N3 to try to stop the laser
-                reading = read_DAC_power_status('laser')
-                if reading == 0:
-                    logger.info("Wrong answer received after writing, but laser is well off")
-                    return False
-                elif reading == 1:
-                    logger.error("Failed to stop the laser (code returned is " + str(reading) + "), trying again...")
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-                else:
-                    attempts += 1
-                    print("Waiting SPI Buffer reset", end='\r')
-                    time.sleep(wait_reset_SPI_buffer)
-            if attempts >= 3:
-                logger.critical("Failed 4 times to stop the laser")
-                return True  # indicate that laser is still on
-        else:
-            logger.critical("Failed to stop the laser (transmission problem)")
-            return True
-    return True
+    return switch("laser", False)
 
 
 def read_DAC_power_status(item='all'):
     """
     Read the status of the Digital to Analog Converter as well as the Power Status (TRY TO READ ONLY ONCE)
+    The transmission errors are recovered by 'initiate_transmission()' (see 'SPI_recovery'), no waiting here
     :param item: 'fan', 'laser', fanDAC', 'laserDAC', 'laser_switch', 'gain', 'auto_gain_toggle', 'all'
-    :return:
+    :return: value of the item (see 'read_power_status()'), percentage for 'fanDAC' and 'laserDAC', False if the
+             transmission failed
     """
     print("Reading DAC power status", end='\r')
-    if initiate_transmission(0x13):
-        response = spi.xfer([0x13, 0x13, 0x13, 0x13, 0x13, 0x13])
-        # cs_high()
-        # spi.close()  # close the serial port to let it available for another device
-        # Avoid opening and closing ports too ofter.
-        # Avoid getting "too much files opened" error after long running time
-        time.sleep(0.5)  # avoid too close communication
-
+    response = read_power_status()
+    if response is not False:
         if item == 'fan':
             logger.debug("DAC power status for " + str(item) + " is " + str(response[0]))
             return response[0]
@@ -435,38 +483,24 @@ def read_DAC_power_status(item='all'):
             response = response[5] & 0x02
             logger.debug("DAC power status for " + str(item) + " is " + str(response))
             return response
-        elif item is 'all':
+        elif item == 'all':
             logger.debug("Full DAC power status is " + str(list(response)))
             return response
         else:
             raise ValueError("Argument of 'read_ADC_power_status' is unknown, check your code!")
 
     else:
-        print("Waiting SPI Buffer reset", end='\r')
-        time.sleep(wait_reset_SPI_buffer)
+        logger.error("Failed to read the DAC power status (transmission problem)")
         return False  # indicate an error
 
 
 def digest(data):
     """
-    Calculate the CRC8 Checksum with the given bytes
+    Calculate the CRC16 Checksum with the given bytes (see 'checksum.crc16()')
     :param data: infinite number of bytes to use to calculate the checksum
     :return: checksum
     """
-    crc = 0xFFFF
-
-    for byteCtr in range(0, len(data)):
-        to_xor = int(data[byteCtr])
-        crc ^= to_xor
-        for bit in range(0, 8):
-            if (crc & 1) == 1:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    # log = "Checksum is " + str(crc)
-    # logger.debug(log)
-    return crc & 0xFFFF
+    return checksum.crc16(data)
 
 
 def check(checksum, *data):
@@ -476,9 +510,12 @@ def check(checksum, *data):
     :param data: all the other bytes sent by the sensor
     :return:
     """
-    to_digest = []
-    for i in data:
-        to_digest.extend(i)
+    if len(data) == 1:
+        to_digest = data[0]  # f-e the whole histogram, no copy
+    else:
+        to_digest = []
+        for i in data:
+            to_digest.extend(i)
     if digest(to_digest) == join_bytes(checksum):
         log = "Checksum is correct"
         logger.debug(log)
@@ -486,6 +523,7 @@ def check(checksum, *data):
     else:
         log = "Checksum is wrong"
         logger.debug(log)
+        metrics.count("OPC-N3", metrics.CHECKSUM_FAILURES)
         return False
 
 
@@ -573,23 +611,14 @@ def getPM(flushing, sampling_time):
     return PM
 
 
-def read_histogram(sampling_period):
+def error_histogram():
     """
-    Read all the available data of the OPC-N3
-    It first read the histogram to delete the old data remaining in the OPCN3 buffer
-    Then it let the sensor take sample during the defined sampling period
-    Finally it read a last time the histogram data returned by the sensor
-    It decode the bytes returned into readable format
-    It returns everything in a dictionary
-    :param: sampling_period: amount of time time (seconds) during while the fan is running
+    Create the dictionary returned in case of error (every item is "error")
+    seacanairy.py need to find the items in the dictionary, if not if crash
     :return: Dictionary{"PM 1", "PM 2.5", "PM 10", "temperature", "relative humidity", "bin", "MToF", "sampling time",
                   "sample flow rate", "reject count glitch", "reject count longTOF", "reject count ratio",
                   "reject count out of range", "fan revolution count", "laser status"}
     """
-    logger.debug("Reading histogram...")
-    print("Reading histogram...", end='\r')
-
-    # Create a dictionary containing data to be returned in case of error
     to_return = {
         "PM 1": "error",
         "PM 2.5": "error",
@@ -603,45 +632,213 @@ def read_histogram(sampling_period):
         "reject count ratio": "error",
         "reject count out of range": "error",
         "fan revolution count": "error",
-        "laser status": "error",
-        "bin 0": "error",
-        "bin 1": "error",
-        "bin 2": "error",
-        "bin 3": "error",
-        "bin 4": "error",
-        "bin 5": "error",
-        "bin 6": "error",
-        "bin 7": "error",
-        "bin 8": "error",
-        "bin 9": "error",
-        "bin 10": "error",
-        "bin 11": "error",
-        "bin 12": "error",
-        "bin 13": "error",
-        "bin 14": "error",
-        "bin 15": "error",
-        "bin 16": "error",
-        "bin 17": "error",
-        "bin 18": "error",
-        "bin 19": "error",
-        "bin 20": "error",
-        "bin 21": "error",
-        "bin 22": "error",
-        "bin 23": "error",
-        "bin 1 MToF": "error",
-        "bin 3 MToF": "error",
-        "bin 5 MToF": "error",
-        "bin 7 MToF": "error"
+        "laser status": "error"
     }
+    for i in range(0, 24):
+        to_return["bin " + str(i)] = "error"
+    for i in range(0, 4):
+        to_return["bin " + str(i * 2 + 1) + " MToF"] = "error"
+    return to_return
 
-    # Delete old histogram data and start a new one
+
+def reset_histogram():
+    """
+    Read the histogram once to delete the old data remaining in the OPCN3 buffer and start a new one
+    :return: True if succeeded, False if the transmission failed
+    """
     if initiate_transmission(0x30):
         answer = spi.xfer([0x00] * 86)
         logger.debug("SPI reading is:\r" + str(answer))
         # spi.close()
         logger.debug("Old histogram in the OPC-N3 deleted, starting a new one")
+        return True
     else:
         logger.critical("Failed to initiate histogram, skipping this measurement")
+        return False
+
+
+class Histogram:
+    """
+    Decoded histogram frame of the OPC-N3 (see 'histogram_frame')
+    """
+
+    __slots__ = ("bins", "MToF", "sampling_time", "sample_flow_rate", "temperature", "relative_humidity", "PM1",
+                 "PM25", "PM10", "reject_count_glitch", "reject_count_long_TOF", "reject_count_ratio",
+                 "reject_count_out_of_range", "fan_revolution_count", "laser_status")
+
+    def __init__(self, fields):
+        """
+        :param fields: values unpacked by 'histogram_frame', checksum included
+        """
+        self.bins = fields[0:24]
+        self.MToF = fields[24:28]  # bins 1, 3, 5 and 7
+        self.sampling_time = fields[28] / 100  # seconds
+        self.sample_flow_rate = fields[29] / 100  # mL/s
+        self.temperature = round(-45 + 175 * (fields[30] / (2 ** 16 - 1)), 2)  # conversion in °C
+        self.relative_humidity = round(100 * (fields[31] / (2 ** 16 - 1)), 2)
+        # rounding until 2 decimals, as this is the accuracy of the OPC-N3 for PM values
+        self.PM1 = round(fields[32], 2)
+        self.PM25 = round(fields[33], 2)
+        self.PM10 = round(fields[34], 2)
+        (self.reject_count_glitch, self.reject_count_long_TOF, self.reject_count_ratio,
+         self.reject_count_out_of_range, self.fan_revolution_count, self.laser_status) = fields[35:41]
+
+    def to_dict(self):
+        """
+        :return: Dictionary with the items of 'error_histogram()'
+        """
+        to_return = {
+            "PM 1": self.PM1,
+            "PM 2.5": self.PM25,
+            "PM 10": self.PM10,
+            "temperature": self.temperature,
+            "relative humidity": self.relative_humidity,
+            "sampling time": self.sampling_time,
+            "sample flow rate": self.sample_flow_rate,
+            "reject count glitch": self.reject_count_glitch,
+            "reject count long TOF": self.reject_count_long_TOF,
+            "reject count ratio": self.reject_count_ratio,
+            "reject count out of range": self.reject_count_out_of_range,
+            "fan revolution count": self.fan_revolution_count,
+            "laser status": self.laser_status
+        }
+        for i in range(0, 24):
+            to_return["bin " + str(i)] = self.bins[i]
+        for i in range(0, 4):
+            to_return["bin " + str(i * 2 + 1) + " MToF"] = self.MToF[i]
+        return to_return
+
+
+def fetch_histogram(sampling_period):
+    """
+    Read the histogram data once and decode the bytes returned into readable format
+    (no waiting, no retry, see 'read_histogram()')
+    :param: sampling_period: amount of time time (seconds) during while the laser was sampling
+    :return: Dictionary (see 'read_histogram()') if succeeded, None if the checksum is wrong,
+            False if the transmission failed
+    """
+    if initiate_transmission(0x30):
+        # read the whole frame in one SPI transfer: no gap between the fields in which the sensor could lose bytes
+        # (spidev gives the answer as a list, it is copied in the buffer kept for all the readings)
+        answer = spi.xfer2(histogram_request)
+        # spi.close()
+
+        if len(answer) != histogram_frame.size:
+            logger.warning("Histogram of " + str(len(answer)) + " bytes received instead of " +
+                           str(histogram_frame.size))
+            return None
+        histogram_buffer[:] = answer
+
+        # check that the data transmitted are correct by comparing the checksums
+        # if the checksum is correct, then proceed...
+        if check(histogram_view[-2:], histogram_view[:-2]):
+            logger.debug("SPI reading is:\r" + str(answer))
+            histogram = Histogram(histogram_frame.unpack_from(histogram_buffer))
+
+            print("PM 1:\t", histogram.PM1, " mg/m3", end="\t\t|\t")
+            print("PM 2.5:\t", histogram.PM25, " mg/m3", end="\t\t|\t")
+            print("PM 10:\t", histogram.PM10, " mg/m3")
+            print("Temperature:", histogram.temperature, " °C (PCB Board)\t| \tRelative Humidity:",
+                  histogram.relative_humidity, " %RH (PCB Board)")
+            print(" Sampling period:", histogram.sampling_time, "seconds", end="\t\t|\t")
+            print(" Sampling flow rate:", histogram.sample_flow_rate, "mL/s |",
+                  round(histogram.sample_flow_rate * 60, 2), "mL/min |",
+                  round(histogram.sample_flow_rate * 60 * 60 / 1000, 2), "L/h")
+            # This is the amount of air passing through the laser beam, not the total sampling flow rate!
+            print(" Reject count glitch:", histogram.reject_count_glitch, end="\t\t|\t")
+            print(" Reject count long TOF:", histogram.reject_count_long_TOF)
+            print(" Reject count ratio:", histogram.reject_count_ratio, end="\t\t|\t")
+            print(" Reject count Out Of Range:", histogram.reject_count_out_of_range)
+            print(" Fan revolutions count:", histogram.fan_revolution_count, end="\t\t|\t")
+            print(" Laser status:", histogram.laser_status)
+            print(" Bin number:\t", ", ".join(str(count) for count in histogram.bins))
+            print(" MToF:\t\t", ", ".join(str(MToF) for MToF in histogram.MToF))
+
+            if histogram.sampling_time > (sampling_period + 0.5):  # we tolerate a difference of 0.5 seconds
+                log = "Sampling period of the sensor was " \
+                      + str(round(histogram.sampling_time - sampling_period, 2)) + " seconds longer than expected"
+                logger.warning(log)
+
+            elif histogram.sampling_time < (sampling_period - 0.5):
+                logger.warning("Sampling period of the sensor was "
+                               + str(round(sampling_period - histogram.sampling_time, 2))
+                               + " seconds shorter than expected")
+
+            return histogram.to_dict()
+
+        else:
+            # if the function with the checksum return an error (FALSE)
+            logger.warning("Error in the data received (wrong checksum)")
+            logger.warning("Data received were:\n" + str(answer))
+            return None
+    else:
+        logger.critical("Failed to read histogram (transmission initiation problem)")
+        return False
+
+
+def frame_strategies(delay):
+    """
+    Reading the histogram delete all the data in the OPCN3's buffer
+    If the checksum is wrong, seacanairy don't get the data as expected
+    Nevertheless, OPCN3 clean its buffer and all data are lost: reading again gives a histogram of the time since
+    the wrong reading only, unless a new sample is taken (see 'Take a new measurement if checksum is wrong')
+    :param delay: time (seconds) waited for a sample
+    :return: Dictionary{strategy which can be used after a wrong histogram: seconds to wait} (see 'recovery.py')
+    """
+    if take_new_sample_if_checksum_is_wrong:
+        return {recovery.RESAMPLE: delay}
+    return {recovery.REREAD: 0, recovery.BACKOFF: 0.1, recovery.RESET: wait_reset_SPI_buffer}
+
+
+def frame_step(reading, delay):
+    """
+    Next step of the reading of the histogram after 'fetch_histogram()', the waiting is done by the caller
+    ('read_histogram()' or 'engine.read_OPCN3_histogram()')
+    :param reading: what 'fetch_histogram()' returned
+    :param delay: time (seconds) waited for the sample
+    :return: (histogram, None, 0) when the reading is finished: the histogram read, or "error" everywhere
+             (None, strategy, seconds) when the histogram must be read again after waiting: a new sample if the
+             strategy is recovery.RESAMPLE, a back-off otherwise (see 'frame_strategies()')
+    """
+    if reading is False:  # transmission problem
+        SPI_recovery.abandon("frame")
+        return error_histogram(), None, 0
+
+    if reading is not None:  # checksum is correct
+        SPI_recovery.succeed("frame")
+        return reading, None, 0
+
+    plan = SPI_recovery.fail("frame", BAD_FRAME, frame_strategies(delay))
+    if plan is None:
+        logger.error("Histogram data were wrong (wrong checksum), skipping this histogram reading")
+        return error_histogram(), None, 0
+    strategy, pause = plan
+    logger.warning("Reading histogram again (" + strategy + ")...")
+    metrics.count("OPC-N3", metrics.RETRIES)
+    return None, strategy, pause
+
+
+def read_histogram(sampling_period):
+    """
+    Read all the available data of the OPC-N3
+    It first read the histogram to delete the old data remaining in the OPCN3 buffer
+    Then it let the sensor take sample during the defined sampling period
+    Finally it read a last time the histogram data returned by the sensor
+    It decode the bytes returned into readable format
+    It returns everything in a dictionary
+    :param: sampling_period: amount of time time (seconds) during while the fan is running
+    :return: Dictionary{"PM 1", "PM 2.5", "PM 10", "temperature", "relative humidity", "bin", "MToF", "sampling time",
+                  "sample flow rate", "reject count glitch", "reject count longTOF", "reject count ratio",
+                  "reject count out of range", "fan revolution count", "laser status"}
+    """
+    logger.debug("Reading histogram...")
+    print("Reading histogram...", end='\r')
+
+    # Create a dictionary containing data to be returned in case of error
+    to_return = error_histogram()
+
+    # Delete old histogram data and start a new one
+    if not reset_histogram():
         return to_return  # indicate clearly an error in the data recording
 
     delay = sampling_period * 2  # you must wait two times the sampling_period in order that
@@ -649,185 +846,56 @@ def read_histogram(sampling_period):
     # first 5 seconds are with low gain, and the next seconds are with high gain (automatically performed by OPC-N3)
     print("                                             ", end='\r')  # remove last line
 
-    # Reading the histogram delete all the data in the OPCN3's buffer
-    # If the checksum is wrong, seacanairy don't get the data as expected
-    # Nevertheless, OPCN3 clean its buffer and all data are lost
-    # So you must wait another x seconds to get sample
-    if not take_new_sample_if_checksum_is_wrong:
-        loading_bar('Sampling PM', delay)
+    loading_bar('Sampling PM', delay)
 
-    attempts = 1  # reset the counter for next measurement
-    while attempts < 4:
-        # If the user want to take a nex sample in case the checksum is wrong (see explanation above), then
-        # the system must wait the required amount of time in the reading loop
-        if take_new_sample_if_checksum_is_wrong:
-            loading_bar('Sampling PM', delay)
-
-        if initiate_transmission(0x30):
-            # read all the bytes and store them in a dedicated variable
-            # see sensor documentation for more info
-            bin = spi.xfer([0x00] * 48)
-            MToF = spi.xfer([0x00] * 4)
-            sampling_time = spi.xfer([0x00] * 2)
-            sample_flow_rate = spi.xfer([0x00] * 2)
-            temperature = spi.xfer([0x00] * 2)
-            relative_humidity = spi.xfer([0x00] * 2)
-            PM_A = spi.xfer([0x00] * 4)
-            PM_B = spi.xfer([0x00] * 4)
-            PM_C = spi.xfer([0x00] * 4)
-            reject_count_glitch = spi.xfer([0x00] * 2)
-            reject_count_longTOF = spi.xfer([0x00] * 2)
-            reject_count_ratio = spi.xfer([0x00] * 2)
-            reject_count_Out_Of_Range = spi.xfer([0x00] * 2)
-            fan_rev_count = spi.xfer([0x00] * 2)
-            laser_status = spi.xfer([0x00] * 2)
-            checksum = spi.xfer([0x00] * 2)
-            # spi.close()
+    while True:
+        histogram, strategy, pause = frame_step(fetch_histogram(sampling_period), delay)
+        if histogram is not None:
+            return histogram
+        if strategy == recovery.RESAMPLE:
+            loading_bar('Sampling PM', pause)
+        elif pause > 0:
+            print("Waiting before reading the histogram again", end='\r')
+            metrics.backoff("OPC-N3", pause)  # let some times between two SPI communications
+
+
+def aggregate(histograms):
+    """
+    Combine the histograms read in streaming mode (fan and laser kept on, see 'Streaming period' in the settings)
+    into one reading of the sampling cycle:
+        - bins, reject counts and fan revolution count summed, sampling time summed
+        - PM weighted by the volume of air sampled by each histogram (sample flow rate * sampling time),
+          minimum and maximum PM of the histograms
+        - MToF, temperature, relative humidity and sample flow rate averaged, laser status of the last histogram
+    :param histograms: List[Dictionary returned by 'fetch_histogram()'], without the failed readings
+    :return: Dictionary (see 'error_histogram()') with the items of the "OPC-N3 stream" columns,
+             "error" everywhere if there is no histogram
+    """
+    to_return = error_histogram()
+    to_return.update(streams.error_data("OPC-N3 stream"))
+    to_return["histograms"] = len(histograms)
+    if not histograms:
+        return to_return
 
-            # check that the data transmitted are correct by comparing the checksums
-            # if the checksum is correct, then proceed...
-            if check(checksum, bin, MToF, sampling_time, sample_flow_rate, temperature, relative_humidity,
-                     PM_A, PM_B,
-                     PM_C, reject_count_glitch, reject_count_longTOF, reject_count_ratio, reject_count_Out_Of_Range,
-                     fan_rev_count, laser_status):
-                logger.debug("SPI reading is:\r" + str(bin) + " " + str(MToF) + " " + str(sampling_time)
-                             + " " + str(sample_flow_rate) + " " + str(temperature) + " " + str(relative_humidity)
-                             + " " + str(PM_A) + " " + str(PM_B) + " " + str(PM_C) + " " + str(reject_count_glitch)
-                             + " " + str(reject_count_longTOF) + " " + str(reject_count_ratio) + " "
-                             + str(reject_count_Out_Of_Range) + " " + str(fan_rev_count)
-                             + " " + str(laser_status))
-                # return TRUE if the data are correct, and execute the below
-
-                # decode the bytes according to the IEEE 754 32 bytes floating point format into decimals
-                # rounding until 2 decimals, as this is the accuracy of the OPC-N3 for PM values
-                PM1 = round(struct.unpack('f', bytes(PM_A))[0], 2)
-                PM25 = round(struct.unpack('f', bytes(PM_B))[0], 2)
-                PM10 = round(struct.unpack('f', bytes(PM_C))[0], 2)
-                print("PM 1:\t", PM1, " mg/m3", end="\t\t|\t")
-                print("PM 2.5:\t", PM25, " mg/m3", end="\t\t|\t")
-                print("PM 10:\t", PM10, " mg/m3")
-
-                relative_humidity = round(100 * (join_bytes(relative_humidity) / (2 ** 16 - 1)), 2)
-                temperature = round(-45 + 175 * (join_bytes(temperature) / (2 ** 16 - 1)), 2)  # conversion in °C
-                print("Temperature:", temperature, " °C (PCB Board)\t| \tRelative Humidity:", relative_humidity,
-                      " %RH (PCB Board)")
-
-                sampling_time = join_bytes(sampling_time) / 100
-                print(" Sampling period:", sampling_time, "seconds", end="\t\t|\t")
-                sample_flow_rate = join_bytes(sample_flow_rate) / 100
-                print(" Sampling flow rate:", sample_flow_rate, "mL/s |", round(sample_flow_rate * 60, 2), "mL/min |",
-                      round(sample_flow_rate * 60 * 60 / 1000, 2), "L/h")
-                # This is the amount of air passing through the laser beam, not the total sampling flow rate!
-
-                reject_count_glitch = join_bytes(reject_count_glitch)
-                print(" Reject count glitch:", reject_count_glitch, end="\t\t|\t")
-                reject_count_longTOF = join_bytes(reject_count_longTOF)
-                print(" Reject count long TOF:", reject_count_longTOF)
-                reject_count_ratio = join_bytes(reject_count_ratio)
-                print(" Reject count ratio:", reject_count_ratio, end="\t\t|\t")
-                reject_count_Out_Of_Range = join_bytes(reject_count_Out_Of_Range)
-                print(" Reject count Out Of Range:", reject_count_Out_Of_Range)
-                fan_rev_count = join_bytes(fan_rev_count)
-                print(" Fan revolutions count:", fan_rev_count, end="\t\t|\t")
-                laser_status = join_bytes(laser_status)
-                print(" Laser status:", laser_status)
-
-                to_return = {
-                    "PM 1": PM1,
-                    "PM 2.5": PM25,
-                    "PM 10": PM10,
-                    "temperature": temperature,
-                    "relative humidity": relative_humidity,
-                    "sampling time": sampling_time,
-                    "sample flow rate": sample_flow_rate,
-                    "reject count glitch": reject_count_glitch,
-                    "reject count long TOF": reject_count_longTOF,
-                    "reject count ratio": reject_count_ratio,
-                    "reject count out of range": reject_count_Out_Of_Range,
-                    "fan revolution count": fan_rev_count,
-                    "laser status": laser_status,
-                    "bin 0": join_bytes(bin[0:1]),
-                    "bin 1": join_bytes(bin[2:3]),
-                    "bin 2": join_bytes(bin[4:5]),
-                    "bin 3": join_bytes(bin[6:7]),
-                    "bin 4": join_bytes(bin[8:9]),
-                    "bin 5": join_bytes(bin[10:11]),
-                    "bin 6": join_bytes(bin[12:13]),
-                    "bin 7": join_bytes(bin[14:15]),
-                    "bin 8": join_bytes(bin[16:17]),
-                    "bin 9": join_bytes(bin[18:19]),
-                    "bin 10": join_bytes(bin[20:21]),
-                    "bin 11": join_bytes(bin[22:23]),
-                    "bin 12": join_bytes(bin[24:25]),
-                    "bin 13": join_bytes(bin[26:27]),
-                    "bin 14": join_bytes(bin[28:29]),
-                    "bin 15": join_bytes(bin[30:31]),
-                    "bin 16": join_bytes(bin[32:33]),
-                    "bin 17": join_bytes(bin[34:35]),
-                    "bin 18": join_bytes(bin[36:37]),
-                    "bin 19": join_bytes(bin[38:39]),
-                    "bin 20": join_bytes(bin[40:41]),
-                    "bin 21": join_bytes(bin[42:43]),
-                    "bin 22": join_bytes(bin[44:45]),
-                    "bin 23": join_bytes(bin[46:47]),
-                    "bin 1 MToF": MToF[0],
-                    "bin 3 MToF": MToF[1],
-                    "bin 5 MToF": MToF[2],
-                    "bin 7 MToF": MToF[3],
-                }
-
-                print(" Bin number:\t", end='')
-                for i in range(0, 24):
-                    print(to_return["bin " + str(i)], end=", ")
-                print("")  # go to next line
-                print(" MToF:\t\t", end='')
-
-                for i in range(0, 4):
-                    i = (i * 2) + 1
-                    print(to_return["bin " + str(i) + " MToF"], end=", ")
-                print("")  # go to next line
-
-                if sampling_time > (sampling_period + 0.5):  # we tolerate a difference of 0.5 seconds
-                    log = "Sampling period of the sensor was " \
-                          + str(round(sampling_time - sampling_period, 2)) + " seconds longer than expected"
-                    logger.warning(log)
-
-                elif sampling_time < (sampling_period - 0.5):
-                    logger.warning("Sampling period of the sensor was "
-                                   + str(round(sampling_period - sampling_time, 2)) + " seconds shorter than expected")
-
-                return to_return
-
-            else:
-                # if the function with the checksum return an error (FALSE)
-                logger.warning(
-                    "Error in the data received (wrong checksum), reading histogram again... (" + str(attempts) + "/3)")
-                logger.warning("Data received were:\n" + str(bin) + str(MToF) + str(sampling_time) +
-                               str(sample_flow_rate) + str(temperature) +
-                               str(relative_humidity) + str(PM_A) + str(PM_B) +
-                               str(PM_C) + str(reject_count_glitch) +
-                               str(reject_count_longTOF) + str(reject_count_ratio) +
-                               str(reject_count_Out_Of_Range) + str(fan_rev_count) +
-                               str(laser_status) + str(checksum))
-                print("Waiting SPI Buffer reset", end='\r')
-                time.sleep(wait_reset_SPI_buffer)  # let some times between two SPI communications
-                attempts += 1
-        else:
-            logger.critical("Failed to read histogram (transmission initiation problem)")
-            return to_return
-
-        if attempts >= 3:
-            logger.error("Data were wrong 3 times (wrong checksum), skipping this histogram reading")
-            logger.warning("Data received were:\n" + str(bin) + str(MToF) + str(sampling_time) +
-                           str(sample_flow_rate) + str(temperature) +
-                           str(relative_humidity) + str(PM_A) + str(PM_B) +
-                           str(PM_C) + str(reject_count_glitch) +
-                           str(reject_count_longTOF) + str(reject_count_ratio) +
-                           str(reject_count_Out_Of_Range) + str(fan_rev_count) +
-                           str(laser_status) + str(checksum))
-            print("Waiting SPI Buffer reset", end='\r')
-            time.sleep(wait_reset_SPI_buffer)
-            return to_return
+    volumes = [histogram["sample flow rate"] * histogram["sampling time"] for histogram in histograms]
+    total_volume = sum(volumes)
+    for PM in ["PM 1", "PM 2.5", "PM 10"]:
+        values = [histogram[PM] for histogram in histograms]
+        if total_volume > 0:
+            to_return[PM] = round(sum(value * volume for value, volume in zip(values, volumes)) / total_volume, 2)
+        else:  # fan stopped, no volume known
+            to_return[PM] = round(sum(values) / len(values), 2)
+        to_return[PM + " min"] = min(values)
+        to_return[PM + " max"] = max(values)
+
+    for item in ["sampling time", "reject count glitch", "reject count long TOF", "reject count ratio",
+                 "reject count out of range", "fan revolution count"] + ["bin " + str(i) for i in range(0, 24)]:
+        to_return[item] = round(sum(histogram[item] for histogram in histograms), 2)
+    for item in ["temperature", "relative humidity", "sample flow rate"] + \
+            ["bin " + str(i * 2 + 1) + " MToF" for i in range(0, 4)]:
+        to_return[item] = round(sum(histogram[item] for histogram in histograms) / len(histograms), 2)
+    to_return["laser status"] = histograms[-1]["laser status"]
+    return to_return
 
 
 def get_data(flushing_time, sampling_time):
@@ -843,49 +911,8 @@ def get_data(flushing_time, sampling_time):
     """
     # return "error" everywhere in case of error during the measurement (fan_on/laser_on/read_histogram...)
     # seacanairy.py need to find the items in the dictionary, if not if crash
-    to_return = {
-        "PM 1": "error",
-        "PM 2.5": "error",
-        "PM 10": "error",
-        "temperature": "error",
-        "relative humidity": "error",
-        "sampling time": "error",
-        "sample flow rate": "error",
-        "reject count glitch": "error",
-        "reject count long TOF": "error",
-        "reject count ratio": "error",
-        "reject count out of range": "error",
-        "fan revolution count": "error",
-        "laser status": "error",
-        "bin 0": "error",
-        "bin 1": "error",
-        "bin 2": "error",
-        "bin 3": "error",
-        "bin 4": "error",
-        "bin 5": "error",
-        "bin 6": "error",
-        "bin 7": "error",
-        "bin 8": "error",
-        "bin 9": "error",
-        "bin 10": "error",
-        "bin 11": "error",
-        "bin 12": "error",
-        "bin 13": "error",
-        "bin 14": "error",
-        "bin 15": "error",
-        "bin 16": "error",
-        "bin 17": "error",
-        "bin 18": "error",
-        "bin 19": "error",
-        "bin 20": "error",
-        "bin 21": "error",
-        "bin 22": "error",
-        "bin 23": "error",
-        "bin 1 MToF": "error",
-        "bin 3 MToF": "error",
-        "bin 5 MToF": "error",
-        "bin 7 MToF": "error"
-    }
+    to_return = error_histogram()
+    SPI_recovery.new_cycle()
     try:  # necessary to put an except condition (see below)
         if fan_on():
             print("Flushing fresh air", end='\r')
@@ -937,10 +964,16 @@ def set_fan_speed(speed):
     value = int((45 + speed / 100 * 55) / 100 * 255)
     # Personal investigations shows that the fan don't work below 45%
     # Formula makes a calculation to convert 0% as 45% --> easier for user input
+    if power.fan_speed == value:
+        logger.debug("Fan speed is already set on " + str(speed) + ", command skipped")
+        power.skipped["fan speed"] = power.skipped.get("fan speed", 0) + 1
+        return
     if initiate_transmission(0x42):
         reading = spi.xfer([0, value])
+        power.fan_speed = value
         logger.info("Fan speed is set on " + str(speed) + " (0 = the slowest, 100 = the fastest)")
     else:
+        power.forget()
         logger.error("Failed to set the fan speed")
 
 
@@ -956,6 +989,7 @@ def initialization_SPI():
     # Personal investigations shows that first communication is always lost
 
     read_DAC_power_status()
+    power.forget()  # the answer of this first communication is not reliable
 
     return
 
@@ -0,0 +1,170 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+Benchmark of the sampling cycle of the Seacanairy
+Execute the whole acquisition loop of 'seacanairy.py' (simulated sensors by default, see 'simulator.py')
+and give the p50/p95/p99 of the duration of each step of the cycle:
+pump flush, OPC-N3, OPC flow, AFE, flow meter, GPS, CO2 sensor, csv file and the whole cycle
+Fails (exit code 1) if the p99 of the cycle is longer than the budget, f-e to choose a sampling period that
+the Seacanairy can really hold, or to check that a change does not make the cycle too long
+
+Usage: python3 benchmark.py [--cycles 10] [--budget 60] [--settings seacanairy_settings.yaml]
+The first cycle waits for the initialization of the sensors, it is not counted (see '--warmup')
+The settings of the file are used (sampling time of the OPC-N3, sensors activated...), except that the cycles
+start one after the other without waiting, and the data are stored in a temporary folder
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import sys
+import tempfile
+
+import yaml  # to read and write the settings file
+
+# Steps of the cycle, in the order of the report (see 'seacanairy.finish_cycle()')
+steps = ["pump flush", "OPC-N3", "OPC flow", "AFE", "flow meter", "GPS", "CO2", "csv", "cycle"]
+
+percentiles = [50, 95, 99]
+
+
+def percentile(values, percent):
+    """
+    Percentile with linear interpolation between the closest values
+    :param values: List[numbers]
+    :param percent: 0 to 100
+    :return: value under which 'percent' % of the values are
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summary(records):
+    """
+    :param records: List[durations of a cycle {step: seconds}] (see 'seacanairy.finish_cycle()')
+    :return: Dictionary{step: {"count", "p50", "p95", "p99", "max"}} (seconds), steps never executed are absent
+    """
+    to_return = {}
+    for step in steps + sorted(set().union(*records) - set(steps)):
+        values = [record[step] for record in records if step in record]
+        if values:
+            to_return[step] = {"count": len(values), "max": max(values)}
+            for percent in percentiles:
+                to_return[step]["p" + str(percent)] = percentile(values, percent)
+    return to_return
+
+
+def print_summary(results, budget):
+    """
+    Show the table of the durations on the screen
+    :param results: see 'summary()'
+    :param budget: maximal duration of the cycle (seconds)
+    :return: nothing
+    """
+    print("\n############## BENCHMARK ###############")
+    print("%-12s %6s %9s %9s %9s %9s" % ("step", "count", "p50 (s)", "p95 (s)", "p99 (s)", "max (s)"))
+    for step in results:
+        print("%-12s %6d %9.3f %9.3f %9.3f %9.3f" % (step, results[step]["count"], results[step]["p50"],
+                                                     results[step]["p95"], results[step]["p99"],
+                                                     results[step]["max"]))
+    print("Budget of the cycle:", budget, "seconds")
+
+
+def prepare_settings(source, backend):
+    """
+    Write the settings file of the benchmark in the current folder
+    :param source: settings file to benchmark
+    :param backend: 'hardware' or 'simulated'
+    :return: Sampling period of the source file (seconds)
+    """
+    with open(source) as file:
+        content = yaml.safe_load(file)
+    general = content.setdefault("Seacanairy settings", {})
+    sampling_period = general.get("Sampling period", 60)
+    general.update({
+        "Sampling session name": "benchmark",
+        "Hardware backend": backend,
+        "Sampling period": 1,  # the next cycle starts as soon as the previous one is finished
+        "Align sampling on the clock": False,
+        "Overrun policy": "stretch"
+    })
+    with open("seacanairy_settings.yaml", "w") as file:
+        yaml.safe_dump(content, file, allow_unicode=True, sort_keys=False)
+    return sampling_period
+
+
+def run(cycles, latency=None, error_rate=None):
+    """
+    Import 'seacanairy.py' with the settings file of the current folder and execute the sampling cycles
+    :param cycles: number of sampling cycles
+    :param latency: Optional: latency of all the simulated devices (seconds)
+    :param error_rate: Optional: error rate of all the simulated devices (0 to 1)
+    :return: List[durations of each cycle]
+    """
+    import config
+    if config.load().seacanairy.hardware_backend == "simulated":
+        import simulator
+        for device in simulator.devices:
+            simulator.configure(device, latency, error_rate)
+    import seacanairy
+    return asyncio.run(seacanairy.main(cycles))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the sampling cycle of the Seacanairy")
+    parser.add_argument("--cycles", type=int, default=10, help="number of sampling cycles (default: 10)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="cycles not counted, initialization of the sensors (default: 1)")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="maximal p99 of the cycle in seconds (default: Sampling period of the settings)")
+    parser.add_argument("--settings", default="seacanairy_settings.yaml", help="settings file to benchmark")
+    parser.add_argument("--backend", choices=["simulated", "hardware"], default="simulated",
+                        help="simulated sensors (default) or sensors connected to the Raspberry Pi")
+    parser.add_argument("--latency", type=float, default=None,
+                        help="latency of each transaction of the simulated devices (seconds)")
+    parser.add_argument("--error-rate", type=float, default=None,
+                        help="probability of an error for each transaction of the simulated devices (0 to 1)")
+    parser.add_argument("--json", default=None, help="also store the results in this file")
+    parser.add_argument("--verbose", action="store_true", help="show the messages of the Seacanairy")
+    arguments = parser.parse_args()
+
+    source = os.path.abspath(arguments.settings)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # the Seacanairy files are next to this one
+    working_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)  # the settings, the data and the log files of the benchmark
+        try:
+            sampling_period = prepare_settings(source, arguments.backend)
+            if arguments.verbose:
+                records = run(arguments.warmup + arguments.cycles, arguments.latency, arguments.error_rate)
+            else:
+                with open(os.devnull, "w") as null, contextlib.redirect_stdout(null), \
+                        contextlib.redirect_stderr(null):
+                    records = run(arguments.warmup + arguments.cycles, arguments.latency, arguments.error_rate)
+        finally:
+            os.chdir(working_directory)
+
+    records = records[arguments.warmup:]
+    budget = arguments.budget if arguments.budget is not None else sampling_period
+    results = summary(records)
+    print_summary(results, budget)
+
+    if arguments.json is not None:
+        with open(arguments.json, "w") as file:
+            json.dump({"budget": budget, "cycles": len(records), "steps": results}, file, indent=4)
+
+    if results["cycle"]["p99"] > budget:
+        print("FAILED: p99 of the cycle (" + str(round(results["cycle"]["p99"], 1)) +
+              " seconds) is longer than the budget (" + str(budget) + " seconds)")
+        sys.exit(1)
+    print("OK: p99 of the cycle (" + str(round(results["cycle"]["p99"], 1)) + " seconds) is within the budget")
+
+
+if __name__ == '__main__':
+    main()
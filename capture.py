@@ -0,0 +1,265 @@
+"""
+Capture of the raw bus traffic of the Seacanairy in a compact binary file (<Sampling session name>-capture.bin)
+Every transaction of the drivers is stored with its time, what was sent and what was received:
+    - SPI: 'spi.xfer()' and 'spi.xfer2()' of the OPC-N3
+    - I²C: 'i2c_rdwr()', 'read_i2c_block_data()', 'read_byte_data()', 'write_byte()' of the CO2 sensor, the AFE
+      board and the flow meter
+    - UART: 'ser.read_all()' of the GPS
+The failed transactions are stored too (errno of the exception), so that a field fault can be reproduced by feeding
+the capture back through the decoders without hardware (see 'replay.py')
+Usage: 'capture.install(file)' before importing the drivers (see 'Capture raw bus traffic' in the settings)
+
+File format: header (magic, version), then one record per transaction:
+    time (double, seconds since epoch), bus (byte), operation (byte), error (byte, errno, 0 = succeeded),
+    address (unsigned short), length of the request (unsigned short), length of the response (unsigned int),
+    request bytes, response bytes
+All the numbers are little-endian
+"""
+
+import atexit
+import errno
+import struct
+import sys
+import threading
+import time
+import logging  # save logger messages into memory
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Capture'
+logger = logging.getLogger('Capture')
+
+magic = b"SEACAP"
+version = 1
+header = struct.Struct("<6sB")
+record = struct.Struct("<dBBBHHI")
+
+# Buses
+SPI = 0
+I2C = 1
+UART = 2
+buses = ["SPI", "I2C", "UART"]
+
+# Operations, stored as their index in this list
+operations = ["xfer", "i2c_rdwr", "read_i2c_block_data", "read_byte_data", "write_byte", "read_all"]
+
+flush_period = 1  # seconds, the file is written at most once per second (and when the software stops)
+
+
+def encode(bus, operation, error, address, request, response, timestamp=None):
+    """
+    :param bus: SPI, I2C or UART
+    :param operation: name of the operation (see 'operations')
+    :param error: errno of the failed transaction, 0 if it succeeded
+    :param address: SPI device, I²C address or 0 for the UART
+    :param request: bytes sent
+    :param response: bytes received
+    :param timestamp: Optional: time of the transaction ('time.time()' by default)
+    :return: bytes of the record
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    request = bytes(request)
+    response = bytes(response)
+    return record.pack(timestamp, bus, operations.index(operation), error & 0xFF, address, len(request),
+                       len(response)) + request + response
+
+
+def read(file):
+    """
+    Read a capture file
+    :param file: path of the -capture.bin file
+    :return: generator of (time, bus, operation, error, address, request, response), the bytes being 'bytes'
+    """
+    with open(file, "rb") as capture_file:
+        found_magic, found_version = header.unpack(capture_file.read(header.size))
+        if found_magic != magic:
+            raise ValueError("'" + str(file) + "' is not a capture of the Seacanairy")
+        if found_version != version:
+            raise ValueError("Version " + str(found_version) + " of the capture file is not supported")
+        while True:
+            fixed = capture_file.read(record.size)
+            if len(fixed) < record.size:
+                return  # end of the file (or last record cut when the software was stopped)
+            timestamp, bus, operation, error, address, request_length, response_length = record.unpack(fixed)
+            request = capture_file.read(request_length)
+            response = capture_file.read(response_length)
+            if len(request) < request_length or len(response) < response_length:
+                return
+            yield timestamp, bus, operations[operation], error, address, request, response
+
+
+class Writer:
+    """
+    Append the records to the capture file, from all the threads of the drivers
+    """
+
+    def __init__(self, file):
+        """
+        :param file: path of the -capture.bin file, created with its header if it doesn't exist
+        """
+        self.file = open(file, "ab")
+        if self.file.tell() == 0:
+            self.file.write(header.pack(magic, version))
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def write(self, bus, operation, error, address, request, response):
+        """
+        Store one transaction (see 'encode()')
+        """
+        data = encode(bus, operation, error, address, request, response)
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(data)
+            if time.monotonic() - self.last_flush > flush_period:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+writer = None  # see 'install()'
+
+
+def failure(error):
+    """
+    :param error: exception raised by a hardware library
+    :return: errno stored in the record (EIO if the exception has none)
+    """
+    return getattr(error, "errno", None) or errno.EIO
+
+
+class Recorder:
+    """
+    Same object as the one of the hardware library, its transactions are stored in the capture file
+    """
+
+    def __init__(self, device):
+        object.__setattr__(self, "device", device)
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.device, name, value)
+
+    def record(self, bus, operation, address, request, function, *args):
+        """
+        Execute the transaction and store it, failed or not
+        :param bus: SPI, I2C or UART
+        :param operation: name of the operation (see 'operations')
+        :param address: SPI device, I²C address or 0 for the UART
+        :param request: bytes sent
+        :param function: method of the hardware library
+        :param args: arguments of the method
+        :return: what the method returns
+        """
+        try:
+            response = function(*args)
+        except Exception as error:
+            writer.write(bus, operation, failure(error), address, request, b"")
+            raise
+        return response
+
+
+class SpiDev(Recorder):
+    """
+    spidev.SpiDev
+    """
+
+    def __init__(self, *args):
+        super().__init__(original["SpiDev"](*args))
+        object.__setattr__(self, "address", 0)
+
+    def open(self, bus, device):
+        object.__setattr__(self, "address", (bus << 8) + device)
+        return self.device.open(bus, device)
+
+    def xfer(self, data):
+        data = list(data)
+        response = self.record(SPI, "xfer", self.address, data, self.device.xfer, data)
+        writer.write(SPI, "xfer", 0, self.address, data, response)
+        return response
+
+    def xfer2(self, data):
+        # same record as 'xfer()', only the chip select between the blocks of the transfer differs
+        data = list(data)
+        response = self.record(SPI, "xfer", self.address, data, self.device.xfer2, data)
+        writer.write(SPI, "xfer", 0, self.address, data, response)
+        return response
+
+
+class SMBus(Recorder):
+    """
+    smbus2.SMBus
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(original["SMBus"](*args, **kwargs))
+
+    def i2c_rdwr(self, *messages):
+        # one record for the whole transaction: bytes of the write messages, bytes of the read messages
+        request = b"".join(bytes(list(message)) for message in messages if not message.flags & 1)
+        self.record(I2C, "i2c_rdwr", messages[0].addr, request, self.device.i2c_rdwr, *messages)
+        response = b"".join(bytes(list(message)) for message in messages if message.flags & 1)
+        writer.write(I2C, "i2c_rdwr", 0, messages[0].addr, request, response)
+
+    def read_i2c_block_data(self, address, register, length, *args):
+        response = self.record(I2C, "read_i2c_block_data", address, [register], self.device.read_i2c_block_data,
+                               address, register, length, *args)
+        writer.write(I2C, "read_i2c_block_data", 0, address, [register], response)
+        return response
+
+    def read_byte_data(self, address, register, *args):
+        response = self.record(I2C, "read_byte_data", address, [register], self.device.read_byte_data, address,
+                               register, *args)
+        writer.write(I2C, "read_byte_data", 0, address, [register], [response])
+        return response
+
+    def write_byte(self, address, value, *args):
+        self.record(I2C, "write_byte", address, [value], self.device.write_byte, address, value, *args)
+        writer.write(I2C, "write_byte", 0, address, [value], b"")
+
+
+class Serial(Recorder):
+    """
+    serial.Serial
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(original["Serial"](*args, **kwargs))
+
+    def read_all(self):
+        response = self.record(UART, "read_all", 0, b"", self.device.read_all)
+        writer.write(UART, "read_all", 0, 0, b"", response)
+        return response
+
+
+original = {}  # classes of the hardware libraries, see 'install()'
+
+
+def install(file):
+    """
+    Store the transactions of the SPI, I²C and UART libraries in the capture file,
+    must be called before importing the drivers (after 'simulator.install()' if the sensors are simulated)
+    :param file: path of the -capture.bin file
+    :return: nothing
+    """
+    global writer
+    writer = Writer(file)
+    for module_name, class_name, recorder in [("spidev", "SpiDev", SpiDev), ("smbus2", "SMBus", SMBus),
+                                              ("serial", "Serial", Serial)]:
+        try:
+            __import__(module_name)
+        except ImportError:
+            logger.warning("'" + module_name + "' not available, its traffic is not captured")
+            continue
+        module = sys.modules[module_name]
+        original[class_name] = getattr(module, class_name)
+        setattr(module, class_name, recorder)
+    logger.info("Raw bus traffic captured in " + str(file))
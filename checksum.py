@@ -0,0 +1,180 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+Checksums of the protocols of the sensors, computed with precomputed tables (one lookup per byte instead of eight
+shifts per byte):
+    - OPC-N3: CRC16, polynomial 0xA001 (reflected), initial value 0xFFFF
+    - CO2 sensor (EE894): CRC8, polynomial 0x31, initial value 0xFF
+    - flow meter (Sensirion): CRC8, polynomial 0x31, initial value 0x00
+    - GPS: XOR of the characters of the NMEA sentence, between '$' and '*'
+The data can be a list of bytes, bytes, bytearray or memoryview
+
+Microbenchmark against the bitwise functions formerly used by the drivers (same results checked first):
+    python3 checksum.py [--loops 10000]
+"""
+
+import argparse
+import functools
+import operator
+import os
+import timeit
+
+
+def crc16_table(polynomial):
+    """
+    :param polynomial: reflected polynomial of the CRC16
+    :return: List[CRC16 of each byte value, 256 entries]
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(0, 8):
+            crc = (crc >> 1) ^ polynomial if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+def crc8_table(polynomial):
+    """
+    :param polynomial: polynomial of the CRC8 (most significant bit first)
+    :return: List[CRC8 of each byte value, 256 entries]
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(0, 8):
+            crc = ((crc << 1) ^ polynomial if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+OPC_table = crc16_table(0xA001)
+sensirion_table = crc8_table(0x31)  # CO2 sensor and flow meter
+
+
+def crc16(data, initial=0xFFFF):
+    """
+    CRC16 of the OPC-N3
+    :param data: bytes to digest
+    :param initial: initial value of the CRC
+    :return: checksum (16 bits)
+    """
+    table = OPC_table
+    crc = initial
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc8(data, initial):
+    """
+    CRC8 of the CO2 sensor (initial value 0xFF) and of the flow meter (initial value 0x00)
+    :param data: bytes to digest
+    :param initial: initial value of the CRC
+    :return: checksum (8 bits)
+    """
+    table = sensirion_table
+    crc = initial
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def NMEA(sentence):
+    """
+    :param sentence: NMEA sentence without '$' and '*' (bytes or text)
+    :return: XOR of all the characters (integer)
+    """
+    if isinstance(sentence, str):
+        sentence = sentence.encode("latin-1", "replace")
+    return functools.reduce(operator.xor, sentence, 0)
+
+
+def NMEA_check(line):
+    """
+    :param line: whole NMEA line, f-e "$GPRMC,...*4F" (bytes or text, the end of line is ignored)
+    :return: True if the checksum after '*' is the XOR of the characters between '$' and '*'
+    """
+    if isinstance(line, str):
+        line = line.encode("latin-1", "replace")
+    line = line.rstrip(b"\r\n")
+    star = line.rfind(b"*")
+    if star < 1 or len(line) != star + 3:
+        return False
+    try:
+        given = int(line[star + 1:], 16)
+    except ValueError:
+        return False
+    return NMEA(line[1:star]) == given
+
+
+# ---------------------------------------------------------------------
+# MICROBENCHMARK
+# ---------------------------------------------------------------------
+# Bitwise functions formerly used by the drivers ('OPCN3.digest()', 'CO2.digest()', 'flow.digest()', 'GPS.digest()')
+
+
+def bitwise_crc16(data):
+    crc = 0xFFFF
+    for byteCtr in range(0, len(data)):
+        crc ^= int(data[byteCtr])
+        for bit in range(0, 8):
+            if (crc & 1) == 1:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc & 0xFFFF
+
+
+def bitwise_crc8(buf, initial):
+    crcVal = initial
+    for i in range(0, len(buf)):
+        curVal = buf[i]
+        for j in range(0, 8):
+            if ((crcVal ^ curVal) & 0x80) != 0:
+                crcVal = (crcVal << 1) ^ 0x31
+            else:
+                crcVal = (crcVal << 1)
+            curVal = (curVal << 1)
+    return crcVal & 0xff
+
+
+def bitwise_NMEA(string_line):
+    calc_cksum = 0
+    for s in string_line[1:-3]:
+        calc_cksum ^= ord(s)
+    return str(hex(calc_cksum))[2:].upper()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the table-driven checksums with the bitwise ones")
+    parser.add_argument("--loops", type=int, default=10000, help="number of checksums of each kind")
+    arguments = parser.parse_args()
+
+    histogram = list(os.urandom(84))  # histogram of the OPC-N3 without its CRC16
+    word = list(os.urandom(2))  # value of the CO2 sensor or of the flow meter
+    line = "$GPRMC,083559.00,A,4717.11437,N,00833.91522,E,0.004,77.52,091202,,,A*57"
+
+    for loop in range(1000):  # same results
+        data = list(os.urandom(loop % 90))
+        assert crc16(data) == bitwise_crc16(data)
+        assert crc8(data, 0xFF) == bitwise_crc8(data, 0xFF)
+        assert crc8(data, 0x00) == bitwise_crc8(data, 0x00)
+    assert NMEA_check(line) and bitwise_NMEA(line) == line[-2:]
+
+    cases = [
+        ("OPC-N3 CRC16 (84 bytes)", lambda: bitwise_crc16(histogram), lambda: crc16(bytes(histogram))),
+        ("CO2 CRC8 (2 bytes)", lambda: bitwise_crc8(word, 0xFF), lambda: crc8(word, 0xFF)),
+        ("flow CRC8 (2 bytes)", lambda: bitwise_crc8(word, 0x00), lambda: crc8(word, 0x00)),
+        ("NMEA (" + str(len(line)) + " characters)", lambda: bitwise_NMEA(line) == line[-2:],
+         lambda: NMEA_check(line))
+    ]
+    print("%-26s %14s %14s %8s" % ("checksum", "bitwise (µs)", "table (µs)", "speedup"))
+    for name, bitwise, table in cases:
+        before = min(timeit.repeat(bitwise, number=arguments.loops, repeat=3)) / arguments.loops * 1e6
+        after = min(timeit.repeat(table, number=arguments.loops, repeat=3)) / arguments.loops * 1e6
+        print("%-26s %14.2f %14.2f %7.1fx" % (name, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
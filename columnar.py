@@ -0,0 +1,311 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+Columnar storage of the aligned cycle rows, instead of the -data.csv file (see 'Data storage backend' in the settings)
+The rows are stored by chunks of typed and compressed columns (Apache Arrow IPC stream, zstd compression):
+    - numbers as 64 bits floats, the "error" values (and the other missing values) as nulls
+    - Date/Time as a timestamp, the GPS texts (position, fix type...) as strings
+One segment file per start of the Seacanairy: <Sampling session name>-data-<YYYYmmdd-HHMMSS>.arrows
+A new segment is started when the columns change (sensor enabled or disabled while running)
+A chunk is readable as soon as it is written, the chunks written before a power cut are not lost
+
+Reading (f-e in a notebook): 'columnar.load(<session folder>)' gives one pyarrow Table of all the segments
+Converter from/to the legacy csv file:
+    python3 columnar.py to-columnar <session>-data.csv [--output <file>.parquet or <file>.arrows]
+    python3 columnar.py to-csv <file>.parquet or <file>.arrows or <session folder> [--output <file>.csv]
+'pyarrow' is only needed when this backend is used (pip3 install pyarrow)
+"""
+
+import argparse
+import csv  # for storing data in file
+import glob
+import os  # to be able to create new files/folders
+import time
+import logging  # save logger messages into memory
+from datetime import datetime
+
+import streams  # columns of the sensors, fsync policies
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Columnar'
+logger = logging.getLogger('Columnar')
+
+extension = ".arrows"  # Arrow IPC stream
+
+
+def import_pyarrow():
+    """
+    :return: pyarrow module, imported only when the columnar backend is used
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError("'pyarrow' is required by the columnar data storage backend (pip3 install pyarrow)")
+    return pyarrow
+
+
+def column_type(column_kind):
+    """
+    :param column_kind: "time", "text" or "number" (see 'streams.kind()')
+    :return: pyarrow type of the column
+    """
+    pyarrow = import_pyarrow()
+    return {"time": pyarrow.timestamp("s"), "text": pyarrow.string(), "number": pyarrow.float64()}[column_kind]
+
+
+def schema(header, kinds=None):
+    """
+    :param header: List[headers of the columns]
+    :param kinds: Optional: List[kinds of the columns] (see 'streams.read_header()'), 'streams.kind()' by default
+    :return: pyarrow schema of the rows
+    """
+    pyarrow = import_pyarrow()
+    kinds = kinds or [streams.kind(name) for name in header]
+    return pyarrow.schema([(name, column_type(kind)) for name, kind in zip(header, kinds)])
+
+
+def batch(header, rows, kinds=None):
+    """
+    :param header: List[headers of the columns]
+    :param rows: List[List[values]], rows shorter than the header are completed with nulls
+    :param kinds: Optional: see 'schema()'
+    :return: pyarrow RecordBatch
+    """
+    pyarrow = import_pyarrow()
+    kinds = kinds or [streams.kind(name) for name in header]
+    row_schema = schema(header, kinds)
+    columns = []
+    for i, kind in enumerate(kinds):
+        values = [streams.convert(row[i], kind) if i < len(row) else None for row in rows]
+        columns.append(pyarrow.array(values, type=row_schema.field(i).type))
+    return pyarrow.RecordBatch.from_arrays(columns, schema=row_schema)
+
+
+class ColumnarWriter:
+    """
+    Segments of the aligned cycle rows, same usage as 'streams.BufferedCSV': the rows are kept in memory and written
+    as one chunk when there are enough of them
+    """
+
+    def __init__(self, directory_path, project_name, flush_rows=1, flush_interval=0, fsync_policy="never"):
+        """
+        :param directory_path: folder of the sampling session
+        :param project_name: name of the sampling session
+        :param flush_rows: a chunk is written when this number of rows is kept in memory
+        :param flush_interval: Optional: a chunk is written when the oldest row is kept since this amount of seconds
+                               (checked when a row is added), 0 = no limit
+        :param fsync_policy: see 'streams.fsync_policies'
+        """
+        import_pyarrow()  # fail at the start of the Seacanairy if it is missing
+        self.directory_path = directory_path
+        self.project_name = project_name
+        self.header = None  # columns of the current segment
+        self.data_file = None  # current segment
+        self.writer = None
+        self.rows = []  # rows kept in memory
+        self.oldest = None  # time at which the oldest row kept in memory has been added
+        self.configure(flush_rows, flush_interval, fsync_policy)
+
+    def configure(self, flush_rows, flush_interval, fsync_policy):
+        """
+        Change when the chunks are written (see '__init__()'), the rows kept in memory are not lost
+        :return: nothing
+        """
+        if fsync_policy not in streams.fsync_policies:
+            raise ValueError("fsync policy must be one of " + str(streams.fsync_policies) + ", not '" +
+                             str(fsync_policy) + "'")
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+
+    def open_segment(self, header):
+        """
+        Start a new segment file with the columns given
+        :param header: List[headers of the columns]
+        :return: nothing
+        """
+        pyarrow = import_pyarrow()
+        self.close_segment()
+        file = self.directory_path + "/" + str(self.project_name) + "-data-" + \
+            datetime.now().strftime("%Y%m%d-%H%M%S") + extension
+        while os.path.exists(file):  # two segments started during the same second
+            file = file[:-len(extension)] + "-" + extension
+        logger.info("Initializing data file " + file)
+        self.data_file = open(file, "wb")
+        self.header = list(header)
+        self.writer = pyarrow.ipc.new_stream(self.data_file, schema(self.header),
+                                             options=pyarrow.ipc.IpcWriteOptions(compression="zstd"))
+
+    def close_segment(self):
+        """
+        Write the rows kept in memory and close the current segment
+        :return: nothing
+        """
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        if self.fsync_policy == "close":
+            os.fsync(self.data_file.fileno())
+        self.data_file.close()
+        self.writer = None
+        self.data_file = None
+
+    def writerow(self, to_write, header):
+        """
+        Add a row, written with the others when there are enough rows or when the oldest one is too old
+        :param to_write: List[values]
+        :param header: List[headers of the columns of the row] (see 'streams.cycle_header()')
+        :return: nothing
+        """
+        if self.header != list(header):
+            self.open_segment(header)  # the rows kept in memory are written in the previous segment
+        if not self.rows:
+            self.oldest = time.monotonic()
+        self.rows.append(to_write)
+        if len(self.rows) >= self.flush_rows or \
+                (self.flush_interval > 0 and time.monotonic() - self.oldest >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows kept in memory as one chunk
+        :return: nothing
+        """
+        if self.writer is None or not self.rows:
+            return
+        self.writer.write_batch(batch(self.header, self.rows))
+        self.rows = []
+        self.data_file.flush()
+        if self.fsync_policy == "flush":
+            os.fsync(self.data_file.fileno())
+
+    def close(self):
+        """
+        Write the rows kept in memory and close the segment, can be called several times
+        :return: nothing
+        """
+        self.close_segment()
+
+
+# ---------------------------------------------------------------------
+# READING AND CONVERSION
+# ---------------------------------------------------------------------
+
+
+def read_segment(file):
+    """
+    :param file: segment file (.arrows)
+    :return: pyarrow Table of the chunks of the segment, the last chunk is ignored if it is incomplete (power cut)
+    """
+    pyarrow = import_pyarrow()
+    with pyarrow.OSFile(file) as source:
+        reader = pyarrow.ipc.open_stream(source)
+        batches = []
+        try:
+            for record_batch in reader:
+                batches.append(record_batch)
+        except (pyarrow.ArrowInvalid, OSError):
+            logger.warning("'" + str(file) + "' ends with an incomplete chunk, ignored")
+        return pyarrow.Table.from_batches(batches, schema=reader.schema)
+
+
+def load(path):
+    """
+    :param path: session folder (all its segments), segment file (.arrows) or Parquet file (.parquet)
+    :return: pyarrow Table, in the order of the segments (time), columns absent from a segment are nulls
+    """
+    pyarrow = import_pyarrow()
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*-data-*" + extension)))
+        if not files:
+            raise FileNotFoundError("No columnar data file (*-data-*" + extension + ") in '" + str(path) + "'")
+        tables = [read_segment(file) for file in files]
+        try:
+            return pyarrow.concat_tables(tables, promote_options="default")
+        except TypeError:  # pyarrow < 14
+            return pyarrow.concat_tables(tables, promote=True)
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(path)
+    return read_segment(path)
+
+
+def csv_to_columnar(csv_file, output):
+    """
+    Convert a -data.csv file (with or without schema line), the values "error" become nulls
+    :param csv_file: -data.csv file
+    :param output: .parquet file or .arrows file
+    :return: number of rows converted
+    """
+    pyarrow = import_pyarrow()
+    with open(csv_file, newline='') as data_file:
+        reader = csv.reader(data_file, delimiter=',', quotechar='"')
+        version, header, kinds = streams.read_header(reader)
+        rows = list(reader)
+    table = pyarrow.Table.from_batches([batch(header, rows, kinds)])
+    if output.endswith(".parquet"):
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, output, compression="zstd")
+    else:
+        with open(output, "wb") as columnar_file:
+            with pyarrow.ipc.new_stream(columnar_file, table.schema,
+                                        options=pyarrow.ipc.IpcWriteOptions(compression="zstd")) as writer:
+                writer.write_table(table)
+    return len(rows)
+
+
+def legacy(value):
+    """
+    :param value: value of a column
+    :return: value as written in the legacy -data.csv file
+    """
+    if value is None:
+        return "error"
+    if isinstance(value, datetime):
+        return value.strftime(streams.date_format)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def columnar_to_csv(path, output):
+    """
+    Convert columnar data to a legacy -data.csv file, the nulls become "error"
+    :param path: see 'load()'
+    :param output: .csv file
+    :return: number of rows converted
+    """
+    table = load(path)
+    with open(output, mode='w', newline='') as data_file:
+        writer = csv.writer(data_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(table.column_names)
+        for record_batch in table.to_batches():
+            for row in zip(*[column.to_pylist() for column in record_batch.columns]):
+                writer.writerow([legacy(value) for value in row])
+    return table.num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the data of the Seacanairy between csv and columnar files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_columnar = commands.add_parser("to-columnar", help="legacy -data.csv file to a .parquet or .arrows file")
+    to_columnar.add_argument("csv_file")
+    to_columnar.add_argument("--output", default=None, help="default: same name, .parquet")
+    to_csv = commands.add_parser("to-csv", help=".parquet file, .arrows file or session folder to a csv file")
+    to_csv.add_argument("path")
+    to_csv.add_argument("--output", default=None, help="default: same name, .csv")
+    arguments = parser.parse_args()
+
+    start = time.time()
+    if arguments.command == "to-columnar":
+        output = arguments.output or os.path.splitext(arguments.csv_file)[0] + ".parquet"
+        rows = csv_to_columnar(arguments.csv_file, output)
+    else:
+        output = arguments.output or os.path.splitext(arguments.path.rstrip("/"))[0] + ".csv"
+        rows = columnar_to_csv(arguments.path, output)
+    print(rows, "rows written in '" + output + "' in", round(time.time() - start, 2), "seconds")
+
+
+if __name__ == '__main__':
+    main()
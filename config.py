@@ -0,0 +1,356 @@
+"""
+Settings of the Seacanairy
+'seacanairy_settings.yaml' is read and checked only once, all the modules receive the same settings object
+(f-e settings.CO2.measurement_delay instead of settings['CO2 sensor']['Amount of time required...'])
+The file is read again only if it has been modified (see 'load()')
+"""
+
+import os  # to see the current path and the modification time of the file
+import sys
+import logging  # save logger messages into memory
+from typing import NamedTuple
+
+import yaml  # to read the settings stored in the 'seacanairy_settings.yaml' file
+
+import scheduler  # overrun policies
+import streams  # storage backends and fsync policies of the aligned cycle rows
+import rotation  # rotation policies and compressions of the data and log files
+
+file_path = str(os.getcwd()) + '/seacanairy_settings.yaml'
+
+# 'hardware' = sensors connected to the Raspberry Pi, 'simulated' = simulated sensors (see 'simulator.py')
+backends = ["hardware", "simulated"]
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Settings'
+logger = logging.getLogger('Settings')
+
+
+# ---------------------------------------------------------------------
+# SCHEMA
+# ---------------------------------------------------------------------
+# One class per section of the yaml file: type and default value of each setting (immutable)
+
+
+class SeacanairySettings(NamedTuple):
+    session_name: str = "seacanairy"
+    sampling_period: int = 60  # seconds
+    piping_flushing_time: int = 0  # seconds
+    align_on_clock: bool = True
+    overrun_policy: str = "skip"  # 'skip', 'catch up' or 'stretch' (see 'scheduler.py')
+    write_cycle_row: bool = True
+    data_backend: str = "csv"  # 'csv', 'columnar' (see 'columnar.py') or 'sqlite' (see 'database.py')
+    data_flush_rows: int = 1  # rows of the -data.csv file kept in memory before writing them
+    data_flush_interval: int = 0  # seconds, 0 = no limit
+    data_fsync: str = "never"  # 'never', 'flush' or 'close' (see 'streams.BufferedCSV')
+    data_journal: bool = False  # see 'journal.py'
+    rotation_policy: str = "never"  # 'never', 'daily' or 'size' (see 'rotation.py')
+    rotation_size: int = 10  # MB
+    rotation_compression: str = "gzip"  # 'none', 'gzip' or 'zstd'
+    write_metrics: bool = True
+    pipelined_cycles: bool = False
+    air_pump_activation: bool = True
+    hardware_backend: str = "hardware"  # 'hardware' or 'simulated' (see 'simulator.py')
+    metrics_port: int = 0  # TCP port of the metrics endpoint, 0 = disabled (see 'exporter.py')
+    metrics_address: str = "127.0.0.1"
+    capture_bus_traffic: bool = False  # see 'capture.py'
+
+
+class CO2Settings(NamedTuple):
+    activation: bool = True
+    sampling_period: int = 0  # seconds, 0 = read once per sampling cycle
+    automatic_sampling_frequency: int = 1  # number of samples during the sampling period
+    measurement_delay: int = 10  # seconds
+    store_debug_messages: bool = False
+    max_attempts: int = 3
+
+
+class OPCN3Settings(NamedTuple):
+    activation: bool = True
+    flushing_time: int = 4  # seconds
+    sampling_time: int = 4  # seconds
+    fan_speed: int = 100  # 0 = the slowest, 100 = the fastest
+    take_new_sample_if_checksum_is_wrong: bool = True
+    streaming_period: int = 0  # seconds, 0 = fan and laser switched on and off at each sampling cycle
+    recovery_budget: int = 10  # seconds spent to recover from the SPI errors during one sampling cycle
+    store_debug_messages: bool = False
+
+
+class FlowSettings(NamedTuple):
+    activation: bool = True
+    OPCN3_flow_measurement: bool = True
+    sampling_period: int = 0  # seconds, 0 = read once per sampling cycle
+    store_debug_messages: bool = False
+
+
+class GPSSettings(NamedTuple):
+    activation: bool = True
+    sampling_period: int = 0  # seconds, 0 = read once per sampling cycle
+    store_debug_messages: bool = False
+
+
+class AFESettings(NamedTuple):
+    activation: bool = True
+    sampling_period: int = 0  # seconds, 0 = read once per sampling cycle
+    store_debug_messages: bool = False
+    readings_averaged: int = 4
+
+
+class Settings(NamedTuple):
+    seacanairy: SeacanairySettings
+    CO2: CO2Settings
+    OPCN3: OPCN3Settings
+    flow: FlowSettings
+    GPS: GPSSettings
+    AFE: AFESettings
+
+
+# For each section: (name of the section in the yaml file, class, {key in the yaml file: setting})
+schema = {
+    "seacanairy": ("Seacanairy settings", SeacanairySettings, {
+        "Sampling session name": "session_name",
+        "Sampling period": "sampling_period",
+        "Flushing time before measurement": "piping_flushing_time",
+        "Align sampling on the clock": "align_on_clock",
+        "Overrun policy": "overrun_policy",
+        "Write aligned cycle row (-data.csv)": "write_cycle_row",
+        "Data storage backend": "data_backend",
+        "Rows kept in memory before writing (-data.csv)": "data_flush_rows",
+        "Maximal time before writing (-data.csv)": "data_flush_interval",
+        "Force writing on the SD card (fsync)": "data_fsync",
+        "Journal of the rows kept in memory (-data.journal)": "data_journal",
+        "Rotate the data and log files": "rotation_policy",
+        "Maximal size of the data and log files (MB)": "rotation_size",
+        "Compression of the rotated files": "rotation_compression",
+        "Write cycle metrics (-metrics.csv)": "write_metrics",
+        "Pipelined sampling cycles": "pipelined_cycles",
+        "Activate M&C air pump": "air_pump_activation",
+        "Hardware backend": "hardware_backend",
+        "Metrics endpoint port": "metrics_port",
+        "Metrics endpoint address": "metrics_address",
+        "Capture raw bus traffic (-capture.bin)": "capture_bus_traffic"
+    }),
+    "CO2": ("CO2 sensor", CO2Settings, {
+        "Activate this sensor": "activation",
+        "Sampling period": "sampling_period",
+        "Automatic sampling frequency (number of sample during the above sampling period)":
+            "automatic_sampling_frequency",
+        "Amount of time required for the sensor to take the measurement": "measurement_delay",
+        "Store debug messages (important increase of logs)": "store_debug_messages",
+        "Number of reading attempts": "max_attempts"
+    }),
+    "OPCN3": ("OPC-N3 sensor", OPCN3Settings, {
+        "Activate this sensor": "activation",
+        "Flushing time": "flushing_time",
+        "Sampling time": "sampling_time",
+        "Fan speed": "fan_speed",
+        "Take a new measurement if checksum is wrong (avoid shorter sampling periods when errors)":
+            "take_new_sample_if_checksum_is_wrong",
+        "Streaming period (fan and laser kept on)": "streaming_period",
+        "Time budget of the error recovery (seconds per measurement)": "recovery_budget",
+        "Store debug messages (important increase of logs)": "store_debug_messages"
+    }),
+    "flow": ("Air flow sensor", FlowSettings, {
+        "Activate this sensor": "activation",
+        "Measure during OPCN3 measurement": "OPCN3_flow_measurement",
+        "Sampling period": "sampling_period",
+        "Store debug messages (important increase of logs)": "store_debug_messages"
+    }),
+    "GPS": ("GPS", GPSSettings, {
+        "Activate this sensor": "activation",
+        "Sampling period": "sampling_period",
+        "Store debug messages (important increase of logs)": "store_debug_messages"
+    }),
+    "AFE": ("AFE Board", AFESettings, {
+        "Activate this sensor": "activation",
+        "Sampling period": "sampling_period",
+        "Store debug messages (important increase of logs)": "store_debug_messages",
+        "Noise reduction - number of reading averaged": "readings_averaged"
+    })
+}
+
+# Smallest value of the integer settings {(section, setting): minimum}, checked by 'parse()'
+minimums = {
+    ("seacanairy", "sampling_period"): 1,
+    ("seacanairy", "piping_flushing_time"): 0,
+    ("seacanairy", "data_flush_rows"): 1,
+    ("seacanairy", "data_flush_interval"): 0,
+    ("seacanairy", "rotation_size"): 1,
+    ("seacanairy", "metrics_port"): 0,
+    ("CO2", "sampling_period"): 0,
+    ("CO2", "automatic_sampling_frequency"): 1,
+    ("CO2", "measurement_delay"): 0,
+    ("CO2", "max_attempts"): 1,
+    ("OPCN3", "flushing_time"): 0,
+    ("OPCN3", "sampling_time"): 1,
+    ("OPCN3", "fan_speed"): 0,
+    ("OPCN3", "streaming_period"): 0,
+    ("OPCN3", "recovery_budget"): 0,
+    ("flow", "sampling_period"): 0,
+    ("GPS", "sampling_period"): 0,
+    ("AFE", "sampling_period"): 0,
+    ("AFE", "readings_averaged"): 1
+}
+
+# ---------------------------------------------------------------------
+# LOADING
+# ---------------------------------------------------------------------
+
+current = None  # last settings loaded
+modification_time = None  # modification time of the file when 'current' has been loaded
+
+
+def check(section, key, value, expected_type):
+    """
+    Check the type of a setting
+    :param section: name of the section in the yaml file
+    :param key: name of the setting in the yaml file
+    :param value: value read in the yaml file
+    :param expected_type: bool, int or str
+    :return: value
+    """
+    # Yes/No are read as booleans, and a boolean is also an integer for Python
+    if (expected_type is int and isinstance(value, bool)) or not isinstance(value, expected_type):
+        raise ValueError("'" + str(key) + "' in '" + str(section) + "' of '" + file_path + "' must be " +
+                         {bool: "Yes or No", int: "an integer", str: "a text"}[expected_type] +
+                         ", not '" + str(value) + "'")
+    return value
+
+
+def parse(content):
+    """
+    Convert the content of the yaml file in a settings object, missing settings take their default value
+    The types and the ranges of the values are checked (ValueError)
+    :param content: dictionary returned by 'yaml.safe_load()'
+    :return: Settings
+    """
+    sections = {}
+    for attribute in schema:
+        section, section_class, keys = schema[attribute]
+        values = {}
+        given = (content or {}).get(section) or {}
+        for key in given:
+            if key not in keys:
+                logger.warning("Unknown setting '" + str(key) + "' in '" + str(section) + "', ignored")
+                continue
+            setting = keys[key]
+            values[setting] = check(section, key, given[key], section_class.__annotations__[setting])
+        for key in keys:
+            if key not in given:
+                logger.warning("'" + str(key) + "' missing in '" + str(section) + "', default value is used (" +
+                               str(section_class._field_defaults[keys[key]]) + ")")
+        sections[attribute] = section_class(**values)
+
+    settings = Settings(**sections)
+    for section, setting in minimums:
+        if getattr(getattr(settings, section), setting) < minimums[(section, setting)]:
+            raise ValueError(name(section, setting) + " must be at least " + str(minimums[(section, setting)]) +
+                             ", not '" + str(getattr(getattr(settings, section), setting)) + "'")
+    if settings.seacanairy.overrun_policy not in scheduler.policies:
+        raise ValueError("'Overrun policy' must be one of " + str(scheduler.policies) + ", not '" +
+                         str(settings.seacanairy.overrun_policy) + "'")
+    if settings.seacanairy.data_backend not in streams.data_backends:
+        raise ValueError("'Data storage backend' must be one of " + str(streams.data_backends) + ", not '" +
+                         str(settings.seacanairy.data_backend) + "'")
+    if settings.seacanairy.data_fsync not in streams.fsync_policies:
+        raise ValueError("'Force writing on the SD card (fsync)' must be one of " + str(streams.fsync_policies) +
+                         ", not '" + str(settings.seacanairy.data_fsync) + "'")
+    if settings.seacanairy.rotation_policy not in rotation.policies:
+        raise ValueError("'Rotate the data and log files' must be one of " + str(rotation.policies) + ", not '" +
+                         str(settings.seacanairy.rotation_policy) + "'")
+    if settings.seacanairy.rotation_compression not in rotation.compressions:
+        raise ValueError("'Compression of the rotated files' must be one of " + str(rotation.compressions) +
+                         ", not '" + str(settings.seacanairy.rotation_compression) + "'")
+    if settings.seacanairy.hardware_backend not in backends:
+        raise ValueError("'Hardware backend' must be one of " + str(backends) + ", not '" +
+                         str(settings.seacanairy.hardware_backend) + "'")
+    if settings.seacanairy.metrics_port > 65535:
+        raise ValueError("'Metrics endpoint port' must be a number between 0 (disabled) and 65535")
+    if settings.OPCN3.fan_speed > 100:
+        raise ValueError("'Fan speed' of the OPC-N3 must be a number between 0 and 100")
+    return settings
+
+
+def changed():
+    """
+    :return: True if the file has been modified since the last loading
+    """
+    return os.path.getmtime(file_path) != modification_time
+
+
+def load():
+    """
+    Read and check the settings file, only if it has not been read yet or if it has been modified
+    :return: Settings (see 'Settings')
+    """
+    global current, modification_time
+
+    if current is None or changed():
+        mtime = os.path.getmtime(file_path)
+        with open(file_path) as file:
+            current = parse(yaml.safe_load(file))
+        modification_time = mtime
+        logger.debug("Settings loaded from '" + file_path + "'")
+
+    return current
+
+
+def reload():
+    """
+    Read the settings file again if it has been modified (called at each sampling cycle, see 'seacanairy.py')
+    If the new file is not valid, the error is logged and the current settings are kept until the next modification
+    :return: List[changes] (see 'differences()'), empty if nothing changed
+    """
+    global modification_time
+
+    try:
+        if not changed():
+            return []
+    except OSError:  # file being replaced
+        return []
+
+    previous = current
+    try:
+        new = load()
+    except Exception:
+        try:
+            modification_time = os.path.getmtime(file_path)  # don't try again before the next modification
+        except OSError:  # file being replaced, read again at the next cycle
+            pass
+        logger.error("Settings file modified but not valid, settings not changed (" + str(sys.exc_info()[1]) + ")")
+        return []
+
+    changes = differences(previous, new)
+    if not changes:
+        logger.info("Settings file modified, no setting changed")
+    return changes
+
+
+def differences(old, new):
+    """
+    Compare two settings objects
+    :param old: Settings
+    :param new: Settings
+    :return: List[(section, setting, old value, new value)] (f-e ("OPCN3", "fan_speed", 100, 80))
+    """
+    changes = []
+    for section in Settings._fields:
+        old_section = getattr(old, section)
+        new_section = getattr(new, section)
+        for setting in old_section._fields:
+            if getattr(old_section, setting) != getattr(new_section, setting):
+                changes.append((section, setting, getattr(old_section, setting), getattr(new_section, setting)))
+    return changes
+
+
+def name(section, setting):
+    """
+    :param section: attribute of the section (f-e "OPCN3")
+    :param setting: attribute of the setting (f-e "fan_speed")
+    :return: name of the setting in the yaml file (f-e "'Fan speed' of 'OPC-N3 sensor'")
+    """
+    section_name, section_class, keys = schema[section]
+    for key in keys:
+        if keys[key] == setting:
+            return "'" + key + "' of '" + section_name + "'"
+    return "'" + setting + "' of '" + section_name + "'"
@@ -0,0 +1,281 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+SQLite storage of the sampling session: <Sampling session name>/<Sampling session name>-data.sqlite
+(see 'Data storage backend' in the settings)
+One table per group of sensors, one line per sampling cycle, indexed on the time of the cycle:
+    - OPC (OPC-N3, streaming of the OPC-N3 and flow of the OPC-N3), AFE, flow (flow meter), GPS, CO2
+    - cycles: overruns and jitter of the scheduler
+The "error" values are stored as NULL, the time as seconds since epoch ('time' column, UTC)
+The sampling cycles kept in memory are inserted in one transaction (see 'Rows kept in memory before writing' in the
+settings), the database is in WAL mode so that it can be read while the Seacanairy is writing (f-e by 'query' below)
+
+Query (time range and columns, result in csv):
+    python3 database.py <session folder or file> --tables
+    python3 database.py <session folder or file> OPC --start "2026-10-18 14:00" --end "2026-10-18 15:00"
+                        --column "PM 1 (μg/m³)" --column "PM 10 (μg/m³)" [--output port_call.csv]
+"""
+
+import argparse
+import csv  # for storing data in file
+import glob
+import logging
+import os  # to be able to create new files/folders
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import streams  # columns of the sensors, typed values
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Database'
+logger = logging.getLogger('Database')
+
+# Table of each sensor (see 'streams.columns')
+tables = {
+    "OPC-N3": "OPC",
+    "OPC-N3 stream": "OPC",
+    "OPC flow": "OPC",
+    "AFE": "AFE",
+    "flow meter": "flow",
+    "GPS": "GPS",
+    "CO2": "CO2"
+}
+
+cycles_table = "cycles"  # counters of the scheduler (see 'streams.scheduler_columns')
+
+extension = "-data.sqlite"
+
+
+def quote(name):
+    """
+    :param name: name of a table or a column (f-e "PM 1 (μg/m³)")
+    :return: name usable in an SQL statement
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def columns(table):
+    """
+    :param table: name of the table
+    :return: List[headers of the columns of the table declared by the drivers (see 'streams.register()')]
+    """
+    if table == cycles_table:
+        return list(streams.scheduler_columns)
+    return [name for sensor in streams.columns if tables[sensor] == table for name in streams.header(sensor)]
+
+
+def sql_type(column):
+    """
+    :param column: header of the column
+    :return: type of the column in SQLite
+    """
+    return "TEXT" if streams.kind(column) == "text" else "REAL"
+
+
+class SessionDatabase:
+    """
+    <Sampling session name>-data.sqlite file, same usage as the other storage backends (see 'streams.BufferedCSV')
+    """
+
+    def __init__(self, directory_path, project_name, flush_rows=1, flush_interval=0, fsync_policy="never"):
+        """
+        :param directory_path: folder of the sampling session
+        :param project_name: name of the sampling session
+        :param flush_rows: sampling cycles are inserted when this number of cycles is kept in memory
+        :param flush_interval: Optional: sampling cycles are inserted when the oldest one is kept since this amount
+                               of seconds (checked when a cycle is added), 0 = no limit
+        :param fsync_policy: see 'streams.fsync_policies' ('flush' = the cycles are on the SD card as soon as they
+                             are inserted, otherwise at the checkpoints of the WAL file)
+        """
+        self.file = directory_path + "/" + str(project_name) + extension
+        if not os.path.isfile(self.file):
+            logger.info("Initializing data file " + self.file)
+        self.connection = sqlite3.connect(self.file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.cycles = []  # sampling cycles kept in memory [(slot, {table: {column: value}})]
+        self.oldest = None  # time at which the oldest cycle kept in memory has been added
+        self.configure(flush_rows, flush_interval, fsync_policy)
+        self.created = set()  # tables created or updated with the columns of the drivers imported
+        with self.connection:
+            for table in sorted(set(tables[sensor] for sensor in streams.columns)) + [cycles_table]:
+                self.create(table)
+
+    def configure(self, flush_rows, flush_interval, fsync_policy):
+        """
+        Change when the sampling cycles are inserted (see '__init__()'), the cycles kept in memory are not lost
+        :return: nothing
+        """
+        if fsync_policy not in streams.fsync_policies:
+            raise ValueError("fsync policy must be one of " + str(streams.fsync_policies) + ", not '" +
+                             str(fsync_policy) + "'")
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.connection.execute("PRAGMA synchronous=" + ("FULL" if fsync_policy == "flush" else "NORMAL"))
+
+    def create(self, table):
+        """
+        Create the table and its time index if they don't exist, add the columns missing in an older file
+        (only the columns of the drivers imported, the others are added when the sensor is activated)
+        :param table: name of the table
+        :return: nothing
+        """
+        self.created.add(table)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS " + quote(table) + " (time REAL NOT NULL, " +
+                                ", ".join(quote(column) + " " + sql_type(column) for column in columns(table)) + ")")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS " + quote(table + "_time") + " ON " + quote(table) +
+                                " (time)")
+        existing = [line[1] for line in self.connection.execute("PRAGMA table_info(" + quote(table) + ")")]
+        for column in columns(table):
+            if column not in existing:
+                self.connection.execute("ALTER TABLE " + quote(table) + " ADD COLUMN " + quote(column) + " " +
+                                        sql_type(column))
+
+    def append(self, slot, to_write, scheduler_data):
+        """
+        Add the lines of one sampling cycle, inserted with the others when there are enough cycles or when the oldest
+        one is too old
+        :param slot: time of the slot of the cycle ('time.time()' format)
+        :param to_write: Dictionary{sensor: values of its columns} of the sensors read during the cycle
+        :param scheduler_data: values of 'streams.scheduler_columns'
+        :return: nothing
+        """
+        lines = {}  # {table: {column: value}}
+        for sensor in to_write:
+            line = lines.setdefault(tables[sensor], {})
+            for column, value in zip(streams.header(sensor), to_write[sensor]):
+                line[column] = streams.convert(value, streams.kind(column))
+        lines[cycles_table] = dict(zip(streams.scheduler_columns, scheduler_data))
+        if not self.cycles:
+            self.oldest = time.monotonic()
+        self.cycles.append((slot, lines))
+        if len(self.cycles) >= self.flush_rows or \
+                (self.flush_interval > 0 and time.monotonic() - self.oldest >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the sampling cycles kept in memory in one transaction
+        :return: nothing
+        """
+        if not self.cycles:
+            return
+        with self.connection:
+            for slot, lines in self.cycles:
+                for table in lines:
+                    if table not in self.created:  # sensor activated while running
+                        self.create(table)
+                    names = ", ".join(quote(name) for name in ["time"] + list(lines[table]))
+                    self.connection.execute("INSERT INTO " + quote(table) + " (" + names + ") VALUES (" +
+                                            ", ".join("?" * (len(lines[table]) + 1)) + ")",
+                                            [slot] + list(lines[table].values()))
+        self.cycles = []
+
+    def close(self):
+        """
+        Close the database, can be called several times
+        :return: nothing
+        """
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+
+# ---------------------------------------------------------------------
+# QUERY
+# ---------------------------------------------------------------------
+
+
+def find(path):
+    """
+    :param path: session folder or -data.sqlite file
+    :return: path of the -data.sqlite file
+    """
+    if os.path.isdir(path):
+        files = glob.glob(os.path.join(path, "*" + extension))
+        if len(files) != 1:
+            raise FileNotFoundError("No single *" + extension + " file in '" + str(path) + "'")
+        return files[0]
+    return path
+
+
+def timestamp(text):
+    """
+    :param text: local date and time, f-e "2026-10-18 14:00" or "18-10-2026 14:00:00"
+    :return: seconds since epoch
+    """
+    for date_format in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", streams.date_format, "%d-%m-%Y %H:%M"]:
+        try:
+            return datetime.strptime(text, date_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format '" + str(text) + "' (f-e 2026-10-18 14:00)")
+
+
+def query(file, table, selected=None, start=None, end=None):
+    """
+    :param file: -data.sqlite file
+    :param table: name of the table (f-e "OPC")
+    :param selected: Optional: List[columns], all of them by default
+    :param start: Optional: seconds since epoch, included
+    :param end: Optional: seconds since epoch, excluded
+    :return: (List[headers], cursor of the lines), the first column is the local date and time
+    """
+    connection = sqlite3.connect("file:" + file + "?mode=ro", uri=True)
+    existing = [line[1] for line in connection.execute("PRAGMA table_info(" + quote(table) + ")")]
+    if not existing:
+        raise ValueError("No table '" + str(table) + "' in '" + str(file) + "'")
+    selected = selected or [column for column in existing if column != "time"]
+    for column in selected:
+        if column not in existing:
+            raise ValueError("No column '" + str(column) + "' in table '" + str(table) + "'")
+    conditions = []
+    parameters = []
+    if start is not None:
+        conditions.append("time >= ?")
+        parameters.append(start)
+    if end is not None:
+        conditions.append("time < ?")
+        parameters.append(end)
+    statement = "SELECT datetime(time, 'unixepoch', 'localtime'), " + \
+        ", ".join(quote(column) for column in selected) + " FROM " + quote(table) + \
+        (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY time"
+    return ["Date/Time"] + selected, connection.execute(statement, parameters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select a time range and columns of a Seacanairy session database")
+    parser.add_argument("path", help="session folder or -data.sqlite file")
+    parser.add_argument("table", nargs="?", default=None,
+                        help="OPC, AFE, flow, GPS, CO2 or cycles (see --tables)")
+    parser.add_argument("--tables", action="store_true", help="list the tables and their columns")
+    parser.add_argument("--column", action="append", default=None, help="column to select (default: all)")
+    parser.add_argument("--start", default=None, help="local date and time, f-e '2026-10-18 14:00'")
+    parser.add_argument("--end", default=None, help="local date and time, excluded")
+    parser.add_argument("--output", default=None, help="csv file (default: on the screen)")
+    arguments = parser.parse_args()
+
+    file = find(arguments.path)
+    if arguments.tables or arguments.table is None:
+        connection = sqlite3.connect("file:" + file + "?mode=ro", uri=True)
+        for (table,) in connection.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"):
+            count = connection.execute("SELECT COUNT(*) FROM " + quote(table)).fetchone()[0]
+            print(table, "(" + str(count) + " lines):")
+            for line in connection.execute("PRAGMA table_info(" + quote(table) + ")"):
+                print("   ", line[1])
+        return
+
+    header, lines = query(file, arguments.table, arguments.column,
+                          timestamp(arguments.start) if arguments.start else None,
+                          timestamp(arguments.end) if arguments.end else None)
+    output = open(arguments.output, mode='w', newline='') if arguments.output else sys.stdout
+    writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(header)
+    writer.writerows(["error" if value is None else value for value in line] for line in lines)
+    if arguments.output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,591 @@
+"""
+Acquisition engine of the Seacanairy based on asyncio
+Each sensor is read by its own coroutine, all the coroutines of a sampling cycle run at the same time
+The SPI and UART buses are protected by an awaitable lock, the I²C transactions are serialized by 'i2c_bus.py'
+The blocking spidev/smbus2/pyserial calls are executed in a thread pool, so that the waiting times
+(OPC-N3 sampling, CO2 measurement, GPS synchronization...) let the other sensors use their bus
+"""
+
+import asyncio
+import contextvars
+import time
+import logging  # save logger messages into memory
+import sys
+
+import scheduler  # start the readings on the slots of the clock
+import metrics  # retries, checksum failures and back-off of each stage of the cycle
+import recovery  # strategies of the error recovery of the OPC-N3
+
+# ---------------------------------------------------------------------
+# BUSES
+# ---------------------------------------------------------------------
+# Physical bus used by each sensor
+
+SPI = "SPI0.0"  # OPC-N3
+I2C = "I2C bus 1"  # CO2 sensor, AFE board (ADC) and flow meter
+UART = "/dev/ttyAMA0"  # GPS
+
+bus_locks = {}  # {bus: asyncio.Lock()}, created by 'initialize()'
+# No lock for the I²C bus, each transaction waits for the bus in 'i2c_bus.py' (not the whole sensor reading)
+
+# Duration of each sensor coroutine during the current sampling cycle {name: seconds}
+durations = {}
+
+# Last reading of the sensors having their own sampling period {name: (time of the reading, data)}
+latest = {}
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Engine'
+logger = logging.getLogger('Engine')
+
+
+def initialize():
+    """
+    Create the bus locks
+    Must be called from inside the running event loop (asyncio locks are attached to the loop)
+    :return: nothing
+    """
+    for bus in [SPI, UART]:
+        bus_locks[bus] = asyncio.Lock()
+
+
+async def run_blocking(bus, function, *args):
+    """
+    Execute a blocking driver function in the thread pool while keeping the bus for itself
+    :param bus: bus used by the function (SPI, I2C or UART)
+    :param function: function to execute
+    :param args: arguments of the function
+    :return: what the function returns
+    """
+    # the function is executed in the context of the coroutine, its metrics go to the right stage of the cycle
+    context = contextvars.copy_context()
+    if bus not in bus_locks:  # I²C, see 'i2c_bus.py'
+        return await asyncio.get_running_loop().run_in_executor(None, context.run, function, *args)
+    async with bus_locks[bus]:
+        future = asyncio.get_running_loop().run_in_executor(None, context.run, function, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the thread can't be stopped: the bus is kept until the function is finished,
+            # so that a shutdown function (see 'shut_down()') doesn't use the bus at the same time
+            while not future.done():
+                try:
+                    await asyncio.wait([future])
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+
+async def shut_down(bus, function):
+    """
+    Execute a blocking driver function when a coroutine is cancelled (f-e 'OPCN3.laser_off'), in the thread pool and
+    under the lock of the bus like the readings (the reading being executed is finished first)
+    The function is not cancelled by the cancellation of the coroutine
+    :param bus: bus used by the function (SPI, I2C or UART)
+    :param function: function to execute
+    :return: what the function returns
+    """
+    return await asyncio.shield(run_blocking(bus, function))
+
+
+async def wait(message, delay):
+    """
+    Wait without blocking the other sensors (replace the 'loading_bar()' of the drivers)
+    :param message: Text to be shown on the screen
+    :param delay: Amount of time to wait (seconds)
+    :return: nothing
+    """
+    print(message + " (" + str(delay) + " seconds)...", end='\r')
+    await asyncio.sleep(delay)
+
+
+async def timed(name, coroutine, cycle_durations=None, cycle_metrics=None):
+    """
+    Execute a sensor coroutine and keep a trace of its duration
+    :param name: name of the sensor
+    :param coroutine: coroutine to execute (f-e 'read_GPS()')
+    :param cycle_durations: Optional: durations of the cycle (see 'new_cycle()'), those of the last cycle by default
+    :param cycle_metrics: Optional: Dictionary in which the start, the end and the counters of the drivers
+                            (see 'metrics.py') are stored {name: {"start", "end", counter: value}}
+    :return: what the coroutine returns
+    """
+    if cycle_durations is None:
+        cycle_durations = durations
+    counters = {}
+    token = metrics.current.set(counters)  # the drivers called by the coroutine count in 'counters'
+    started = time.time()
+    try:
+        return await coroutine
+    finally:
+        ended = time.time()
+        metrics.current.reset(token)
+        cycle_durations[name] = ended - started
+        if cycle_metrics is not None:
+            cycle_metrics[name] = {"start": started, "end": ended, **counters}
+
+
+def new_cycle():
+    """
+    New durations at the beginning of a sampling cycle
+    Two cycles can run at the same time (pipelined cycles), each one has its own durations
+    :return: Dictionary in which the durations of the cycle are stored {name: seconds}
+    """
+    global durations
+    durations = {}
+    return durations
+
+
+def report(starting_time, cycle_durations=None):
+    """
+    Compare the wall time of the cycle with the time it would have taken to read the sensors one after the other
+    :param starting_time: 'time.time()' at which the sensors started to be read
+    :param cycle_durations: Optional: durations of the cycle (see 'new_cycle()'), those of the last cycle by default
+    :return: Dictionary{"sequential", "concurrent", "saved"} (seconds)
+    """
+    if cycle_durations is None:
+        cycle_durations = durations
+    sequential = sum(cycle_durations.values())
+    concurrent = time.time() - starting_time
+    saved = sequential - concurrent
+
+    details = ""
+    for name in cycle_durations:
+        details += " " + str(name) + ": " + str(round(cycle_durations[name], 1)) + "s |"
+    logger.debug("Duration of the sensors:" + details[:-2])
+    logger.info("Sensors read in " + str(round(concurrent, 1)) + " seconds instead of " +
+                str(round(sequential, 1)) + " seconds one after the other (saved " + str(round(saved, 1)) +
+                " seconds)")
+
+    return {
+        "sequential": sequential,
+        "concurrent": concurrent,
+        "saved": saved
+    }
+
+
+# ---------------------------------------------------------------------
+# MULTI-RATE
+# ---------------------------------------------------------------------
+# Sensors having their own sampling period are read in their own loop, independently of the sampling cycle
+
+
+async def sensor_loop(name, period, read, stream=None, align=True, stop=None):
+    """
+    Read a sensor at its own sampling period, forever
+    Each reading is stored in the dedicated file of the sensor and kept in 'latest' for the cycle row
+    :param name: name of the sensor
+    :param period: sampling period of the sensor (seconds)
+    :param read: function returning the coroutine which reads the sensor (f-e 'read_flow')
+    :param stream: Optional: 'rotation.SensorStream' in which each reading is stored
+    :param align: start the readings on the multiples of the period on the clock (see 'scheduler.py')
+    :param stop: Optional: (bus, function) executed when the loop is cancelled (f-e (UART, close_GPS)),
+                    see 'shut_down()'
+    :return: never
+    """
+    sensor_scheduler = scheduler.DeadlineScheduler(period, align, scheduler.SKIP, verbose=False)
+    logger.info(str(name) + " is read every " + str(period) + " seconds")
+    try:
+        while True:
+            slot = await sensor_scheduler.wait()
+            try:
+                data = await when_ready(name, read())
+            except Exception:
+                # avoid that the loop stops forever because of one failed reading
+                logger.critical("Failed to read " + str(name) + " (" + str(sys.exc_info()) + ")")
+                continue
+            latest[name] = (slot, data)
+            if stream is not None:
+                stream.append(slot, data)
+    finally:
+        latest.pop(name, None)  # the last reading is not updated anymore
+        if stop is not None:
+            await shut_down(*stop)
+
+
+def latest_data(name, default):
+    """
+    Get the last reading of a sensor having its own sampling period
+    :param name: name of the sensor
+    :param default: value returned if the sensor has not been read yet
+    :return: data returned by the last reading
+    """
+    if name not in latest:
+        logger.warning(str(name) + " has not been read yet")
+        return default
+    return latest[name][1]
+
+
+# ---------------------------------------------------------------------
+# STARTUP
+# ---------------------------------------------------------------------
+# The sensors are initialized at the same time, each sensor is read as soon as its own initialization is finished
+
+ready = {}  # {name: asyncio.Event()} set when the initialization of the sensor is finished (succeeded or not)
+
+startup_durations = {}  # Duration of the initialization of each sensor {name: seconds}
+
+
+def start_initialization(initializations):
+    """
+    Start the initialization of all the sensors at the same time
+    Must be called from inside the running event loop
+    :param initializations: Dictionary{name of the sensor: initialization coroutine (f-e 'initialize_OPCN3(100)')}
+    :return: task finishing when all the sensors are initialized (see 'startup_report()')
+    """
+    starting_time = time.time()
+    tasks = []
+    for name in initializations:
+        ready[name] = asyncio.Event()
+        tasks.append(asyncio.ensure_future(initialize_sensor(name, initializations[name])))
+
+    async def report():
+        await asyncio.gather(*tasks)
+        return startup_report(starting_time)
+
+    return asyncio.ensure_future(report())
+
+
+async def initialize_sensor(name, coroutine):
+    """
+    Execute the initialization coroutine of a sensor and indicate that the sensor is ready
+    A failed initialization doesn't prevent the sensor to be read (as before, the reading will show the errors)
+    :param name: name of the sensor
+    :param coroutine: initialization coroutine
+    :return: nothing
+    """
+    started = time.time()
+    try:
+        await coroutine
+    except Exception:
+        logger.critical("Failed to initialize " + str(name) + " (" + str(sys.exc_info()) + ")")
+    finally:
+        startup_durations[name] = time.time() - started
+        ready[name].set()
+
+
+async def when_ready(name, coroutine):
+    """
+    Wait for the end of the initialization of a sensor before executing a coroutine
+    :param name: name of the sensor
+    :param coroutine: coroutine to execute (f-e 'read_CO2(10)')
+    :return: what the coroutine returns
+    """
+    if name in ready and not ready[name].is_set():
+        logger.debug("Waiting for the end of the initialization of " + str(name))
+        await ready[name].wait()
+    return await coroutine
+
+
+def startup_report(starting_time):
+    """
+    Log the duration of the initialization of each sensor
+    :param starting_time: 'time.time()' at which the initializations started
+    :return: Dictionary{name of the sensor: seconds}
+    """
+    details = ""
+    for name in startup_durations:
+        details += " " + str(name) + ": " + str(round(startup_durations[name], 1)) + "s |"
+    logger.info("Sensors initialized in " + str(round(time.time() - starting_time, 1)) + " seconds instead of " +
+                str(round(sum(startup_durations.values()), 1)) + " seconds one after the other (" +
+                details[1:-2] + ")")
+    return dict(startup_durations)
+
+
+async def initialize_CO2(sampling_period):
+    """
+    Set the internal timestamp of the CO2 sensor and synchronize its measurements with the Seacanairy
+    Same as 'CO2.internal_timestamp()' followed by 'CO2.trigger_measurement(True)', the sampling is awaited
+    :param sampling_period: internal sampling period of the sensor (seconds)
+    :return: nothing
+    """
+    import CO2
+
+    # Read the internal timestamp of the CO2 sensor, and change the value if necessary
+    if sampling_period != await run_blocking(I2C, CO2.internal_timestamp):
+        await run_blocking(I2C, CO2.internal_timestamp, sampling_period)
+
+    # The sensor will not take a new sample if the previous one is older than 10 seconds,
+    # trigger twice to be sure that the sensor starts a new measurement right now (see 'CO2.trigger_measurement()')
+    print("Synchronizing CO2 sensor with Seacanairy sampling period")
+    await run_blocking(I2C, CO2.status, False)
+    if CO2.measurement_delay != 0:
+        await wait("Waiting for CO2 sensor sampling", CO2.measurement_delay)
+        await run_blocking(I2C, CO2.status, False)
+        await wait("Waiting for CO2 sensor sampling", CO2.measurement_delay)
+
+
+async def initialize_OPCN3(fan_speed):
+    """
+    Start the SPI communication of the OPC-N3 (the first communication is always lost) and set the fan speed
+    :param fan_speed: speed of the fan (0 = slowest, 100 = fastest)
+    :return: nothing
+    """
+    import OPCN3
+
+    await run_blocking(SPI, OPCN3.initialization_SPI)
+    await run_blocking(SPI, OPCN3.set_fan_speed, fan_speed)
+
+
+# ---------------------------------------------------------------------
+# SENSOR COROUTINES
+# ---------------------------------------------------------------------
+# The drivers are imported inside the coroutines, they are only imported by seacanairy.py if they are activated
+
+
+async def read_OPCN3(flushing_time, sampling_time):
+    """
+    Same as 'OPCN3.get_data()', the flushing and the sampling are awaited instead of blocking
+    :param flushing_time: time during which the ventilator is running without sampling
+    :param sampling_time: time during which the sensor is sampling
+    :return: Dictionary (see 'OPCN3.get_data()')
+    """
+    import OPCN3
+
+    to_return = OPCN3.error_histogram()
+    OPCN3.SPI_recovery.new_cycle()
+    try:
+        if await run_blocking(SPI, OPCN3.fan_on):
+            await wait("Flushing fresh air in the OPC-N3", flushing_time / 2)
+            if await run_blocking(SPI, OPCN3.laser_on):
+                await wait("Flushing fresh air in the OPC-N3", flushing_time / 2)
+                to_return = await read_OPCN3_histogram(sampling_time)
+            else:
+                OPCN3.logger.critical("Skipping histogram reading")
+            await run_blocking(SPI, OPCN3.laser_off)
+        else:
+            OPCN3.logger.critical("Skipping histogram reading")
+        await run_blocking(SPI, OPCN3.fan_off)
+        return to_return
+
+    except (asyncio.CancelledError, KeyboardInterrupt, SystemExit):
+        # Avoid that the laser and the fan keep running indefinitely if the software is stopped
+        OPCN3.logger.info("Python instance has been stopped, shutting laser and fan OFF...")
+        await shut_down(SPI, OPCN3.laser_off)
+        await shut_down(SPI, OPCN3.fan_off)
+        raise
+
+
+async def read_OPCN3_histogram(sampling_period):
+    """
+    Same as 'OPCN3.read_histogram()', the sampling period is awaited instead of blocking
+    :param sampling_period: amount of time (seconds) during which the laser is sampling
+    :return: Dictionary (see 'OPCN3.read_histogram()')
+    """
+    import OPCN3
+
+    # Delete old histogram data and start a new one
+    if not await run_blocking(SPI, OPCN3.reset_histogram):
+        return OPCN3.error_histogram()
+
+    delay = sampling_period * 2  # low gain then high gain (see 'OPCN3.read_histogram()')
+
+    await wait("Sampling PM", delay)
+
+    while True:
+        reading = await run_blocking(SPI, OPCN3.fetch_histogram, sampling_period)
+        histogram, strategy, pause = OPCN3.frame_step(reading, delay)
+        if histogram is not None:
+            return histogram
+        if strategy == recovery.RESAMPLE:
+            await wait("Sampling PM", pause)
+        elif pause > 0:
+            await wait("Waiting before reading the histogram again", pause)
+            metrics.count("OPC-N3", metrics.BACKOFF, pause)
+
+
+# OPC-N3 streaming: the fan and the laser are kept on, a histogram is read at each period of the loop of the sensor
+# (see 'sensor_loop()') and kept until the sampling cycle takes them (see 'take_OPCN3_stream()')
+
+OPC_streaming = False  # True when the fan and the laser are kept on
+OPC_streamed = []  # histograms read since the previous sampling cycle
+
+
+async def read_OPCN3_stream(period):
+    """
+    Read the histogram of the last period, the fan and the laser are started at the first reading and kept on
+    :param period: streaming period (seconds), amount of time sampled by each histogram
+    :return: Dictionary (see 'OPCN3.fetch_histogram()'), "error" everywhere if the reading failed
+    """
+    import OPCN3
+    global OPC_streaming
+
+    if not OPC_streaming:
+        OPC_streaming = await run_blocking(SPI, OPCN3.fan_on)
+        if not OPC_streaming:
+            OPCN3.logger.critical("Failed to start the fan, streaming not started")
+            return OPCN3.error_histogram()
+        if not await run_blocking(SPI, OPCN3.laser_on):
+            OPCN3.logger.critical("Failed to start the laser, streaming not started")
+            await run_blocking(SPI, stop_OPCN3_stream)
+            return OPCN3.error_histogram()
+        OPCN3.logger.info("OPC-N3 streaming started, a histogram is read every " + str(period) + " seconds")
+        # Delete old histogram data and start a new one
+        if not await run_blocking(SPI, OPCN3.reset_histogram):
+            return OPCN3.error_histogram()
+        await wait("Sampling PM", period)
+
+    reading = await run_blocking(SPI, OPCN3.fetch_histogram, period)
+    if not reading:  # wrong checksum (the histogram is lost) or transmission problem
+        return OPCN3.error_histogram()
+    OPC_streamed.append(reading)
+    return reading
+
+
+def stop_OPCN3_stream():
+    """
+    Turn the laser and the fan off if they are kept on by the streaming, the histograms not taken are lost
+    :return: nothing
+    """
+    import OPCN3
+    global OPC_streaming
+
+    if OPC_streaming:
+        OPCN3.logger.info("OPC-N3 streaming stopped, shutting laser and fan OFF...")
+        OPCN3.laser_off()
+        OPCN3.fan_off()
+        OPC_streaming = False
+    OPC_streamed.clear()
+
+
+def take_OPCN3_stream():
+    """
+    Aggregate the histograms streamed since the previous sampling cycle (see 'OPCN3.aggregate()')
+    :return: Dictionary with the items of the "OPC-N3" and "OPC-N3 stream" columns
+    """
+    import OPCN3
+
+    histograms = list(OPC_streamed)
+    OPC_streamed.clear()
+    OPCN3.SPI_recovery.new_cycle()
+    return OPCN3.aggregate(histograms)
+
+
+async def read_CO2(measurement_delay):
+    """
+    Trigger a new CO2 measurement, await the end of the measurement and read the data
+    :param measurement_delay: amount of time required for the sensor to take the measurement (seconds)
+    :return: Dictionary (see 'CO2.get_data()')
+    """
+    import CO2
+
+    await run_blocking(I2C, CO2.trigger_measurement)
+    await wait("Waiting for CO2 sensor sampling", measurement_delay)
+    return await run_blocking(I2C, CO2.get_data)
+
+
+async def read_AFE(number_of_measurements):
+    """
+    Same as 'AFE.start_averaged_data()' followed by 'AFE.get_averaged_data()'
+    The I²C bus is released during the conversion of each electrode (see 'AFE.getADCreading()'), only the
+    selection of the channel and the reading of the conversion wait for it
+    :param number_of_measurements: number of readings averaged
+    :return: Dictionary (see 'AFE.get_averaged_data()')
+    """
+    import AFE
+
+    readings = []
+    for _ in range(number_of_measurements):
+        reading = {}
+        for name, channel in AFE.electrodes:
+            reading[name] = await run_blocking(I2C, AFE.read_electrode, channel)
+        readings.append(reading)
+
+    data = AFE.apply_calibration(AFE.average_readings(readings))
+    AFE.print_data(data)
+    return data
+
+
+async def read_OPC_flow(sampling_period, number_of_measurements, delay=0):
+    """
+    Same as 'flow.start_averaged_measurement()' followed by 'flow.get_averaged_measurement()'
+    :param sampling_period: amount of time during which the flow is measured (seconds)
+    :param number_of_measurements: number of readings during the sampling period
+    :param delay: amount of time to wait before starting the measurement (seconds)
+    :return: Dictionary (see 'flow.get_averaged_measurement()')
+    """
+    import flow
+
+    await asyncio.sleep(delay)
+    readings = []
+    for _ in range(number_of_measurements):
+        readings.append(await run_blocking(I2C, flow.get_data, False))
+        await asyncio.sleep(sampling_period / number_of_measurements)
+
+    return flow.average_measurements(readings)
+
+
+async def read_flow():
+    """
+    Same as 'flow.get_data()'
+    :return: Dictionary (see 'flow.get_data()')
+    """
+    import flow
+
+    return await run_blocking(I2C, flow.get_data)
+
+
+async def read_GPS(keep_open=False):
+    """
+    Same as 'GPS.get_position()', the UART synchronization is awaited instead of blocking
+    :param keep_open: True to keep the UART port open between two readings (readings every few seconds),
+                        the lines sent by the GPS since the previous reading are then read without synchronization
+    :return: Dictionary (see 'GPS.get_position()')
+    """
+    import GPS
+    global GPS_port_open
+
+    attempts = 1
+    to_return = GPS.error_position()
+
+    while attempts <= 4:
+        reading = False
+        try:
+            if keep_open and GPS_port_open:
+                reading = await run_blocking(UART, GPS.read_UART, False)
+            elif await run_blocking(UART, GPS.open_UART):
+                GPS_port_open = True
+                await asyncio.sleep(1)
+                await run_blocking(UART, GPS.synchronize_UART)
+                await asyncio.sleep(1)  # let the GPS send a full set of NMEA lines
+                reading = await run_blocking(UART, GPS.read_UART, False)
+        except Exception:
+            GPS.logger.critical("Failed to read GPS data on UART port (" + str(sys.exc_info()) + ")")
+            reading = False
+
+        if not reading:
+            GPS.logger.critical("Unable to read GPS sensor, skipping reading")
+            close_GPS()
+            return to_return  # return a dictionary full of "error"
+
+        if GPS.process_reading(reading, to_return):
+            break
+        else:
+            attempts += 1
+            if attempts >= 4:
+                GPS.logger.error("Tried 3 times to get full GPS data, still a value 'error'")
+                break
+            GPS.logger.warning("Data missing in GPS transmission, reading again (" + str(attempts) + "/3)")
+            metrics.count("GPS", metrics.RETRIES)
+            if keep_open:
+                await asyncio.sleep(1)  # wait for the next set of NMEA lines
+                metrics.count("GPS", metrics.BACKOFF, 1)
+
+    if not keep_open:
+        close_GPS()
+
+    return GPS.finish_position(to_return)
+
+
+def close_GPS():
+    """
+    Close the UART port of the GPS
+    :return: nothing
+    """
+    import GPS
+    global GPS_port_open
+
+    GPS.close_UART()
+    GPS_port_open = False
+
+
+GPS_port_open = False  # True when the UART port is kept open between two readings (see 'read_GPS()')
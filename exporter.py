@@ -0,0 +1,220 @@
+"""
+HTTP endpoint giving the live performance of the acquisition in the Prometheus text format
+(http://<address>:<port>/metrics, see 'Metrics endpoint port' in 'seacanairy_settings.yaml')
+Duration of the cycles and of each sensor, overruns of the scheduler, OPC-N3 handshake answers (busy/ready) and
+fan and laser transitions (count, time, commands skipped), SPI error recovery (strategies tried and succeeded),
+retries, checksum failures and back-off of each sensor (see 'metrics.py'), transactions and errors of each I²C device
+The server runs in its own thread, it only reads the counters
+"""
+
+import sys
+import threading
+import logging  # save logger messages into memory
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics  # counters and histograms of the acquisition
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Exporter'
+logger = logging.getLogger('Exporter')
+
+server = None  # running HTTP server, see 'start()'
+
+cycle_scheduler = None  # scheduler of the sampling cycles, for the overruns (see 'scheduler.py')
+
+
+def label(value):
+    """
+    :param value: value of a label
+    :return: value with the characters escaped as required by the Prometheus text format
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def family(lines, name, kind, description):
+    """
+    Add the HELP and TYPE lines of a metric
+    :param lines: List[lines of the page]
+    :param name: name of the metric
+    :param kind: counter, gauge or histogram
+    :param description: text of the HELP line
+    :return: nothing
+    """
+    lines.append("# HELP " + name + " " + description)
+    lines.append("# TYPE " + name + " " + kind)
+
+
+def histogram(lines, name, histogram_data, labels=""):
+    """
+    Add the lines of one histogram (see 'metrics.observe()')
+    :param lines: List[lines of the page]
+    :param name: name of the metric
+    :param histogram_data: {"buckets", "sum", "count"}
+    :param labels: Optional: labels of the histogram (f-e 'sensor="GPS",')
+    :return: nothing
+    """
+    for bound, value in zip(metrics.buckets, histogram_data["buckets"]):
+        lines.append(name + "_bucket{" + labels + "le=\"" + str(bound) + "\"} " + str(value))
+    lines.append(name + "_bucket{" + labels + "le=\"+Inf\"} " + str(histogram_data["count"]))
+    braces = "{" + labels[:-1] + "}" if labels else ""
+    lines.append(name + "_sum" + braces + " " + str(round(histogram_data["sum"], 3)))
+    lines.append(name + "_count" + braces + " " + str(histogram_data["count"]))
+
+
+def render():
+    """
+    :return: page of the metrics (Prometheus text format)
+    """
+    with metrics.lock:
+        histograms = {name: {"buckets": list(data["buckets"]), "sum": data["sum"], "count": data["count"]}
+                      for name, data in metrics.histograms.items()}
+        totals = {sensor: dict(counters) for sensor, counters in metrics.totals.items()}
+
+    lines = []
+
+    if "cycle" in histograms:
+        family(lines, "seacanairy_cycle_duration_seconds", "histogram", "Duration of the sampling cycles")
+        histogram(lines, "seacanairy_cycle_duration_seconds", histograms["cycle"])
+
+    sensors = [name for name in histograms if name != "cycle"]
+    if sensors:
+        family(lines, "seacanairy_sensor_duration_seconds", "histogram",
+               "Duration of the reading of each sensor during the sampling cycles")
+        for sensor in sensors:
+            histogram(lines, "seacanairy_sensor_duration_seconds", histograms[sensor],
+                      "sensor=\"" + label(sensor) + "\",")
+
+    if cycle_scheduler is not None:
+        counters = cycle_scheduler.counters()
+        family(lines, "seacanairy_cycle_overruns_total", "counter",
+               "Sampling cycles which finished after the start of the next slot")
+        lines.append("seacanairy_cycle_overruns_total " + str(counters["overruns"]))
+        family(lines, "seacanairy_skipped_slots_total", "counter", "Slots of the clock without measurement")
+        lines.append("seacanairy_skipped_slots_total " + str(counters["skipped slots"]))
+        family(lines, "seacanairy_start_jitter_seconds", "gauge",
+               "Difference between the start of the last cycle and its slot")
+        lines.append("seacanairy_start_jitter_seconds " + str(counters["jitter"] / 1000))
+
+    OPC = totals.get("OPC-N3", {})
+    family(lines, "seacanairy_opcn3_handshake_answers_total", "counter",
+           "Answers of the OPC-N3 to the command bytes (0x31 busy, 0xF3 ready)")
+    lines.append("seacanairy_opcn3_handshake_answers_total{answer=\"busy\"} " + str(OPC.get(metrics.BUSY, 0)))
+    lines.append("seacanairy_opcn3_handshake_answers_total{answer=\"ready\"} " + str(OPC.get(metrics.READY, 0)))
+
+    for name, counter, description in [
+        ("seacanairy_checksum_failures_total", metrics.CHECKSUM_FAILURES,
+         "Wrong checksums (OPC-N3 CRC16, CO2 sensor and flow meter CRC8, GPS NMEA)"),
+        ("seacanairy_retries_total", metrics.RETRIES, "Readings or transmissions started again"),
+        ("seacanairy_backoff_seconds_total", metrics.BACKOFF, "Time spent waiting before trying again")
+    ]:
+        family(lines, name, "counter", description)
+        for sensor in metrics.sensors + sorted(set(totals) - set(metrics.sensors)):
+            value = totals.get(sensor, {}).get(counter, 0)
+            lines.append(name + "{sensor=\"" + label(sensor) + "\"} " + str(round(value, 3)))
+
+    if "OPCN3" in sys.modules:
+        power = sys.modules["OPCN3"].power
+        transitions = {name: dict(statistics) for name, statistics in list(power.transitions.items())}
+        skipped = dict(power.skipped)
+        family(lines, "seacanairy_opcn3_power_transitions_total", "counter",
+               "Fan and laser transitions of the OPC-N3 (command sent and confirmed)")
+        for name in transitions:
+            lines.append("seacanairy_opcn3_power_transitions_total{transition=\"" + label(name) + "\"} " +
+                         str(transitions[name]["count"]))
+        family(lines, "seacanairy_opcn3_power_transition_seconds_total", "counter",
+               "Time spent in the fan and laser transitions of the OPC-N3")
+        for name in transitions:
+            lines.append("seacanairy_opcn3_power_transition_seconds_total{transition=\"" + label(name) + "\"} " +
+                         str(round(transitions[name]["seconds"], 3)))
+        family(lines, "seacanairy_opcn3_power_commands_skipped_total", "counter",
+               "Power commands of the OPC-N3 not sent because the fan or the laser was already in that state")
+        for name in skipped:
+            lines.append("seacanairy_opcn3_power_commands_skipped_total{transition=\"" + label(name) + "\"} " +
+                         str(skipped[name]))
+        recoveries = {failure: {strategy: dict(statistics) for strategy, statistics in list(strategies.items())}
+                      for failure, strategies in list(sys.modules["OPCN3"].SPI_recovery.statistics.items())}
+        for name, counter, description in [
+            ("seacanairy_opcn3_recovery_attempts_total", "attempts", "Recovery strategies tried after an SPI error"),
+            ("seacanairy_opcn3_recovery_successes_total", "successes", "Recovery strategies followed by a success"),
+            ("seacanairy_opcn3_recovery_seconds_total", "seconds", "Time spent by each recovery strategy")
+        ]:
+            family(lines, name, "counter", description)
+            for failure in recoveries:
+                for strategy in recoveries[failure]:
+                    lines.append(name + "{failure=\"" + label(failure) + "\",strategy=\"" + label(strategy) + "\"} " +
+                                 str(recoveries[failure][strategy][counter]))
+
+    if "i2c_bus" in sys.modules:
+        statistics = {address: dict(counters) for address, counters in sys.modules["i2c_bus"].statistics.items()}
+        for name, counter, description in [
+            ("seacanairy_i2c_transactions_total", "transactions", "I2C transactions of each device"),
+            ("seacanairy_i2c_nack_total", "NACK", "I2C transactions not acknowledged by each device"),
+            ("seacanairy_i2c_errors_total", "errors", "Other I2C exceptions of each device (bus stuck, timeout...)")
+        ]:
+            family(lines, name, "counter", description)
+            for address in statistics:
+                lines.append(name + "{device=\"" + label(sys.modules["i2c_bus"].name(address)) + "\"} " +
+                             str(statistics[address][counter]))
+
+    return "\n".join(lines) + "\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answer GET /metrics
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404, "Only /metrics is available")
+            return
+        try:
+            page = render().encode()
+        except Exception:
+            logger.error("Failed to prepare the metrics (" + str(sys.exc_info()) + ")")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        logger.debug(self.address_string() + " " + format % args)
+
+
+def start(address, port, scheduler=None):
+    """
+    Start the HTTP server in its own thread
+    :param address: address on which the server listens ("127.0.0.1" = this Raspberry Pi only,
+                    "0.0.0.0" = all the networks of the Raspberry Pi, f-e the ship LAN)
+    :param port: TCP port
+    :param scheduler: Optional: scheduler of the sampling cycles (see 'scheduler.py')
+    :return: True if the server is started, False if it failed
+    """
+    global server, cycle_scheduler
+    stop()
+    cycle_scheduler = scheduler
+    try:
+        server = ThreadingHTTPServer((address, port), Handler)
+    except OSError:
+        logger.error("Failed to start the metrics endpoint on " + str(address) + ":" + str(port) + " (" +
+                     str(sys.exc_info()[1]) + ")")
+        return False
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics endpoint", daemon=True).start()
+    logger.info("Metrics available on http://" + str(address) + ":" + str(port) + "/metrics")
+    return True
+
+
+def stop():
+    """
+    Stop the HTTP server if it is running
+    :return: nothing
+    """
+    global server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
@@ -8,16 +8,23 @@ import sys
 # Create folders and files
 import os
 
-# smbus2 is the new smbus, allow more than 32 bits writing/reading
-from smbus2 import SMBus, i2c_msg
-# 'SMBus' is the general driver for i2c communication
-# 'i2c_msg' allow to make i2c write followed by i2c read WITHOUT any STOP byte (see sensor documentation)
+# the I²C bus is shared with the CO2 sensor and the AFE board (one SMBus for all the drivers)
+import i2c_bus
 
 # logging
 import logging
 
 # yaml settings
-import yaml
+import config  # settings of the 'seacanairy_settings.yaml' file
+
+# retries, checksum failures and back-off (see 'metrics.py')
+import metrics
+
+# columns of the -data.csv file
+import streams
+
+# CRC8 of the frames
+import checksum
 
 # progress bar during sampling
 from progress.bar import IncrementalBar
@@ -32,8 +39,15 @@ CO2_address = 3
 N2O_address = 4
 Ar_address = 5
 
-# emplacement variable
-bus = SMBus(1)  # make it easier to read/write to the sensor (bus.read or bus.write...)
+i2c_bus.register(air_address, "flow meter")
+
+# Columns in the -data.csv file: (header, item of the dictionary of 'get_data()', kind)
+streams.register("flow meter", [("flow (sccm)", "flow [sccm]", "number"), ("flow (slm)", "flow [slm]", "number"),
+                                ("flow (slh)", "flow [slh]", "number")])
+# average flow during the measurement of the OPC-N3 (see 'average_measurements()')
+streams.register("OPC flow", [("average flow[sccm]", "average flow [sccm]", "number"),
+                              ("average flow [slm]", "average flow [slm]", "number"),
+                              ("average flow [slh]", "average flow [slh]", "number")])
 
 # --------------------------------------------------------
 # YAML SETTINGS
@@ -41,13 +55,11 @@ bus = SMBus(1)  # make it easier to read/write to the sensor (bus.read or bus.wr
 # Get current directory
 current_working_directory = str(os.getcwd())
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)
-    file.close()  # close the file after use
+settings = config.load()  # same settings object for all the modules (see 'config.py')
 
-store_debug_messages = settings['Air flow sensor']['Store debug messages (important increase of logs)']
+store_debug_messages = settings.flow.store_debug_messages
 
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
 
 # --------------------------------------------------------
@@ -130,30 +142,11 @@ def loading_bar(name, delay):
 
 def digest(buf):
     """
-    Calculate the CRC8 checksum (based on the CO2 documentation example)
+    Calculate the CRC8 checksum (same as the CO2 sensor with the initial value 0x00, see 'checksum.crc8()')
     :param buf: List[bytes to digest]
     :return: checksum
     """
-    # Translation of the C++ code given in the documentation
-    crcVal = 0x00
-    _from = 0  # the first item in a list is named 0
-    _to = len(buf)  # if there are two items in the list, then len() return 1 --> range(0, 1) = 2 loops
-
-    for i in range(_from, _to):
-        curVal = buf[i]
-
-        for j in range(0, 8):  # C++ stops when J is not < 8 --> same for python in range
-            if ((crcVal ^ curVal) & 0x80) != 0:
-                crcVal = (crcVal << 1) ^ 0x31
-
-            else:
-                crcVal = (crcVal << 1)
-
-            curVal = (curVal << 1)  # this line is in the "for j" loop, not in the "for i" loop
-
-    checksum = crcVal & 0xff  # keep only the 8 last bits
-
-    return checksum
+    return checksum.crc8(buf, 0x00)
 
 
 def check(checksum, data):
@@ -172,33 +165,11 @@ def check(checksum, data):
         logger.error("Checksum is wrong, sensor checksum is: " + str(checksum) +
                      ", seacanairy checksum is: " + str(calculation) +
                      ", data returned by the sensor is:" + str(data))
+        metrics.count("flow meter", metrics.CHECKSUM_FAILURES)
         if data[0] and data[1] == 0:
             logger.debug("Sensor returned 0 values, it is not ready, waiting a bit")
             print("Sensor not ready, waiting...", end='\r')
-            time.sleep(3)
-        return False
-
-
-def check(checksum, data):
-    """
-    Check that the data transmitted are correct using the data and the given checksum
-    :param checksum: Checksum given by the sensor (see sensor doc)
-    :param data: List[bytes to be used in the checksum calculation (see sensor doc)]
-    :return: True if the data are correct, False if not
-    """
-    calculation = digest(data)
-    if calculation == checksum:
-        logger.debug("CRC8 is correct, data are valid")
-        return True
-    else:
-        logger.debug("CRC8 does not fit, data are wrong")
-        logger.error("Checksum is wrong, sensor checksum is: " + str(checksum) +
-                     ", seacanairy checksum is: " + str(calculation) +
-                     ", data returned by the sensor is:" + str(data))
-        if data[0] and data[1] == 0:
-            logger.debug("Sensor returned 0 values, it is not ready, waiting a bit")
-            print("Sensor not ready, waiting...", end='\r')
-            time.sleep(3)
+            metrics.backoff("flow meter", 3)
         return False
 
 
@@ -224,12 +195,15 @@ def get_data(print_data=True):
             logger.critical("i2c transmission failed 3 consecutive times, skipping this flow reading")
             return to_return
         try:
-            answer = bus.read_i2c_block_data(air_address, 0xF1, 3)
+            answer = i2c_bus.read_i2c_block_data(air_address, 0xF1, 3)  # command (0xF1) and reading in one transaction
             logger.debug("i2c succeeded, answer is: " + str(answer))
             if check(answer[2], answer[0:2]):
                 break
+            attempts += 1  # wrong checksum, read again
+            metrics.count("flow meter", metrics.RETRIES)
         except:
             attempts += 1
+            metrics.count("flow meter", metrics.RETRIES)
             logger.error("i2c communication failed while reading flow (" + str(sys.exc_info()) + ")")
 
     if answer[0] == 255:
@@ -257,51 +231,45 @@ def get_data(print_data=True):
 
 
 def start_averaged_measurement(sampling_period, number_of_measurement_during_sampling_period, delay=0):
-    global sccm
-    global slm
-    global slh
-    sccm = []
-    slm = []
-    slh = []
+    global readings
+    readings = []
 
     time.sleep(delay)
     loop = 0
     sleep = sampling_period / number_of_measurement_during_sampling_period
     while loop < number_of_measurement_during_sampling_period:
-        reading = get_data(print_data=False)
-        sccm.append(reading['flow [sccm]'])
-        slm.append(reading['flow [slm]'])
-        slh.append(reading['flow [slh]'])
+        readings.append(get_data(print_data=False))
         time.sleep(sleep)
         loop += 1
 
 
-def get_averaged_measurement():
-
+def average_measurements(readings):
+    """
+    Average flow readings
+    :param readings: List[dictionary returned by 'get_data()']
+    :return: dictionary {"average flow [sccm]", "average flow [slm]", "average flow [slh]"}
+    """
     to_return = {
         "average flow [sccm]": "error",
         "average flow [slm]": "error",
         "average flow [slh]": "error",
     }
 
-    global sccm
-    global slm
-    global slh
     try:
         sum = 0
-        for i in range(len(sccm)):
-            sum += sccm[i]
-        sccm = round(sum/len(sccm), 0)
+        for i in range(len(readings)):
+            sum += readings[i]['flow [sccm]']
+        sccm = round(sum/len(readings), 0)
 
         sum = 0
-        for i in range(len(slm)):
-            sum += slm[i]
-        slm = round(sum/len(slm), 3)
+        for i in range(len(readings)):
+            sum += readings[i]['flow [slm]']
+        slm = round(sum/len(readings), 3)
 
         sum = 0
-        for i in range(len(slh)):
-            sum += slh[i]
-        slh = round(sum/len(slh), 2)
+        for i in range(len(readings)):
+            sum += readings[i]['flow [slh]']
+        slh = round(sum/len(readings), 2)
 
     except:
         logger.error("Error occurred while computing average flow rate (" + str(sys.exc_info()) + ")")
@@ -321,6 +289,11 @@ def get_averaged_measurement():
     return to_return
 
 
+def get_averaged_measurement():
+    global readings
+    return average_measurements(readings)
+
+
 if __name__ == "__main__":
     while True:
         get_data()
@@ -0,0 +1,212 @@
+"""
+Manager of the I²C bus 1, shared by the CO2 sensor, the AFE board (ADC) and the flow meter
+The bus is opened only once and kept open, the transactions of all the drivers are executed one after the other
+(the drivers are called at the same time from the thread pool of 'engine.py')
+The latency and the number of NACK of each device are recorded
+Back-to-back transactions with the same device are batched in a session (see 'session'): the lock is taken once and
+no other device uses the bus between them. The transactions are not merged into a single one (each device has its
+own command/reading protocol), the "batched" counter gives the number of transactions executed in a session
+"""
+
+import errno
+import threading
+import time
+import logging  # save logger messages into memory
+import sys
+
+from smbus2 import SMBus
+# 'SMBus' is the general driver for i2c communication
+
+bus_number = 1  # /dev/i2c-1 on the Raspberry Pi
+
+# A device which does not answer (NACK) raises one of these errors
+NACK_errors = [errno.EREMOTEIO, errno.ENXIO]
+
+# Transactions wait for this lock, the thread which has the bus can take it again (see 'session')
+lock = threading.RLock()
+
+bus = None  # persistent SMBus handle, opened at the first transaction (see 'handle()')
+
+session_address = {}  # {thread: address of the device which has the bus in a session}
+
+devices = {}  # {address: name of the device}, see 'register()'
+
+# Counters of each device {address: {"transactions", "batched", "NACK", "errors", "total latency", "max latency"}}
+statistics = {}
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'I2C bus'
+logger = logging.getLogger('I2C bus')
+
+
+def register(address, name):
+    """
+    Give a name to a device, used in the logs
+    :param address: I²C address of the device
+    :param name: name of the device (f-e "CO2 sensor")
+    :return: nothing
+    """
+    devices[address] = name
+
+
+def handle():
+    """
+    Open the bus if it is not open yet
+    Must be called with the lock
+    :return: SMBus object
+    """
+    global bus
+    if bus is None:
+        bus = SMBus(bus_number)
+        logger.debug("I2C bus " + str(bus_number) + " opened")
+    return bus
+
+
+def close():
+    """
+    Close the bus, it will be opened again at the next transaction
+    :return: nothing
+    """
+    global bus
+    with lock:
+        if bus is not None:
+            try:
+                bus.close()
+            except OSError:
+                pass
+            bus = None
+
+
+def counters(address):
+    """
+    :param address: I²C address of the device
+    :return: Dictionary of the counters of the device (see 'statistics')
+    """
+    if address not in statistics:
+        statistics[address] = {
+            "transactions": 0,  # number of transactions (succeeded or not)
+            "batched": 0,  # number of transactions executed in a session without releasing the bus
+            "NACK": 0,  # number of transactions not acknowledged by the device
+            "errors": 0,  # other errors (bus stuck, timeout...)
+            "total latency": 0,  # seconds, waiting for the bus included
+            "max latency": 0  # seconds
+        }
+    return statistics[address]
+
+
+def transaction(address, operation, *args):
+    """
+    Execute one transaction on the bus, the other drivers wait until it is finished
+    :param address: I²C address of the device
+    :param operation: name of the SMBus method (f-e "read_i2c_block_data")
+    :param args: arguments of the SMBus method, after the address
+    :return: what the SMBus method returns
+    """
+    started = time.monotonic()
+    with lock:
+        device = counters(address)
+        device["transactions"] += 1
+        if session_address.get(threading.get_ident()) == address:
+            device["batched"] += 1
+        try:
+            if operation == "i2c_rdwr":
+                return handle().i2c_rdwr(*args)  # the address is in the messages
+            return getattr(handle(), operation)(address, *args)
+
+        except OSError as error:
+            if error.errno in NACK_errors:
+                device["NACK"] += 1
+                logger.debug("NACK from " + name(address) + " (" + str(error) + ")")
+            else:
+                device["errors"] += 1
+                logger.warning("I2C error with " + name(address) + " (" + str(sys.exc_info()) +
+                               "), the bus will be opened again")
+                close()
+            raise
+
+        finally:
+            latency = time.monotonic() - started
+            device["total latency"] += latency
+            device["max latency"] = max(device["max latency"], latency)
+
+
+class session:
+    """
+    Keep the bus for back-to-back transactions with the same device (f-e write the index then read the memory of the
+    CO2 sensor)
+    Usage: with i2c_bus.session(address): ...
+    Avoid sleeping inside a session, the other devices would wait
+    """
+
+    def __init__(self, address):
+        self.address = address
+
+    def __enter__(self):
+        lock.acquire()
+        self.previous = session_address.get(threading.get_ident())
+        session_address[threading.get_ident()] = self.address
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        session_address[threading.get_ident()] = self.previous
+        lock.release()
+        return False
+
+
+def name(address):
+    """
+    :param address: I²C address of the device
+    :return: name of the device if it has been registered, its address if not
+    """
+    return devices.get(address, "device " + str(hex(address)))
+
+
+# ---------------------------------------------------------------------
+# SMBUS METHODS
+# ---------------------------------------------------------------------
+# Same as the SMBus methods, executed through 'transaction()'
+
+
+def read_byte_data(address, register):
+    return transaction(address, "read_byte_data", register)
+
+
+def write_byte(address, value):
+    return transaction(address, "write_byte", value)
+
+
+def read_i2c_block_data(address, register, length):
+    return transaction(address, "read_i2c_block_data", register, length)
+
+
+def i2c_rdwr(*messages):
+    """
+    Combined write/read transaction without STOP between the messages (see 'smbus2.i2c_msg')
+    :param messages: i2c_msg.write(...) and/or i2c_msg.read(...)
+    :return: nothing, the data read are in the read messages
+    """
+    return transaction(messages[0].addr, "i2c_rdwr", *messages)
+
+
+def report():
+    """
+    Log the counters of each device
+    :return: Dictionary{name of the device: {"transactions", "NACK", "errors", "average latency", "max latency"}}
+                (latency in ms)
+    """
+    to_return = {}
+    for address in statistics:
+        device = statistics[address]
+        average = device["total latency"] / device["transactions"] if device["transactions"] else 0
+        to_return[name(address)] = {
+            "transactions": device["transactions"],
+            "NACK": device["NACK"],
+            "errors": device["errors"],
+            "average latency": round(average * 1000, 1),
+            "max latency": round(device["max latency"] * 1000, 1)
+        }
+        logger.debug(name(address) + ": " + str(device["transactions"]) + " transactions (" +
+                     str(device["batched"]) + " batched), " + str(device["NACK"]) + " NACK, " +
+                     str(device["errors"]) + " errors, latency " + str(round(average * 1000, 1)) + " ms (max " +
+                     str(round(device["max latency"] * 1000, 1)) + " ms)")
+    return to_return
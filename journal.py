@@ -0,0 +1,208 @@
+"""
+Write-ahead journal of the rows of the -data.csv file kept in memory (see 'Journal of the rows kept in memory' in the
+settings): <Sampling session name>-data.journal
+Each row is appended to the journal and forced on the SD card before being kept in memory, the journal is emptied
+once the rows are written and forced in the -data.csv file. After a power cut, the rows of the journal which never
+reached the -data.csv file are written at the next start (see 'recover()'), so that the rows can be written by big
+batches without losing the last ones
+
+One line per row: CRC32 of the row (8 hexadecimal characters), space, row in csv
+The headers of the columns the rows are written with are the first line of the journal (same format, first value
+"#columns"), so that the rows are recovered under their own columns even if the -data.csv file is lost
+A line cut by the power cut, or with a wrong CRC, is ignored
+"""
+
+import csv  # for storing data in file
+import io
+import os  # to be able to create new files/folders
+import zlib
+import logging  # save logger messages into memory
+
+import rotation  # time of the rows of the -data.csv file
+import streams  # schema line of the -data.csv file
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Journal'
+logger = logging.getLogger('Journal')
+
+extension = ".journal"
+
+columns_marker = "#columns"  # first value of the lines of the journal holding the headers of the columns
+
+recovered_suffix = "-recovered.csv"  # rows which can't be written in the -data.csv file (other columns)
+
+
+def encode(row):
+    """
+    :param row: List[values]
+    :return: line of the journal (bytes)
+    """
+    text = io.StringIO()
+    csv.writer(text, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, lineterminator="").writerow(row)
+    line = text.getvalue().encode()
+    return b"%08x " % zlib.crc32(line) + line + b"\n"
+
+
+def decode(line):
+    """
+    :param line: line of the journal without its end (bytes)
+    :return: List[values], None if the line is damaged
+    """
+    if len(line) < 9 or line[8:9] != b" ":
+        return None
+    try:
+        if int(line[:8], 16) != zlib.crc32(line[9:]):
+            return None
+        return next(csv.reader([line[9:].decode()], delimiter=',', quotechar='"'))
+    except (ValueError, StopIteration):
+        return None
+
+
+class Journal:
+    """
+    Journal of the rows kept in memory by 'streams.BufferedCSV'
+    """
+
+    def __init__(self, file):
+        """
+        :param file: path of the journal
+        """
+        self.file = file
+        self.journal_file = None  # opened at the first row
+        self.header = None  # headers of the columns written in the journal since it has been emptied
+
+    def append(self, row, header=None):
+        """
+        Add a row and force it on the SD card
+        :param row: List[values]
+        :param header: Optional: List[headers of the columns of the row], written before the row when they change
+        :return: nothing
+        """
+        if self.journal_file is None:
+            self.journal_file = open(self.file, "ab", buffering=0)
+        line = encode(row)
+        if header is not None and list(header) != self.header:
+            self.header = list(header)
+            line = encode([columns_marker] + self.header) + line
+        self.journal_file.write(line)
+        os.fdatasync(self.journal_file.fileno())
+
+    def clear(self):
+        """
+        Empty the journal, once its rows are forced in the -data.csv file
+        :return: nothing
+        """
+        self.header = None  # written again with the next row
+        if self.journal_file is None:
+            if not os.path.isfile(self.file) or os.path.getsize(self.file) == 0:
+                return
+            self.journal_file = open(self.file, "ab", buffering=0)
+        os.ftruncate(self.journal_file.fileno(), 0)
+        os.fdatasync(self.journal_file.fileno())
+
+    def close(self):
+        """
+        Close the journal, it is opened again at the next row
+        :return: nothing
+        """
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    def read(self):
+        """
+        :return: List[rows of the journal], without the damaged lines
+        """
+        if not os.path.isfile(self.file):
+            return []
+        with open(self.file, "rb") as journal_file:
+            lines = journal_file.read().split(b"\n")
+        if lines[-1]:
+            logger.warning("Last line of '" + os.path.basename(self.file) + "' cut by a power cut, ignored")
+        rows = [decode(line) for line in lines[:-1]]
+        if None in rows:
+            logger.warning(str(rows.count(None)) + " damaged lines in '" + os.path.basename(self.file) +
+                           "', ignored")
+        return [row for row in rows if row is not None]
+
+    def recover(self, csv_file):
+        """
+        Write the rows of the journal which are not in the -data.csv file (power cut), to be called at the start
+        before writing in the -data.csv file. A line of the -data.csv file cut by the power cut is removed
+        The rows are written with the headers of the journal if the -data.csv file doesn't exist, in
+        <Sampling session name>-data-recovered.csv if the -data.csv file has other columns
+        :param csv_file: -data.csv file
+        :return: number of rows recovered
+        """
+        rows = self.read()
+        if not rows:
+            self.clear()
+            return 0
+        new_file = not os.path.isfile(csv_file) or os.path.getsize(csv_file) == 0
+        file_header = None
+        if not new_file:
+            truncate_partial_line(csv_file)
+            with open(csv_file, newline='') as data_file:
+                file_header = streams.read_header(csv.reader(data_file, delimiter=',', quotechar='"'))[1]
+        last = None if new_file else rotation.time_range(csv_file, "data")[1]
+
+        header = None  # columns of the rows of the journal, None for a journal written without them
+        missing = []  # [(headers, row)]
+        for row in rows:
+            if row and row[0] == columns_marker:
+                header = row[1:]
+                continue
+            row_time = rotation.line_time(row[0] if row else "", "data", None)
+            if row_time is not None and (last is None or row_time > last):  # the rows are in the order of time
+                missing.append((header, row))
+
+        recovered_file = csv_file[:-len(".csv")] + recovered_suffix
+        headers = {csv_file: file_header, recovered_file: None}  # columns of each file once the rows are written
+        lines = {csv_file: [], recovered_file: []}
+        for header, row in missing:
+            # a journal without headers has been written for the -data.csv file
+            file = csv_file if header is None or headers[csv_file] in (None, header) else recovered_file
+            if header is not None and headers[file] != header:
+                lines[file] += [streams.schema_row(header), header]
+                headers[file] = header
+            lines[file].append(row)
+        for file in lines:
+            if lines[file]:
+                with open(file, mode='a', newline='') as data_file:
+                    writer = csv.writer(data_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                    writer.writerows(lines[file])
+                    data_file.flush()
+                    os.fsync(data_file.fileno())
+        self.clear()
+        if missing:
+            logger.warning(str(len(missing)) + " rows not written in '" + os.path.basename(csv_file) +
+                           "' before the last stop recovered from the journal (" + missing[0][1][0] + " to " +
+                           missing[-1][1][0] + ")")
+        if lines[recovered_file]:
+            logger.warning("Rows of the journal with other columns than '" + os.path.basename(csv_file) +
+                           "' written in '" + os.path.basename(recovered_file) + "'")
+        return len(missing)
+
+
+def truncate_partial_line(file):
+    """
+    Remove the end of a file which is not a complete line (written during a power cut)
+    :param file: path of the file
+    :return: number of bytes removed
+    """
+    with open(file, "r+b") as text_file:
+        size = text_file.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            text_file.seek(max(0, end - 4096))
+            block = text_file.read(end - max(0, end - 4096))
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                end = max(0, end - 4096) + newline + 1
+                break
+            end = max(0, end - 4096)
+        if end < size:
+            text_file.truncate(end)
+            logger.warning("Last line of '" + os.path.basename(file) + "' cut by a power cut (" +
+                           str(size - end) + " bytes), removed")
+        return size - end
@@ -0,0 +1,158 @@
+"""
+Metrics of the acquisition: retries, checksum failures and back-off waiting of each sensor
+The drivers count what happens during their readings ('count()', 'backoff()'), the counters are added
+- to the totals of the sensor since the start of the software ('totals')
+- to the stage of the sampling cycle which called the driver (see 'engine.timed()'), so that a slow cycle can be
+  traced to the exact sensor and retry path in the -metrics.csv file
+"""
+
+import contextvars
+import os  # to be able to create new files/folders
+import threading
+import time
+import logging  # save logger messages into memory
+from datetime import datetime
+
+import rotation  # -metrics.csv file kept open and rotated like the -data.csv file
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Metrics'
+logger = logging.getLogger('Metrics')
+
+# Counters
+RETRIES = "retries"  # reading or transmission started again
+CHECKSUM_FAILURES = "checksum failures"  # CRC8/CRC16/NMEA checksum not correct
+BUSY = "busy answers"  # OPC-N3 answered 0x31 (busy) to a command byte
+READY = "ready answers"  # OPC-N3 answered 0xF3 (ready) to a command byte
+BACKOFF = "back-off time"  # seconds spent waiting before trying again
+
+# Counters stored in the -metrics.csv file for each stage
+stage_counters = [RETRIES, CHECKSUM_FAILURES, BUSY, BACKOFF]
+
+# Stages of the sampling cycle stored in the -metrics.csv file (see 'seacanairy.sample()')
+stages = ["OPC-N3", "OPC flow", "AFE", "flow meter", "GPS", "CO2"]
+
+# Counters of the stage being executed {counter: value}, None outside of a stage (see 'engine.timed()')
+# Each asyncio task and each function executed in the thread pool sees the stage which started it
+current = contextvars.ContextVar("stage counters", default=None)
+
+# Sensors whose drivers count their events (see 'count()')
+sensors = ["OPC-N3", "CO2", "flow meter", "GPS", "AFE"]
+
+totals = {}  # {sensor: {counter: value}} since the start of the software
+
+# Upper bounds of the duration histograms (seconds), see 'observe()'
+buckets = [1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300]
+
+histograms = {}  # {name: {"buckets": [number of durations <= each bound], "sum", "count"}}
+
+lock = threading.Lock()  # the drivers are executed at the same time in the thread pool
+
+
+def count(sensor, counter, value=1):
+    """
+    Count an event of a driver
+    :param sensor: name of the sensor (f-e "OPC-N3")
+    :param counter: see the counters above (f-e RETRIES)
+    :param value: Optional: amount to add (1 by default)
+    :return: nothing
+    """
+    with lock:
+        sensor_totals = totals.setdefault(sensor, {})
+        sensor_totals[counter] = sensor_totals.get(counter, 0) + value
+        stage = current.get()
+        if stage is not None:
+            stage[counter] = stage.get(counter, 0) + value
+
+
+def backoff(sensor, delay):
+    """
+    Same as 'time.sleep()', the waiting time is counted as back-off of the sensor
+    :param sensor: name of the sensor (f-e "CO2")
+    :param delay: seconds
+    :return: nothing
+    """
+    time.sleep(delay)
+    count(sensor, BACKOFF, delay)
+
+
+def observe(name, duration):
+    """
+    Add a duration to a histogram (see 'exporter.py')
+    :param name: "cycle" or name of the sensor
+    :param duration: seconds
+    :return: nothing
+    """
+    with lock:
+        histogram = histograms.setdefault(name, {"buckets": [0] * len(buckets), "sum": 0, "count": 0})
+        for i in range(len(buckets)):
+            if duration <= buckets[i]:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += duration
+        histogram["count"] += 1
+
+
+def header():
+    """
+    :return: List[headers of the columns of the -metrics.csv file]
+    """
+    to_return = ["Date/Time", "cycle start", "cycle end", "cycle duration (s)"]
+    for stage in stages:
+        to_return += [stage + " start", stage + " end"] + [stage + " " + counter for counter in stage_counters]
+    return to_return
+
+
+def row(slot, start, end, cycle_metrics):
+    """
+    :param slot: time of the slot of the cycle ('time.time()' format)
+    :param start: time at which the cycle has started
+    :param end: time at which the cycle has finished
+    :param cycle_metrics: Dictionary{stage: {"start", "end", counter: value}} (see 'engine.timed()')
+    :return: List[values in the order of the columns], empty values for the stages not executed during the cycle
+    """
+    to_return = [datetime.fromtimestamp(slot).strftime("%d-%m-%Y %H:%M:%S"), round(start, 3), round(end, 3),
+                 round(end - start, 3)]
+    for stage in stages:
+        if stage in cycle_metrics:
+            stage_metrics = cycle_metrics[stage]
+            to_return += [round(stage_metrics["start"], 3), round(stage_metrics["end"], 3)]
+            to_return += [round(stage_metrics.get(counter, 0), 3) for counter in stage_counters]
+        else:
+            to_return += [""] * (2 + len(stage_counters))
+    return to_return
+
+
+class MetricsFile(rotation.RotatingCSV):
+    """
+    <Sampling session name>-metrics.csv file, one line for each sampling cycle
+    Kept open, written by batches and rotated like the -data.csv file (see 'rotation.RotatingCSV')
+    """
+
+    def __init__(self, directory_path, project_name, file_rotation, flush_rows=1, flush_interval=0,
+                 fsync_policy="never", journal=None):
+        """
+        :param directory_path: folder of the sampling session
+        :param project_name: name of the sampling session
+        :param file_rotation: rotation.Rotation of the session
+        :param flush_rows, flush_interval, fsync_policy, journal: see 'rotation.RotatingCSV'
+        """
+        file = file_path(directory_path, project_name)
+        if not os.path.isfile(file):
+            logger.info("Initializing metrics file " + str(file))
+        super().__init__(file, file_rotation, flush_rows, flush_interval, fsync_policy, journal, "metrics")
+
+    def append(self, slot, start, end, cycle_metrics):
+        """
+        Store the metrics of one sampling cycle (see 'row()'), the headers are written with the first line
+        :return: nothing
+        """
+        self.writerow(row(slot, start, end, cycle_metrics), header())
+
+
+def file_path(directory_path, project_name):
+    """
+    :param directory_path: folder of the sampling session
+    :param project_name: name of the sampling session
+    :return: path of the -metrics.csv file
+    """
+    return directory_path + "/" + str(project_name) + "-metrics" + rotation.extensions["metrics"]
@@ -0,0 +1,211 @@
+"""
+Adaptive error recovery of a sensor (used by the OPC-N3, see 'OPCN3.SPI_recovery')
+Each failure is classified (busy for too long, chip select fault, unexpected answer, bad frame...) and recovered by
+one of the strategies below, from the one which was the cheapest to succeed for this class of failure on this unit
+(time spent / rate of success, learned from the previous failures and kept in a small json file of the sampling
+session), the next ones are tried if it doesn't work:
+    - re-read: try again right away
+    - back-off: try again after an exponential waiting time with jitter (20 ms, 40 ms, 80 ms...)
+    - reset: try again after the reset of the SPI buffer of the sensor (3 seconds)
+    - re-sample: take a new sample (OPC-N3 histogram, whole sampling time)
+The time spent to recover is limited for each sampling cycle (see 'Time budget of the error recovery' in the
+settings): a failure which can't be recovered in the budget left gives "error" values instead of making the
+cycle much longer
+"""
+
+import json
+import os  # to be able to create new files/folders
+import random
+import threading
+import time
+import logging  # save logger messages into memory
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Recovery'
+logger = logging.getLogger('Recovery')
+
+# Strategies
+REREAD = "re-read"
+BACKOFF = "back-off"
+RESET = "reset"
+RESAMPLE = "re-sample"
+
+# Number of times each strategy can be used to recover from one failure
+limits = {REREAD: 2, BACKOFF: 4, RESET: 2, RESAMPLE: 1}
+
+backoff_cap = 1  # seconds, longest back-off
+
+
+def jittered(base, exponent, cap=backoff_cap):
+    """
+    Exponential waiting time with jitter: between half and the whole of base * 2^exponent (limited to 'cap'),
+    so that the waiting time never gets shorter than half of 'base' (f-e the 10 ms required by the OPC-N3 after
+    a busy answer)
+    :param base: first waiting time (seconds)
+    :param exponent: number of waiting times before this one
+    :param cap: longest waiting time (seconds)
+    :return: seconds
+    """
+    delay = min(base * 2 ** exponent, cap)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Recovery:
+    """
+    Recovery of the failures of one sensor, one failure at a time for each scope (f-e "handshake" and "frame" for
+    the OPC-N3: a handshake can fail while a frame is being recovered)
+    """
+
+    def __init__(self, sensor, budget, file=None):
+        """
+        :param sensor: name of the sensor (f-e "OPC-N3")
+        :param budget: seconds which can be spent to recover the failures during one sampling cycle
+        :param file: Optional: json file in which the statistics of the strategies are kept between two starts
+        """
+        self.sensor = sensor
+        self.budget = budget
+        self.file = file
+        self.spent = 0  # seconds spent to recover during the current sampling cycle
+        self.incidents = {}  # failures being recovered {scope: {"failure", "started", "strategy", "tries"}}
+        # {failure: {strategy: {"attempts", "successes", "seconds"}}}
+        self.statistics = {}
+        self.lock = threading.Lock()  # the readings of the sensor are executed in the thread pool
+        if file is not None and os.path.isfile(file):
+            try:
+                with open(file) as statistics_file:
+                    self.statistics = json.load(statistics_file)
+            except (OSError, ValueError):
+                logger.warning("Statistics of the error recovery of the " + sensor + " in '" + str(file) +
+                               "' are not readable, starting from scratch")
+
+    def new_cycle(self):
+        """
+        Start the time budget of a new sampling cycle
+        :return: nothing
+        """
+        with self.lock:
+            self.spent = 0
+
+    def expected_cost(self, failure, strategy, nominal):
+        """
+        :param failure: class of the failure
+        :param strategy: see the strategies above
+        :param nominal: seconds that the strategy takes when it has never been used
+        :return: seconds expected to recover with this strategy (time of one use / rate of success)
+        """
+        statistics = self.statistics.get(failure, {}).get(strategy, {"attempts": 0, "successes": 0, "seconds": 0})
+        cost = (statistics["seconds"] + nominal) / (statistics["attempts"] + 1)
+        rate = (statistics["successes"] + 1) / (statistics["attempts"] + 2)
+        return cost / rate
+
+    def fail(self, scope, failure, candidates):
+        """
+        A reading failed, choose how to try again
+        :param scope: what failed (f-e "handshake")
+        :param failure: class of the failure (f-e "busy"), only the first failure of the scope is used to learn
+        :param candidates: Dictionary{strategy which can be used: seconds to wait (first waiting time for BACKOFF)}
+        :return: (strategy, seconds to wait before trying again), None if the failure can't be recovered (all the
+                 strategies tried or time budget of the cycle used)
+        """
+        with self.lock:
+            now = time.monotonic()
+            incident = self.incidents.get(scope)
+            if incident is None:
+                incident = {"failure": failure, "started": now, "strategy": None, "tries": {}}
+                self.incidents[scope] = incident
+            else:
+                self.record(incident, now, False)
+
+            order = sorted(candidates, key=lambda strategy: self.expected_cost(incident["failure"], strategy,
+                                                                               candidates[strategy]))
+            for strategy in order:
+                tries = incident["tries"].get(strategy, 0)
+                if tries < limits[strategy]:
+                    break
+            else:
+                logger.error(self.sensor + ": " + incident["failure"] + " not recovered (" +
+                             ", ".join(order) + " tried)")
+                self.close(scope, now)
+                return None
+
+            delay = jittered(candidates[strategy], tries) if strategy == BACKOFF else candidates[strategy]
+            if self.spent + (now - incident["started"]) + delay > self.budget:
+                logger.error(self.sensor + ": " + incident["failure"] + " not recovered, time budget of the cycle "
+                             "used (" + str(self.budget) + " seconds)")
+                self.close(scope, now)
+                return None
+
+            incident["tries"][strategy] = tries + 1
+            incident["strategy"] = strategy
+            incident["strategy started"] = now
+            logger.debug(self.sensor + ": " + failure + ", " + strategy + " (" + str(round(delay, 3)) + " s)")
+            return strategy, delay
+
+    def succeed(self, scope):
+        """
+        The reading succeeded, the strategy used (if any) is credited
+        :param scope: see 'fail()'
+        :return: nothing
+        """
+        if scope not in self.incidents:  # nothing to recover, most of the readings
+            return
+        with self.lock:
+            incident = self.incidents.get(scope)
+            if incident is None:
+                return
+            now = time.monotonic()
+            self.record(incident, now, True)
+            logger.info(self.sensor + ": " + incident["failure"] + " recovered by " + str(incident["strategy"]) +
+                        " in " + str(round(now - incident["started"], 3)) + " seconds")
+            self.close(scope, now)
+
+    def abandon(self, scope):
+        """
+        The reading is given up for another reason (f-e transmission problem), the strategy used did not work
+        :param scope: see 'fail()'
+        :return: nothing
+        """
+        if scope not in self.incidents:
+            return
+        with self.lock:
+            incident = self.incidents.get(scope)
+            if incident is None:
+                return
+            now = time.monotonic()
+            self.record(incident, now, False)
+            self.close(scope, now)
+
+    def record(self, incident, now, success):
+        """
+        Add the result of the strategy being used to the statistics
+        :param incident: see 'fail()'
+        :param now: 'time.monotonic()'
+        :param success: True if the reading succeeded after the strategy
+        :return: nothing
+        """
+        if incident["strategy"] is None:
+            return
+        statistics = self.statistics.setdefault(incident["failure"], {}).setdefault(
+            incident["strategy"], {"attempts": 0, "successes": 0, "seconds": 0})
+        statistics["attempts"] += 1
+        statistics["successes"] += int(success)
+        statistics["seconds"] = round(statistics["seconds"] + now - incident["strategy started"], 3)
+        incident["strategy"] = None
+
+    def close(self, scope, now):
+        """
+        End of the recovery of a scope: its time is taken from the budget, the statistics are saved
+        :param scope: see 'fail()'
+        :param now: 'time.monotonic()'
+        :return: nothing
+        """
+        incident = self.incidents.pop(scope)
+        self.spent += now - incident["started"]
+        if self.file is None or not incident["tries"]:
+            return
+        try:
+            with open(self.file + ".tmp", "w") as statistics_file:
+                json.dump(self.statistics, statistics_file, indent=1)
+            os.replace(self.file + ".tmp", self.file)
+        except OSError:
+            logger.warning("Failed to save the statistics of the error recovery in '" + str(self.file) + "'")
@@ -0,0 +1,337 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+Replay of a capture of the raw bus traffic (see 'capture.py') through the decoders of the drivers, without hardware
+The libraries 'spidev', 'smbus2' and 'serial' are replaced by a player giving back the recorded answers (the failed
+transactions raise the same error again), and the drivers decode them as fast as possible (no waiting):
+    - OPC-N3: 'OPCN3.fetch_histogram()' (handshake, histogram and CRC16 of 'read_histogram()')
+    - CO2 sensor: 'CO2.get_data()' ('getCO2P()' and 'getRHT()')
+    - flow meter: 'flow.get_data()'
+    - AFE board: 'AFE.get_data()'
+    - GPS: 'GPS.decode_NMEA()' of each 'ser.read_all()'
+To reproduce a field fault (--verbose shows the messages of the drivers) and to measure the throughput of the
+decoders on real data
+
+Usage: python3 replay.py <session>-capture.bin [--sensor OPC-N3] [--output readings.jsonl] [--verbose]
+Must be executed in the folder of the Seacanairy (the drivers read 'seacanairy_settings.yaml')
+The answers are given back in the order they were recorded, separately for each device and each request
+"""
+
+import argparse
+import collections
+import contextlib
+import errno
+import json
+import logging
+import os
+import sys
+import time
+import types
+
+import capture  # format of the capture file
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Replay'
+logger = logging.getLogger('Replay')
+
+
+class Player:
+    """
+    Recorded answers of a capture, given back to the stand-in libraries below
+    """
+
+    def __init__(self, file):
+        """
+        :param file: path of the -capture.bin file
+        """
+        # {(bus, address, operation, request): deque[(time, error, response)]}
+        self.answers = collections.defaultdict(collections.deque)
+        self.remaining = collections.Counter()  # {(bus, address): number of records not replayed yet}
+        for timestamp, bus, operation, error, address, request, response in capture.read(file):
+            self.answers[(bus, address, operation, request)].append((timestamp, error, response))
+            self.remaining[(bus, address)] += 1
+        self.replayed = 0  # number of records given back
+        self.bytes = 0  # number of bytes given back
+        self.time = None  # time of the last record given back
+        self.exhausted = False  # True when a driver asked for an answer which is not in the capture anymore
+
+    def answer(self, bus, address, operation, request):
+        """
+        :param bus: capture.SPI, capture.I2C or capture.UART
+        :param address: SPI device, I²C address or 0 for the UART
+        :param operation: name of the operation (see 'capture.operations')
+        :param request: bytes sent by the driver
+        :return: bytes recorded as answer to the same request, raise the recorded error if the transaction failed
+        """
+        answers = self.answers.get((bus, address, operation, bytes(request)))
+        if not answers:
+            self.exhausted = True
+            raise OSError(errno.ENODATA, "No more " + capture.buses[bus] + " " + operation + " in the capture")
+        self.time, error, response = answers.popleft()
+        self.remaining[(bus, address)] -= 1
+        self.replayed += 1
+        self.bytes += len(request) + len(response)
+        if error:
+            raise OSError(error, os.strerror(error))
+        return response
+
+
+player = None  # see 'install()'
+
+
+# ---------------------------------------------------------------------
+# Same classes as the real libraries, limited to what the drivers use
+
+
+class SpiDev:
+    """
+    spidev.SpiDev
+    """
+
+    def __init__(self):
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.address = 0
+
+    def open(self, bus, device):
+        self.address = (bus << 8) + device
+
+    def xfer(self, data):
+        return list(player.answer(capture.SPI, self.address, "xfer", list(data)))
+
+    xfer2 = xfer  # recorded as 'xfer' (see 'capture.SpiDev')
+
+    def close(self):
+        pass
+
+
+class i2c_msg:
+    """
+    smbus2.i2c_msg
+    """
+
+    def __init__(self, address, flags, data):
+        self.addr = address
+        self.flags = flags
+        self.buf = data
+        self.len = len(data)
+
+    @staticmethod
+    def write(address, data):
+        return i2c_msg(address, 0, list(data))
+
+    @staticmethod
+    def read(address, length):
+        return i2c_msg(address, 1, [0] * length)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __len__(self):
+        return self.len
+
+
+class SMBus:
+    """
+    smbus2.SMBus
+    """
+
+    def __init__(self, bus=None):
+        pass
+
+    def i2c_rdwr(self, *messages):
+        request = b"".join(bytes(message.buf) for message in messages if not message.flags & 1)
+        response = player.answer(capture.I2C, messages[0].addr, "i2c_rdwr", request)
+        for message in messages:
+            if message.flags & 1:
+                message.buf = list(response[:message.len])
+                response = response[message.len:]
+
+    def read_i2c_block_data(self, address, register, length):
+        return list(player.answer(capture.I2C, address, "read_i2c_block_data", [register]))
+
+    def read_byte_data(self, address, register):
+        return player.answer(capture.I2C, address, "read_byte_data", [register])[0]
+
+    def write_byte(self, address, value):
+        player.answer(capture.I2C, address, "write_byte", [value])
+
+    def close(self):
+        pass
+
+
+class Serial:
+    """
+    serial.Serial
+    """
+
+    def __init__(self, port=None, baudrate=9600, **kwargs):
+        self.port = port
+
+    def read_all(self):
+        return player.answer(capture.UART, 0, "read_all", b"")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def install(file):
+    """
+    Replace the hardware libraries by the player, must be called before importing the drivers
+    :param file: path of the -capture.bin file
+    :return: Player
+    """
+    global player
+    player = Player(file)
+    modules = {
+        "spidev": {"SpiDev": SpiDev},
+        "smbus2": {"SMBus": SMBus, "i2c_msg": i2c_msg},
+        "serial": {"Serial": Serial, "SerialException": OSError}
+    }
+    for name in modules:
+        module = types.ModuleType(name, "Replayed '" + name + "' (see 'replay.py')")
+        module.__dict__.update(modules[name])
+        sys.modules[name] = module
+    return player
+
+
+# ---------------------------------------------------------------------
+# DECODERS
+# ---------------------------------------------------------------------
+
+
+def decode_OPCN3():
+    import OPCN3
+    return OPCN3.fetch_histogram(OPCN3.OPC_sampling_time)
+
+
+def decode_CO2():
+    import CO2
+    return CO2.get_data()
+
+
+def decode_flow():
+    import flow
+    return flow.get_data(print_data=False)
+
+
+def decode_AFE():
+    import AFE
+    return AFE.get_data()
+
+
+def decode_GPS():
+    import GPS
+    if "ser" not in vars(GPS):
+        GPS.open_UART()
+    to_return = GPS.error_position()
+    GPS.process_reading(GPS.read_UART(close_UART=False), to_return)
+    return to_return
+
+
+def decoders():
+    """
+    :return: Dictionary{sensor: ((bus, address), decoder)} (the drivers are imported here, after 'install()')
+    """
+    import CO2
+    import AFE
+    import flow
+    return {
+        "OPC-N3": ((capture.SPI, 0), decode_OPCN3),
+        "CO2": ((capture.I2C, CO2.CO2_address), decode_CO2),
+        "flow meter": ((capture.I2C, flow.air_address), decode_flow),
+        "AFE": ((capture.I2C, AFE.address), decode_AFE),
+        "GPS": ((capture.UART, 0), decode_GPS)
+    }
+
+
+def failed(reading):
+    """
+    :param reading: what a decoder returned
+    :return: True if the reading is missing or contains an "error" value
+    """
+    if not isinstance(reading, dict):
+        return True
+    return any(value == "error" or value is False for value in reading.values())
+
+
+def replay(sensor, device, decoder, output=None):
+    """
+    Decode the readings of one sensor until its records are all replayed
+    :param sensor: name of the sensor
+    :param device: (bus, address) of the sensor
+    :param decoder: function reading the sensor once through the player
+    :param output: Optional: opened file, one line of json for each reading
+    :return: Dictionary{"readings", "failed readings", "transactions", "bytes", "seconds"}
+    """
+    to_return = {"readings": 0, "failed readings": 0, "transactions": 0, "bytes": 0, "seconds": 0}
+    player.exhausted = False
+    while player.remaining[device] > 0 and not player.exhausted:
+        replayed = player.replayed
+        replayed_bytes = player.bytes
+        start = time.perf_counter()
+        try:
+            reading = decoder()
+        except Exception:
+            reading = None
+            if not player.exhausted:
+                logger.error("Decoder of the " + sensor + " failed (" + str(sys.exc_info()) + ")")
+        to_return["seconds"] += time.perf_counter() - start
+        to_return["transactions"] += player.replayed - replayed
+        to_return["bytes"] += player.bytes - replayed_bytes
+        if player.replayed == replayed:
+            break  # the decoder does not use the records left (f-e initialization of the sensor)
+        if player.exhausted:
+            break  # the capture stopped in the middle of this reading
+        to_return["readings"] += 1
+        if failed(reading):
+            to_return["failed readings"] += 1
+        if output is not None:
+            output.write(json.dumps({"sensor": sensor, "time": player.time, "reading": reading}, default=str) + "\n")
+    return to_return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a capture of the raw bus traffic through the decoders")
+    parser.add_argument("capture", help="-capture.bin file (see 'Capture raw bus traffic' in the settings)")
+    parser.add_argument("--sensor", action="append", default=None,
+                        choices=["OPC-N3", "CO2", "flow meter", "AFE", "GPS"],
+                        help="sensor to replay, can be given several times (default: all)")
+    parser.add_argument("--output", default=None, help="store the decoded readings in this file (json lines)")
+    parser.add_argument("--verbose", action="store_true", help="show the messages of the drivers")
+    arguments = parser.parse_args()
+
+    # before the drivers, which would log in the file of the session
+    logging.basicConfig(level=logging.DEBUG if arguments.verbose else logging.WARNING,
+                        format='%(name)-12s: %(levelname)-8s %(message)s')
+    install(arguments.capture)
+    time.sleep = lambda seconds: None  # as fast as possible: no waiting in the drivers (this process only)
+
+    with contextlib.ExitStack() as stack:
+        if not arguments.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        sensors = decoders()
+        output = stack.enter_context(open(arguments.output, "w")) if arguments.output is not None else None
+        results = {}
+        for sensor in arguments.sensor or sensors:
+            device, decoder = sensors[sensor]
+            if player.remaining[device] > 0:
+                results[sensor] = replay(sensor, device, decoder, output)
+
+    print("\n################ REPLAY ################")
+    print("%-12s %9s %7s %13s %10s %10s %12s" % ("sensor", "readings", "failed", "transactions", "kB", "seconds",
+                                                 "readings/s"))
+    for sensor in results:
+        result = results[sensor]
+        print("%-12s %9d %7d %13d %10.1f %10.3f %12.1f" % (
+            sensor, result["readings"], result["failed readings"], result["transactions"], result["bytes"] / 1000,
+            result["seconds"], result["readings"] / result["seconds"] if result["seconds"] else 0))
+    not_replayed = sum(player.remaining.values())
+    if not_replayed:
+        print(not_replayed, "records not used by the decoders (initialization, status...)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,584 @@
+#! /home/pi/seacanairy_project/venv/bin/python3
+"""
+Rotation of the -data.csv, -metrics.csv and -log.log files of the sampling session and of the dedicated files of the
+sensors
+(see 'Rotate the data and log files' in the settings), so that the file being written stays small and cheap to
+append to:
+    - daily: a new file is started at midnight (local time)
+    - size: a new file is started when the file reaches the maximal size
+The closed file is renamed <Sampling session name>-<data, metrics, log or sensor>-<YYYYmmdd-HHMMSS of its first
+line>.<csv or log>
+and compressed in the background (gzip, or zstd if 'zstandard' is installed: pip3 install zstandard)
+<Sampling session name>-manifest.csv lists each closed file with the time of its first and last line, so that a
+reader can open the files of a time range only, without decompressing the others (see 'segments()')
+The files left uncompressed (Seacanairy stopped during the compression) are compressed at the next start
+
+Reading a time range of the data (csv, on the screen or in a file):
+    python3 rotation.py <session folder> [--start "2026-10-18 14:00"] [--end "2026-10-18 15:00"] [--output <file>]
+    python3 rotation.py <session folder> --list
+"""
+
+import argparse
+import csv  # for storing data in file
+import glob
+import gzip
+import io
+import os  # to be able to create new files/folders
+import queue
+import shutil
+import sys
+import threading
+import time
+import logging  # save logger messages into memory
+from datetime import datetime
+
+import streams  # date format, -data.csv file kept open
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Rotation'
+logger = logging.getLogger('Rotation')
+
+# When a new file is started: never (the files grow forever), daily (at midnight), size (see 'max_size')
+policies = ["never", "daily", "size"]
+
+# Compression of the closed files
+compressions = ["none", "gzip", "zstd"]
+suffixes = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Extension of the files of each kind, the dedicated files of the sensors are named after them (see 'SensorStream')
+extensions = {"data": ".csv", "metrics": ".csv", "log": ".log"}
+extensions.update({name: ".csv" for name in streams.file_names.values()})
+
+# Date of the lines of the -log.log file, without year (see 'seacanairy.py' and 'set_logger()' of the drivers)
+log_date_formats = ["%d-%m %H:%M:%S", "%d-%m %H:%M"]
+
+manifest_header = ["file", "kind", "first time", "last time", "size (bytes)"]
+
+
+def import_zstandard():
+    """
+    :return: zstandard module, imported only when the zstd compression is used
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("'zstandard' is required by the zstd compression of the rotated files "
+                          "(pip3 install zstandard)")
+    return zstandard
+
+
+def open_text(file):
+    """
+    :param file: file of the session, compressed or not
+    :return: file opened for reading text, decompressed on the fly
+    """
+    if file.endswith(suffixes["gzip"]):
+        return gzip.open(file, mode="rt", newline="")
+    if file.endswith(suffixes["zstd"]):
+        return io.TextIOWrapper(import_zstandard().ZstdDecompressor().stream_reader(open(file, "rb"),
+                                                                                    closefd=True), newline="")
+    return open(file, newline="")
+
+
+def line_time(line, kind, year):
+    """
+    :param line: line of a data or log file
+    :param kind: "data", "metrics", "log" or name of the file of a sensor (same date as "data")
+    :param year: year of the log lines (which don't contain it)
+    :return: datetime of the line, None if the line has no time (header, "NEW SESSION"...)
+    """
+    if kind != "log":
+        try:
+            return datetime.strptime(line.split(",", 1)[0], streams.date_format)
+        except ValueError:
+            return None
+    for date_format in log_date_formats:
+        try:
+            return datetime.strptime(str(year) + " " + line[:len(datetime(2000, 12, 31).strftime(date_format))],
+                                     "%Y " + date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def parse_time(text):
+    """
+    :param text: time written in the manifest, can be empty
+    :return: datetime, the smallest one if the time is unknown
+    """
+    return datetime.strptime(text, streams.date_format) if text else datetime.min
+
+
+def time_range(file, kind):
+    """
+    Time of the first and of the last line of an uncompressed file, only the start and the end of the file are read
+    :param file: data or log file
+    :param kind: "data" or "log"
+    :return: (first datetime, last datetime), None for each if the file has no line with a time
+    """
+    year = datetime.fromtimestamp(os.path.getmtime(file)).year
+    first = None
+    with open(file, newline="") as text_file:
+        for line in text_file:
+            first = line_time(line, kind, year)
+            if first is not None:
+                break
+    last = None
+    with open(file, "rb") as binary_file:
+        size = binary_file.seek(0, os.SEEK_END)
+        binary_file.seek(max(0, size - 65536))
+        lines = binary_file.read().decode(errors="replace").splitlines()
+        for line in reversed(lines[1:] if size > 65536 else lines):  # the first line read may be cut
+            last = line_time(line, kind, year)
+            if last is not None:
+                break
+    if first is not None and last is not None and last < first and kind == "log":
+        last = last.replace(year=last.year + 1)  # the segment of the log goes through the new year
+    return first, last
+
+
+class Rotation:
+    """
+    Rotation policy and background compression, shared by the -data.csv file and the -log.log file of the session
+    """
+
+    def __init__(self, directory_path, project_name, policy="never", max_size=10, compression="gzip"):
+        """
+        :param directory_path: folder of the sampling session
+        :param project_name: name of the sampling session
+        :param policy: see 'policies'
+        :param max_size: MB, maximal size of a file with the 'size' policy
+        :param compression: see 'compressions'
+        """
+        self.directory_path = directory_path
+        self.project_name = str(project_name)
+        self.manifest = directory_path + "/" + self.project_name + "-manifest.csv"
+        self.lock = threading.Lock()  # the log is rotated from any thread
+        self.pending = queue.Queue()  # files waiting for their compression
+        self.worker = None
+        self.configure(policy, max_size, compression)
+        self.recover()
+
+    def configure(self, policy, max_size, compression):
+        """
+        Change the rotation policy (see '__init__()'), applied to the next rotation
+        :return: nothing
+        """
+        if policy not in policies:
+            raise ValueError("rotation policy must be one of " + str(policies) + ", not '" + str(policy) + "'")
+        if compression not in compressions:
+            raise ValueError("compression must be one of " + str(compressions) + ", not '" + str(compression) + "'")
+        if compression == "zstd":
+            import_zstandard()  # fail when the setting is applied if it is missing
+        self.policy = policy
+        self.max_size = max_size * 1000000
+        self.compression = compression
+
+    def due(self, size, day):
+        """
+        :param size: bytes written in the current file
+        :param day: date of the first line of the current file, None if the file is empty
+        :return: True if a new file must be started before writing
+        """
+        if self.policy == "daily":
+            return day is not None and day != datetime.now().date()
+        if self.policy == "size":
+            return size >= self.max_size
+        return False
+
+    # ---------------------------------------------------------------------
+    # MANIFEST
+
+    def read_manifest(self):
+        """
+        :return: Dictionary{file name: Dictionary{column of 'manifest_header': value}}
+        """
+        if not os.path.isfile(self.manifest):
+            return {}
+        with open(self.manifest, newline="") as manifest_file:
+            return {line["file"]: line for line in csv.DictReader(manifest_file)}
+
+    def write_manifest(self, entries):
+        """
+        Replace the manifest (written next to it, then renamed: never half written)
+        :param entries: see 'read_manifest()'
+        :return: nothing
+        """
+        temporary = self.manifest + ".tmp"
+        with open(temporary, mode="w", newline="") as manifest_file:
+            writer = csv.DictWriter(manifest_file, fieldnames=manifest_header)
+            writer.writeheader()
+            writer.writerows(sorted(entries.values(),
+                                    key=lambda entry: (entry["kind"], parse_time(entry["first time"]))))
+        os.replace(temporary, self.manifest)
+
+    def register(self, file, kind, first=None, last=None):
+        """
+        Add or update a closed file in the manifest
+        :param file: path of the file
+        :param kind: "data" or "log"
+        :param first: Optional: datetime of its first line, the previous value is kept if not given
+        :param last: Optional: datetime of its last line
+        :return: nothing
+        """
+        with self.lock:
+            entries = self.read_manifest()
+            name = os.path.basename(file)
+            entry = entries.get(name, {"file": name, "kind": kind, "first time": "", "last time": ""})
+            if first is not None:
+                entry["first time"] = first.strftime(streams.date_format)
+            if last is not None:
+                entry["last time"] = last.strftime(streams.date_format)
+            entry["size (bytes)"] = os.path.getsize(file)
+            entries[name] = entry
+            self.write_manifest(entries)
+
+    def rename(self, old_file, new_file):
+        """
+        Replace the name of a file in the manifest (after its compression)
+        :return: nothing
+        """
+        with self.lock:
+            entries = self.read_manifest()
+            entry = entries.pop(os.path.basename(old_file), None)
+            if entry is None:
+                return
+            entry["file"] = os.path.basename(new_file)
+            entry["size (bytes)"] = os.path.getsize(new_file)
+            entries[entry["file"]] = entry
+            self.write_manifest(entries)
+
+    # ---------------------------------------------------------------------
+    # ROTATION AND COMPRESSION
+
+    def archive(self, file, kind):
+        """
+        Rename a closed file after the time of its first line, add it to the manifest and compress it in the
+        background (nothing is logged here: it is also called by the handler of the log file)
+        :param file: -data.csv or -log.log file, closed
+        :param kind: "data" or "log"
+        :return: new path of the file
+        """
+        first, last = time_range(file, kind)
+        stamp = (first or datetime.now()).strftime("%Y%m%d-%H%M%S")
+        segment = self.directory_path + "/" + self.project_name + "-" + kind + "-" + stamp + extensions[kind]
+        while glob.glob(glob.escape(segment) + "*"):  # two files starting during the same second
+            segment = segment[:-len(extensions[kind])] + "-" + extensions[kind]
+        os.rename(file, segment)
+        self.register(segment, kind, first, last)
+        self.compress(segment)
+        return segment
+
+    def compress(self, file):
+        """
+        Compress a closed file in the background thread (nothing if the compression is 'none')
+        :param file: path of the file
+        :return: nothing
+        """
+        if self.compression == "none":
+            return
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run, name="compression", daemon=True)
+            self.worker.start()
+        self.pending.put((file, self.compression))
+
+    def run(self):
+        """
+        Background thread: compress the files waiting, one after the other
+        """
+        while True:
+            file, compression = self.pending.get()
+            try:
+                compressed = file + suffixes[compression]
+                temporary = compressed + ".part"
+                with open(file, "rb") as source, open(temporary, "wb") as destination:
+                    if compression == "zstd":
+                        with import_zstandard().ZstdCompressor(level=3).stream_writer(destination,
+                                                                                       closefd=False) as writer:
+                            shutil.copyfileobj(source, writer)
+                    else:
+                        with gzip.GzipFile(filename=os.path.basename(file), mode="wb", fileobj=destination) as writer:
+                            shutil.copyfileobj(source, writer)
+                    destination.flush()
+                    os.fsync(destination.fileno())
+                os.replace(temporary, compressed)
+                os.remove(file)
+                self.rename(file, compressed)
+                logger.debug("'" + os.path.basename(file) + "' compressed")
+            except Exception:
+                logger.error("Failed to compress '" + str(file) + "' (" + str(sys.exc_info()[1]) + ")")
+            finally:
+                self.pending.task_done()
+
+    def recover(self):
+        """
+        At the start: add to the manifest the closed files missing in it and compress the ones left uncompressed
+        :return: nothing
+        """
+        for temporary in glob.glob(glob.escape(self.directory_path + "/" + self.project_name) + "-*.part"):
+            os.remove(temporary)  # compression interrupted, the uncompressed file is still there
+        entries = self.read_manifest()
+        for kind in extensions:
+            pattern = glob.escape(self.directory_path + "/" + self.project_name + "-" + kind + "-") + "[0-9]*" + \
+                extensions[kind]
+            for file in sorted(glob.glob(pattern) + glob.glob(pattern + ".*")):
+                if os.path.basename(file) not in entries:
+                    self.register(file, kind, *(time_range(file, kind) if file.endswith(extensions[kind])
+                                                else (None, None)))
+                if file.endswith(extensions[kind]):
+                    self.compress(file)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the compressions (when the Seacanairy stops), the ones not finished are done at the next
+        start
+        :param timeout: Optional: seconds
+        :return: True if all the files are compressed
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.pending.unfinished_tasks:
+            if end is not None and time.monotonic() > end:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+class RotatingCSV(streams.BufferedCSV):
+    """
+    -data.csv file kept open (see 'streams.BufferedCSV'), a new file is started when the rotation policy asks it and
+    when the columns change (sensor activated or deactivated while running, file of an older layout)
+    """
+
+    def __init__(self, file, rotation, flush_rows=1, flush_interval=0, fsync_policy="never", journal=None,
+                 kind="data"):
+        """
+        :param file: path of the -data.csv file
+        :param rotation: Rotation
+        :param flush_rows, flush_interval, fsync_policy, journal: see 'streams.BufferedCSV'
+        :param kind: Optional: kind of the file (see 'extensions')
+        """
+        super().__init__(file, flush_rows, flush_interval, fsync_policy, journal)
+        self.rotation = rotation
+        self.kind = kind
+        with open(file, newline='') as data_file:
+            self.version, self.header, column_kinds = streams.read_header(csv.reader(data_file, delimiter=',',
+                                                                                     quotechar='"'))
+        self.day = self.first_day()
+
+    def first_day(self):
+        """
+        :return: date of the first line of the current file, None if it has no data yet
+        """
+        if self.data_file.tell() == 0:
+            return None
+        first = time_range(self.file, self.kind)[0]
+        return first.date() if first is not None else None
+
+    def writerow(self, to_write, header):
+        """
+        Add a row (see 'streams.BufferedCSV'), in a new file if the current one must be rotated
+        :param to_write: List[values]
+        :param header: List[headers of the columns of the row] (see 'streams.cycle_header()')
+        :return: nothing
+        """
+        header = list(header)
+        if self.header and (header != self.header or self.version != streams.schema_version):
+            if self.day is None and not self.rows:  # headers only, no data to keep
+                self.data_file.truncate(0)
+                self.header = []
+            else:
+                self.rotate()  # the rows kept in memory are written in the previous file
+        elif self.rotation.due(self.data_file.tell(), self.day):
+            self.rotate()
+        if not self.header:
+            self.writer.writerow(streams.schema_row(header))
+            self.writer.writerow(header)
+            self.data_file.flush()
+            self.version = streams.schema_version
+            self.header = header
+        if self.day is None:
+            self.day = datetime.now().date()
+        super().writerow(to_write, self.header)
+
+    def rotate(self):
+        """
+        Close the current file, archive it (see 'Rotation.archive()') and start a new one, its headers are written
+        with its first row
+        :return: nothing
+        """
+        self.close()
+        segment = self.rotation.archive(self.file, self.kind)
+        logger.info("'" + os.path.basename(self.file) + "' rotated to '" + os.path.basename(segment) + "'")
+        self.data_file = open(self.file, mode='a', newline='')
+        self.writer = csv.writer(self.data_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.header = []
+        self.day = None
+
+
+class SensorStream(RotatingCSV):
+    """
+    Time-indexed csv file of one sensor: <Sampling session name>-<name of the file of the sensor>.csv
+    One line for each reading of the sensor, kept open and rotated like the -data.csv file
+    """
+
+    def __init__(self, directory_path, project_name, sensor, rotation, flush_rows=1, flush_interval=0,
+                 fsync_policy="never", journal=None):
+        """
+        :param directory_path: folder of the sampling session
+        :param project_name: name of the sampling session
+        :param sensor: name of the sensor (see 'streams.columns')
+        :param rotation, flush_rows, flush_interval, fsync_policy, journal: see 'RotatingCSV'
+        """
+        self.sensor = sensor
+        self.columns = ["Date/Time"] + streams.header(sensor)
+        file = stream_file(directory_path, project_name, sensor)
+        if not os.path.isfile(file):
+            logger.info("Initializing data file " + str(file))
+        super().__init__(file, rotation, flush_rows, flush_interval, fsync_policy, journal, streams.file_names[sensor])
+
+    def append(self, timestamp, data):
+        """
+        Store one reading of the sensor
+        :param timestamp: time of the reading ('time.time()' format)
+        :param data: dictionary returned by the driver
+        :return: nothing
+        """
+        now = datetime.fromtimestamp(timestamp).strftime(streams.date_format)
+        self.writerow([now] + streams.row(self.sensor, data), self.columns)
+
+
+def stream_file(directory_path, project_name, sensor):
+    """
+    :param directory_path: folder of the sampling session
+    :param project_name: name of the sampling session
+    :param sensor: name of the sensor (see 'streams.file_names')
+    :return: path of the dedicated file of the sensor
+    """
+    return directory_path + "/" + str(project_name) + "-" + streams.file_names[sensor] + extensions["data"]
+
+
+class RotatingLog(logging.FileHandler):
+    """
+    Handler of the -log.log file, a new file is started when the rotation policy asks it
+    """
+
+    def __init__(self, file, rotation):
+        """
+        :param file: path of the -log.log file
+        :param rotation: Rotation
+        """
+        super().__init__(file, mode='a', encoding="utf-8")
+        self.rotation = rotation
+        self.day = None
+        if os.path.getsize(file) > 0:
+            first = time_range(file, "log")[0]
+            self.day = first.date() if first is not None else None
+
+    def emit(self, record):
+        try:
+            if self.rotation.due(self.stream.tell() if self.stream is not None else 0, self.day):
+                self.rotate()
+            if self.day is None:
+                self.day = datetime.now().date()
+        except Exception:
+            self.handleError(record)
+        super().emit(record)
+
+    def rotate(self):
+        """
+        Close the current file, archive it (see 'Rotation.archive()') and start a new one
+        :return: nothing
+        """
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.day = None
+        self.rotation.archive(self.baseFilename, "log")
+        self.stream = self._open()
+
+
+# ---------------------------------------------------------------------
+# READING
+# ---------------------------------------------------------------------
+
+
+def segments(path, kind="data", start=None, end=None):
+    """
+    Files of a session holding the lines of a time range, the others are not opened
+    :param path: session folder
+    :param kind: "data" or "log"
+    :param start: Optional: datetime, included
+    :param end: Optional: datetime, excluded
+    :return: List[paths], in the order of time, the file being written is the last one
+    """
+    entries = []
+    for manifest in glob.glob(os.path.join(glob.escape(path), "*-manifest.csv")):  # none if never rotated
+        with open(manifest, newline="") as manifest_file:
+            entries += [entry for entry in csv.DictReader(manifest_file) if entry["kind"] == kind]
+    files = []
+    for entry in sorted(entries, key=lambda line: parse_time(line["first time"])):
+        if entry["first time"] and end is not None and parse_time(entry["first time"]) >= end:
+            continue
+        if entry["last time"] and start is not None and parse_time(entry["last time"]) < start:
+            continue
+        files.append(os.path.join(path, entry["file"]))
+    return files + sorted(glob.glob(os.path.join(glob.escape(path), "*-" + kind + extensions[kind])))
+
+
+def rows(path, start=None, end=None):
+    """
+    Lines of the data of a time range, read from the files holding it only
+    :param path: session folder
+    :param start: Optional: datetime, included
+    :param end: Optional: datetime, excluded
+    :return: generator of List[values], the headers first: columns of all the files (the sensors activated may
+             change from a file to the other), empty when a column is not in a file
+    """
+    files = segments(path, "data", start, end)
+    header = []  # columns of all the files, in the order in which they appear
+    for file in files:
+        with open_text(file) as text_file:
+            header += [column for column in streams.read_header(csv.reader(text_file, delimiter=',',
+                                                                           quotechar='"'))[1] if column not in header]
+    yield header
+    for file in files:
+        with open_text(file) as text_file:
+            reader = csv.reader(text_file, delimiter=',', quotechar='"')
+            file_columns = streams.column_map(*streams.read_header(reader)[1:])
+            positions = [file_columns[column][0] if column in file_columns else None for column in header]
+            for row in reader:
+                row_time = line_time(row[0] if row else "", "data", None)
+                if row_time is None or (start is not None and row_time < start) or \
+                        (end is not None and row_time >= end):
+                    continue
+                yield ["" if position is None or position >= len(row) else row[position] for position in positions]
+
+
+def main():
+    import database  # date and time given by the user
+
+    parser = argparse.ArgumentParser(description="Read a time range of the rotated data files of a session")
+    parser.add_argument("path", help="session folder")
+    parser.add_argument("--list", action="store_true", help="list the files of the time range")
+    parser.add_argument("--kind", default="data", choices=list(extensions), help="with --list (default: data)")
+    parser.add_argument("--start", default=None, help="local date and time, f-e '2026-10-18 14:00'")
+    parser.add_argument("--end", default=None, help="local date and time, excluded")
+    parser.add_argument("--output", default=None, help="csv file (default: on the screen)")
+    arguments = parser.parse_args()
+
+    start = datetime.fromtimestamp(database.timestamp(arguments.start)) if arguments.start else None
+    end = datetime.fromtimestamp(database.timestamp(arguments.end)) if arguments.end else None
+    if arguments.list:
+        for file in segments(arguments.path, arguments.kind, start, end):
+            print(file)
+        return
+
+    output = open(arguments.output, mode='w', newline='') if arguments.output else sys.stdout
+    writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerows(rows(arguments.path, start, end))
+    if arguments.output:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
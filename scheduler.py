@@ -0,0 +1,189 @@
+"""
+Deadline scheduler of the sampling cycles
+Each cycle starts on a slot of the clock (multiple of the sampling period since midnight 01/01/1970 UTC),
+so that the measurements of different Seacanairy are taken at the same time without post-processing
+(f-e every :00 of the minute for a sampling period of 60 seconds)
+"""
+
+import asyncio
+import math
+import time
+import logging  # save logger messages into memory
+
+# What to do when a cycle takes longer than the sampling period
+SKIP = "skip"  # wait for the next free slot, the missed slots are counted as skipped
+CATCH_UP = "catch up"  # start the missed slots right away, one after the other, until the schedule is caught up
+# (the measurements of the missed slots are dated with their effective start, see 'DeadlineScheduler.wait()')
+STRETCH = "stretch"  # start right away and shift all the next slots (same as before, the phase is lost)
+
+policies = [SKIP, CATCH_UP, STRETCH]
+
+max_catch_up = 10  # maximal number of late slots executed in catch up mode, the older ones are skipped
+
+clock_step_tolerance = 0.5  # seconds, above this change between the system clock and the monotonic clock
+# we consider that the system time has been set (RTC, internet or 'set_system_time.sh')
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Scheduler'
+logger = logging.getLogger('Scheduler')
+
+
+class DeadlineScheduler:
+    """
+    Compute the starting time of each sampling cycle and wait for it
+    The slots are computed on the system clock (to be aligned between different units),
+    the waiting is done on the monotonic clock (not affected by a change of the system time during the wait)
+    """
+
+    def __init__(self, period, align=True, policy=SKIP, verbose=True):
+        """
+        :param period: sampling period (seconds)
+        :param align: True to start the cycles on the multiples of the period on the clock,
+                        False to start the first cycle right away
+        :param policy: what to do when a cycle overruns, 'skip', 'catch up' or 'stretch'
+        :param verbose: False to not print the waiting time on the screen (sensors read every few seconds)
+        """
+        if policy not in policies:
+            raise ValueError("Overrun policy must be one of " + str(policies) + ", not '" + str(policy) + "'")
+        self.period = period
+        self.align = align
+        self.policy = policy
+        self.verbose = verbose
+        self.origin = 0 if align else None  # system time of the slot number 0
+        self.slot = None  # number of the slot of the current cycle
+        self.last_start = None  # system time at which the current cycle has started
+        self.caught_up = False  # True if the current cycle is a missed slot started late (catch up policy)
+        self.clock_offset = None  # difference between the system clock and the monotonic clock
+
+        # counters exposed with the data
+        self.overruns = 0  # number of cycles which finished after the start of the next slot
+        self.skipped = 0  # number of slots without measurement
+        self.jitter = 0  # difference between the effective start and the slot of the current cycle (seconds)
+        self.max_jitter = 0  # biggest jitter since the start of the software (seconds)
+        self.clock_steps = 0  # number of times the system time has been changed
+
+    def reconfigure(self, period, align, policy):
+        """
+        Change the sampling period, the alignment or the overrun policy while running
+        The next cycle starts on a slot of the new period (counters are kept)
+        :param period: sampling period (seconds)
+        :param align: True to start the cycles on the multiples of the period on the clock
+        :param policy: what to do when a cycle overruns, 'skip', 'catch up' or 'stretch'
+        :return: nothing
+        """
+        if policy not in policies:
+            raise ValueError("Overrun policy must be one of " + str(policies) + ", not '" + str(policy) + "'")
+        if period != self.period or align != self.align:
+            self.origin = 0 if align else None
+            self.slot = None  # the next slot is computed as for the first cycle
+        self.period = period
+        self.align = align
+        self.policy = policy
+
+    def slot_time(self, slot):
+        """
+        :param slot: number of the slot
+        :return: system time ('time.time()') at which the slot starts
+        """
+        return self.origin + slot * self.period
+
+    def next_slot(self, now):
+        """
+        Find the slot of the next cycle, apply the overrun policy if the previous cycle took too long
+        :param now: current system time ('time.time()')
+        :return: number of the slot
+        """
+        self.caught_up = False
+        if self.slot is None:  # first cycle
+            if self.origin is None:
+                self.origin = now  # start right away
+                return 0
+            return math.ceil((now - self.origin) / self.period)
+
+        slot = self.slot + 1
+        late = now - self.slot_time(slot)
+        if late <= 0:
+            return slot  # on time
+
+        if self.slot_time(slot) > self.last_start:  # the previous cycle has overrun its slot
+            self.overruns += 1
+            logger.error("Sampling cycle took " + str(round(now - self.last_start, 1)) + " seconds, " +
+                         str(round(late, 1)) + " seconds more than the sampling period (" +
+                         str(round(self.period, 0)) + " seconds), overrun policy is '" + str(self.policy) + "'")
+
+        if self.policy == SKIP:
+            next_free = math.ceil((now - self.origin) / self.period)
+            self.skipped += next_free - slot
+            if next_free - slot > 0:
+                logger.warning("Skipping " + str(next_free - slot) + " slot(s), next measurement at " +
+                               time.strftime("%H:%M:%S", time.localtime(self.slot_time(next_free))))
+            return next_free
+
+        elif self.policy == CATCH_UP:
+            behind = math.floor(late / self.period)  # number of slots which should already have been started
+            if behind >= max_catch_up:
+                self.skipped += behind - max_catch_up + 1
+                logger.warning("Too late to catch up, skipping " + str(behind - max_catch_up + 1) + " slot(s)")
+                slot += behind - max_catch_up + 1
+            self.caught_up = True
+            return slot  # start right away
+
+        else:  # STRETCH
+            self.origin = now - slot * self.period  # shift the next slots
+            return slot
+
+    def check_clock(self):
+        """
+        Detect a change of the system time (the slots are computed on the system time)
+        :return: nothing
+        """
+        offset = time.time() - time.monotonic()
+        if self.clock_offset is not None and abs(offset - self.clock_offset) > clock_step_tolerance:
+            self.clock_steps += 1
+            logger.warning("System time has changed by " + str(round(offset - self.clock_offset, 1)) +
+                           " seconds, slots are computed on the new time")
+        self.clock_offset = offset
+
+    async def wait(self):
+        """
+        Wait for the start of the next slot (sleep only once)
+        :return: system time ('time.time()') to be used as the date/time of the measurement: the time of the slot,
+                 or the effective start if a missed slot is caught up (nothing was measured at the time of the slot,
+                 the slot is given by 'caught_up' and 'jitter')
+        """
+        self.check_clock()
+        now = time.time()
+        slot = self.next_slot(now)
+        deadline = self.slot_time(slot)
+
+        to_wait = deadline - now
+        if to_wait > 0:
+            if self.verbose:
+                print("Waiting before next measurement:", int(round(to_wait, 0)), "seconds (sampling time is set on",
+                      self.period, "seconds)")
+            # the monotonic clock does not follow the changes of the system time during the waiting
+            await asyncio.sleep(deadline - self.clock_offset - time.monotonic())
+
+        self.last_start = time.time()
+        self.jitter = self.last_start - deadline
+        self.max_jitter = max(self.max_jitter, self.jitter)
+        self.slot = slot
+        if self.verbose:
+            print("Starting new sample...")
+        if self.caught_up:
+            return self.last_start
+        return deadline
+
+    def counters(self):
+        """
+        :return: Dictionary{"overruns", "skipped slots", "jitter", "max jitter", "clock steps", "caught up"}
+                 (jitter in ms, caught up = 1 if the current cycle is a missed slot started late, otherwise 0)
+        """
+        return {
+            "caught up": int(self.caught_up),
+            "overruns": self.overruns,
+            "skipped slots": self.skipped,
+            "jitter": round(self.jitter * 1000, 1),
+            "max jitter": round(self.max_jitter * 1000, 1),
+            "clock steps": self.clock_steps
+        }
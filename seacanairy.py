@@ -7,12 +7,19 @@ the OPC-N3, the AFE board, the GPS, stop the pump, and store the whole in a file
 # import all libraries
 import time
 from datetime import date, datetime, timedelta
-import csv  # for storing data in file
 from progress.bar import IncrementalBar  # to show beautiful loading bar on the screen during sampling
 import os  # to be able to create new files/folders and see the current path
-import yaml  # to read the settings stored in the 'seacanairy_settings.yaml' file
+import config  # to read the settings stored in the 'seacanairy_settings.yaml' file (see 'config.py')
 import logging  # to store the errors messages in a separate log file
-import threading
+import sys  # to get the errors
+import asyncio  # to read the sensors at the same time
+import signal  # to stop properly when the system asks it ('kill', 'systemctl stop')
+import engine  # acquisition engine, one coroutine per sensor
+import scheduler  # start the measurements on the slots of the clock
+import streams  # columns of the sensors
+import metrics  # retries, checksum failures and back-off of each stage of the cycle (-metrics.csv file)
+import exporter  # metrics endpoint (Prometheus text format)
+import rotation  # new data, log and sensor files when they are too old or too big, compression of the closed files
 
 # ---------------------------------------
 # HELLO
@@ -38,48 +45,86 @@ print("\n################ FILES #################")
 
 current_working_directory = str(os.getcwd())  # returns the path where the python script is currently running
 
-with open(current_working_directory + '/seacanairy_settings.yaml') as file:
-    settings = yaml.safe_load(file)  # load all the yaml file in a dictionary
-    file.close()  # always close the file after use
+settings = config.load()  # read and check the yaml file, same settings object for all the modules
+
+# Simulated sensors instead of the real ones (f-e to test the software on a computer, see 'simulator.py')
+# must be done before importing the drivers
+hardware_backend = settings.seacanairy.hardware_backend
+if hardware_backend == "simulated":
+    import simulator
+    simulator.install()
 
 # Sampling period
-sampling_period = settings['Seacanairy settings']['Sampling period']
+sampling_period = settings.seacanairy.sampling_period
 
 # CO2 sampling period (CO2 sensor takes samples automatically)
-CO2_sampling_period = int(sampling_period / settings['CO2 sensor']['Automatic sampling frequency ' \
-                                                                   '(number of sample during the above sampling period)'])
+CO2_sampling_period = int(sampling_period / settings.CO2.automatic_sampling_frequency)
 
 # Amount of time required for the CO2 sensor to take the measurement
-CO2_startup_delay = settings['CO2 sensor']['Amount of time required for the sensor to take the measurement']
+CO2_startup_delay = settings.CO2.measurement_delay
 
 # Name of the research (f-e 'Air measurement in my room')
-project_name = settings['Seacanairy settings']['Sampling session name']
+project_name = settings.seacanairy.session_name
 
 # Amount of time while the OPCN3 fan keep running without measurement to flush fresh air inside the casing
-OPC_flushing_time = settings['OPC-N3 sensor']['Flushing time']
+OPC_flushing_time = settings.OPCN3.flushing_time
 
 # Amount of time the OPCN3's laser takes PM sample
-OPC_sampling_time = settings['OPC-N3 sensor']['Sampling time']
+OPC_sampling_time = settings.OPCN3.sampling_time
 
 # OPCN3 Fan speed (0-100)
-OPC_fan_speed = settings['OPC-N3 sensor']['Fan speed']
+OPC_fan_speed = settings.OPCN3.fan_speed
 
 # Number of reading AFE must take and average
-AFE_readings_averaged = settings['AFE Board']['Noise reduction - number of reading averaged']
+AFE_readings_averaged = settings.AFE.readings_averaged
 
 # Let the user choose if he want to activate the following sensor or not
 # Seen the problems encountered with GPS and OPCN3, could be good to disable the unnecessary sensors (GPS f-e)
 # This does not shut down the sensor powering
-CO2_activation = settings['CO2 sensor']['Activate this sensor']
-OPCN3_activation = settings['OPC-N3 sensor']['Activate this sensor']
-GPS_activation = settings['GPS']['Activate this sensor']
-AFE_activation = settings['AFE Board']['Activate this sensor']
-air_pump_activation = settings['Seacanairy settings']['Activate M&C air pump']
-flow_sensor_activation = settings['Air flow sensor']['Activate this sensor']
-OPCN3_flow_measurement = settings['Air flow sensor']['Measure during OPCN3 measurement']
+CO2_activation = settings.CO2.activation
+OPCN3_activation = settings.OPCN3.activation
+GPS_activation = settings.GPS.activation
+AFE_activation = settings.AFE.activation
+air_pump_activation = settings.seacanairy.air_pump_activation
+flow_sensor_activation = settings.flow.activation
+OPCN3_flow_measurement = settings.flow.OPCN3_flow_measurement
 
 # Air pump settings
-fresh_air_piping_flushing_time = settings['Seacanairy settings']['Flushing time before measurement']
+fresh_air_piping_flushing_time = settings.seacanairy.piping_flushing_time
+
+# Start the measurements on the multiples of the sampling period on the clock (f-e every :00 of the minute)
+align_on_clock = settings.seacanairy.align_on_clock
+
+# What to do if a measurement takes longer than the sampling period ('skip', 'catch up' or 'stretch')
+overrun_policy = settings.seacanairy.overrun_policy
+
+# Start the next measurement (pump, OPC-N3 flushing) while the GPS, the CO2 sensor and the csv file of the
+# previous measurement are finishing
+pipelined_cycles = settings.seacanairy.pipelined_cycles
+
+# Store the aligned cycle row (all the sensors on the same line) in the -data.csv file
+write_cycle_row = settings.seacanairy.write_cycle_row
+
+# Store the start, the end, the retries, the checksum failures and the back-off of each sensor in the -metrics.csv file
+write_metrics = settings.seacanairy.write_metrics
+
+# Give the live performance of the acquisition on http://<address>:<port>/metrics, port 0 = disabled
+metrics_port = settings.seacanairy.metrics_port
+metrics_address = settings.seacanairy.metrics_address
+
+# Sampling period of the sensors which are read at their own rate (f-e GPS every second)
+# 0 = the sensor is read once per sampling cycle, like the OPC-N3 (pumped air) when it is not streaming
+own_sampling_periods = {
+    "OPC-N3": settings.OPCN3.streaming_period,
+    "CO2": settings.CO2.sampling_period,
+    "AFE": settings.AFE.sampling_period,
+    "flow meter": settings.flow.sampling_period,
+    "GPS": settings.GPS.sampling_period
+}
+
+if own_sampling_periods["CO2"] != 0:
+    # the CO2 sensor takes its samples automatically at its own sampling period
+    CO2_sampling_period = own_sampling_periods["CO2"]
 
 # -----------------------------------------
 # CREATE FILES
@@ -103,6 +148,16 @@ else:
     file_logfile.close()
 # You can't go further in the program without creating the folder and the logger file
 
+# Rotation of the -data.csv and -log.log files, the closed files are compressed in the background (see 'rotation.py')
+file_rotation = rotation.Rotation(directory_path, project_name, settings.seacanairy.rotation_policy,
+                                  settings.seacanairy.rotation_size, settings.seacanairy.rotation_compression)
+
+# Store every raw transaction of the buses in the -capture.bin file (see 'capture.py' and 'replay.py')
+# must be done before importing the drivers
+if settings.seacanairy.capture_bus_traffic:
+    import capture
+    capture.install(directory_path + "/" + project_name + "-capture.bin")
+
 # -----------------------------------------
 # IMPORT NECESSARY SENSORS
 # -----------------------------------------
@@ -121,12 +176,12 @@ if GPS_activation:
 if AFE_activation:
     import AFE
 
-if air_pump_activation:
-    import RPi.GPIO as GPIO  # to put GPIO high/low to switch the air pump relay on and off
-
 if flow_sensor_activation:
     import flow as flow
 
+if CO2_activation or AFE_activation or flow_sensor_activation:
+    import i2c_bus  # one I²C bus shared by the CO2 sensor, the AFE board and the flow meter
+
 # -----------------------------------------
 # LOGGING
 # -----------------------------------------
@@ -134,12 +189,21 @@ if flow_sensor_activation:
 
 message_level = logging.INFO
 
-# set up logging to file
+# set up logging to file (a new file is started when the rotation policy asks it)
+log_handler = rotation.RotatingLog(log_file, file_rotation)
 logging.basicConfig(level=message_level,
                     format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
                     datefmt='%d-%m %H:%M:%S',
-                    filename=log_file,
-                    filemode='a')
+                    handlers=[log_handler])
+# the drivers imported above may already have set up the logging to the same file (see their 'set_logger()'),
+# their handler is replaced by the one rotating the file
+for handler in list(logging.getLogger().handlers):
+    if type(handler) is logging.FileHandler and handler.baseFilename == log_handler.baseFilename:
+        log_handler.setFormatter(handler.formatter)
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+        if log_handler not in logging.getLogger().handlers:
+            logging.getLogger().addHandler(log_handler)
 # define a Handler which writes INFO messages or higher to the sys.stderr/display
 console = logging.StreamHandler()
 console.setLevel(message_level)
@@ -159,13 +223,25 @@ logger = logging.getLogger('SEACANAIRY')
 # -----------------------------------------
 # Use the GPIO to turn on and off the air pump via relay
 
-if air_pump_activation:
+pump_gpio = 27
+
+
+def pump_setup():
+    """
+    Set the GPIO number 27 as output, air pump relay off
+    :return: nothing
+    """
+    global GPIO
+    import RPi.GPIO as GPIO  # to put GPIO high/low to switch the air pump relay on and off
     GPIO.setwarnings(False)  # avoid messages concerning GPIO (GPIO is already low, blablabla)
     GPIO.setmode(GPIO.BCM)  # use the GPIO names (GPIO1...) instead of the processor pin name (BCM...)
-    pump_gpio = 27
     GPIO.setup(pump_gpio, GPIO.OUT, initial=GPIO.LOW)
 
 
+if air_pump_activation:
+    pump_setup()
+
+
 # -----------------------------------------
 # FUNCTIONS
 # -----------------------------------------
@@ -203,120 +279,90 @@ def pump_stop():
     GPIO.output(pump_gpio, GPIO.LOW)
 
 
-def append_data_to_csv(*data_to_write):
-    """
-    Store all the arguments given in the -data.csv file
-    All arguments will be separated by a coma in the csv file
-    :param data_to_write: unlimited amount of arguments
-    :return: nothing
-    """
-    to_write = []
-    for i in data_to_write:
-        if isinstance(i, list):
-            to_write += i
-        else:
-            to_write += [i]
-
-    # to_write = [*data_to_write]  # Concatenate all the arguments in one list
-
-    with open(csv_file, mode='a', newline='') as data_file:
-        writer = csv.writer(data_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(to_write)
-    data_file.close()  # close file after use(general safety practice)
+# --------------------------------------------
+# MAIN CODE
+# --------------------------------------------
 
+# INITIATE CSV FILE
 
-def wait_timestamp(starting_time):
-    """
-    Wait that the sampling period is passed out to start the next measurement
-    :param starting_time: time at which the measurement has started ('time.time()' required)
-    :return: Nothing, function will stop when the next measurement can start
-    """
-    finishing_time = time.time()
-    next_launching = starting_time + sampling_period  # time at which the next sample should start
+# Create the file to store the data if it doesn't exist
+csv_file = directory_path + "/" + str(project_name) + "-data.csv"
 
-    # if the sampling process took more time than the expected sampling period
-    if finishing_time >= next_launching:
-        logger.error("Sampling cycle took " + str(round((finishing_time - next_launching), 1)) +
-                     "seconds more than expected (" + str(round(sampling_period, 0)) + " seconds)")
-        print("Starting new sample...")
-        return  # function stop and new sample start
+# Storage of the aligned cycle rows: 'csv' (-data.csv file), 'columnar' (see 'columnar.py') or 'sqlite' (see
+# 'database.py')
+data_backend = settings.seacanairy.data_backend
 
-    while True:
-        now = time.time()
-        for i in range(10):
-            if now < next_launching:
-                time.sleep(.1)
-            else:
-                break
-        to_wait = round(next_launching - now, 0)  # amount of time system will wait
-        print("Waiting before next measurement:", int(to_wait), "seconds (sampling time is set on",
-              sampling_period,
-              "seconds)  ", end="\r")
-        if not now < next_launching:
-            break
+data_file = None  # -data.csv file kept open (see 'rotation.RotatingCSV'), opened by 'initialize_csv_file()'
 
-    # Delete the waiting countdown and skip a line
-    # Print a whole blank to remove completely the previous line ("Waiting before next measurement...")
-    print("                                                                                    ")
-    print("Starting new sample...")
-    return  # function stop and new sample start
 
+def initialize_csv_file():
+    """
+    Open the -data.csv file and keep it open, the column headers of the sensors activated are written with the
+    first row
+    (or the columnar data file, see 'Data storage backend' in 'seacanairy_settings.yaml')
+    :return: nothing
+    """
+    global data_file
+    if data_backend == "columnar":
+        if data_file is None:
+            import columnar  # only if needed, requires 'pyarrow'
+            data_file = columnar.ColumnarWriter(directory_path, project_name, settings.seacanairy.data_flush_rows,
+                                                settings.seacanairy.data_flush_interval,
+                                                settings.seacanairy.data_fsync)
+        return
+    if data_backend == "sqlite":
+        if data_file is None:
+            import database
+            data_file = database.SessionDatabase(directory_path, project_name, settings.seacanairy.data_flush_rows,
+                                                 settings.seacanairy.data_flush_interval,
+                                                 settings.seacanairy.data_fsync)
+        return
+
+    new_file = not os.path.isfile(csv_file)
+    if data_file is None:
+        # the schema line and the column headers are written with the first row, the file is rotated if the
+        # columns are not the same (see 'rotation.RotatingCSV')
+        data_file = rotation.RotatingCSV(csv_file, file_rotation, settings.seacanairy.data_flush_rows,
+                                         settings.seacanairy.data_flush_interval, settings.seacanairy.data_fsync,
+                                         file_journal(csv_file))
+    if new_file:  # if the file doesn't exist
+        print("Initializing data file", csv_file)
+
+    else:
+        logger.info("'" + str(csv_file) + "' already exist")
+        logger.info("Appending data to this file")
+
+
+def close_csv_file():
+    """
+    Write the rows kept in memory and close the -data.csv file (when the Seacanairy stops)
+    :return: nothing
+    """
+    global data_file
+    if data_file is not None:
+        data_file.close()
+        data_file = None
 
-# --------------------------------------------
-# MAIN CODE
-# --------------------------------------------
 
-# INITIATE CSV FILE
+def file_journal(file):
+    """
+    Journal of the rows of a csv file kept in memory (see 'Journal of the rows kept in memory' in the settings), the
+    rows lost by a power cut are written in the file first
+    :param file: path of the csv file (-data.csv, -metrics.csv or dedicated file of a sensor)
+    :return: journal.Journal, None if the journal is not activated
+    """
+    if not settings.seacanairy.data_journal:
+        return None
+    import journal  # rows kept in memory also forced in the .journal file
+    to_return = journal.Journal(file[:-len(".csv")] + journal.extension)
+    to_return.recover(file)  # rows lost by a power cut
+    return to_return
 
-# Create the file to store the data if it doesn't exist
-csv_file = directory_path + "/" + str(project_name) + "-data.csv"
-if not os.path.isfile(csv_file):  # if the file doesn't exist
-    os.mknod(csv_file)  # create the file
-    print("Initializing data file", csv_file)
-    # Write a first line to the file, this will be the column headers
-    to_write = []
-    to_write += ["Date/Time"]
-
-    # for the OPC-N3 sensor:
-    to_write += ["PM 1 (μg/m³)", "PM 2.5 (μg/m³)", "PM 10 (μg/m³)",
-                 "Temperature OPC (°C)", "Relative Humidity OPC (%RH)",
-                 "sampling time OPC (sec)", "sample flow rate OPC (ml/s)",
-                 "bin 0", "bin 1", "bin 2", "bin 3", "bin 4", "bin 5",
-                 "bin 6", "bin 7", "bin 8", "bin 9", "bin 10", "bin 11",
-                 "bin 12", "bin 13", "bin 14", "bin 15", "bin 16", "bin 17",
-                 "bin 18", "bin 19", "bin 20", "bin 21", "bin 22", "bin 23",
-                 "bin 1 MToF", "bin 3 MToF", "bin 5 MToF", "bin 7 MToF",
-                 "reject count glitch", "reject count long TOF", "reject count ratio",
-                 "reject count out of range", "fan revolution count", "laser status"]
-
-    # for the OPC-N3 flow measurement:
-    to_write += ["average flow[sccm]", "average flow [slm]", "average flow [slh]"]
-
-    # for the AFE:
-    to_write += ["temperature (°C)", "temperature (mV)",
-                 "NO2 (ppm)", "NO2 main (mV)", "NO2 aux (mV)",
-                 "OX (ppm)", "OX main (mV)", "OX aux (mV)",
-                 "SO2 (ppm)", "SO2 main (mV)", "SO2 aux (mV)",
-                 "CO2 (ppm)", "CO2 main (mV)", "CO2 aux (mV)"]
-
-    # for the flow sensor:
-    to_write += ["flow (sccm)", "flow (slm)", "flow (slh)"]
-
-    # for the GPS:
-    to_write += ["Date and time (UTC)",
-                 "GPS fix date and time (UTC)", "latitude", "longitude", "SOG (kts)", "COG",
-                 "horizontal dilution of precision", "accuracy",
-                 "altitude (m)", "WGS84 correction (m)", "fix type", "GPS status"]
-
-    # for the CO2 sensor:
-    to_write += ["Relative Humidity (%RH)", "Temperature (°C)", "Pressure (hPa)",
-                 "CO2 average (ppm)", "CO2 instant (ppm)"]
-
-    append_data_to_csv(to_write)
 
+if write_cycle_row:
+    initialize_csv_file()
 else:
-    logger.info("'" + str(csv_file) + "' already exist")
-    logger.info("Appending data to this file")
+    logger.warning("Aligned cycle row disabled, each sensor is stored in its own file")
 
 print("\n########### STARTING SENSORS ############")
 
@@ -340,13 +386,9 @@ if not air_pump_activation:
     logger.warning("Air pump has been disabled by the user in 'seacanairy_settings.yaml'")
 
 # SET INTERNAL CO2 SENSOR TIMESTAMP
+# The sensors are initialized at the same time at the start of the sampling (see 'main()' and 'engine.py')
 
-if CO2_activation:
-    # Read the internal timestamp of the CO2 sensor, and change the value if necessary
-    if CO2_sampling_period != CO2.internal_timestamp():  # if internal timestamp is not the good one... change it
-        CO2.internal_timestamp(CO2_sampling_period)
-        # nothing in the brackets = read, timestamp in the brackets = write
-else:  # if user don't want to use the sensor...
+if not CO2_activation:  # if user don't want to use the sensor...
     try:
         # set the internal timestamp to the longest period available to reduce its wear...
         CO2.internal_timestamp(3600)
@@ -355,137 +397,193 @@ else:  # if user don't want to use the sensor...
         # It means that CO2 sensor is maybe not plugged in...
         pass  # nothing to do if it fails
 
-if OPCN3_activation:
-    # Initialize OPCN3 SPI, avoid loosing first communication
-    OPCN3.initialization_SPI()
-
-if CO2_activation:
-    # Ask the CO2 sensor to take a new sample
-    print("Synchronizing CO2 sensor with Seacanairy sampling period")
-    CO2.trigger_measurement(True)  # True == force
-
-if OPCN3_activation:
-    # Set the desired OPC fan speed
-    OPCN3.set_fan_speed(OPC_fan_speed)
-
 
 print("\n############## SAMPLING! ###############")
 
 # LOOP which will run continuously
 
-while True:
-    # Get date and time to store in the Excel file
-    now = datetime.now()
-    now = now.strftime("%d-%m-%Y %H:%M:%S")  # remove the decimals and change the date order
-
+async def sample(slot, previous=None):
+    """
+    Execute one sampling cycle: start the pump, read all the sensors at the same time, stop the pump
+    and store the data in the -data.csv file
+    The sensors having their own sampling period are not read, their last reading is used instead
+    :param slot: time of the slot of this cycle ('time.time()' format, see 'scheduler.py')
+    :param previous: Optional: end of the previous cycle (task returned by the previous call)
+    :return: task finishing the cycle once the pump is stopped (GPS, CO2 and csv file, see 'finish_cycle()')
+    """
     # Get the time in second at which the measurement start
     start = time.time()  # return the time expressed in second since the python date reference
-    # a bit the same as 'millis()' on Arduino
-    # easier to work with than with a complex string datetime format and a timedelta function...
 
     if air_pump_activation:
         pump_start()  # start the pump
         print("Air pump is on")
 
+    stages = {}  # durations of the steps of the cycle which are not sensor readings {step: seconds}
+
     # If user want to flush the piping system before beginning the sampling
     if fresh_air_piping_flushing_time != 0:
-        loading_bar('Flushing fresh air in the piping system', fresh_air_piping_flushing_time)
+        await engine.timed("pump flush", engine.wait('Flushing fresh air in the piping system',
+                                                     fresh_air_piping_flushing_time), stages)
 
-    to_write = []  # create the list in which data to store will be saved
-    # [a, b, c] + [d, e, f] = [a, b, c, d, e, f]
+    to_write = {}  # {sensor: values of its columns}, in the order of the columns of the -data.csv file
+
+    # All the sensors are read at the same time by their own coroutine (see 'engine.py')
+    durations = engine.new_cycle()
+    cycle_metrics = {}  # start, end and counters of each sensor {sensor: {"start", "end", counter: value}}
+    reading_start = time.time()
+    tail_tasks = {}  # {sensor: task awaited at the end of the cycle, None if read at its own sampling period}
 
     if CO2_activation:
+        tail_tasks["CO2"] = None
+    if CO2_activation and "CO2" not in sensor_loops:
         print("Triggering CO2 measurement (measurement reading will come later...)")
-        CO2.trigger_measurement()
+        tail_tasks["CO2"] = asyncio.ensure_future(engine.when_ready("CO2", engine.timed(
+            "CO2", engine.read_CO2(CO2_startup_delay), durations, cycle_metrics)))
 
-    if AFE_activation:
-        AFE_thread = threading.Thread(target=AFE.start_averaged_data, args=[AFE_readings_averaged], daemon=True)
+    if AFE_activation and "AFE" not in sensor_loops:
         print("Reading averaged AFE in background (data will show up later...)")
-        AFE_thread.start()
+        AFE_task = asyncio.ensure_future(engine.timed("AFE", engine.read_AFE(AFE_readings_averaged), durations,
+                                                      cycle_metrics))
 
     if OPCN3_activation:
-        # Start Flow Rate thread
-        flow_period = 4
-        flow_number_measurements = 4
-        flow_delay = 3
+        if "OPC-N3" not in sensor_loops:
+            OPC_task = asyncio.ensure_future(engine.when_ready("OPC-N3", engine.timed(
+                "OPC-N3", engine.read_OPCN3(OPC_flushing_time, OPC_sampling_time), durations, cycle_metrics)))
         if OPCN3_flow_measurement:
-            flow_thread = threading.Thread(target=flow.start_averaged_measurement,
-                                           args=[flow_period, flow_number_measurements, flow_delay], daemon=True)
+            flow_period = 4
+            flow_number_measurements = 4
+            flow_delay = 3
             print("Reading flow rate during", flow_period, "seconds after", flow_delay,
                   "seconds delay in background (readings will come later...)")
-            flow_thread.start()
+            OPC_flow_task = asyncio.ensure_future(engine.timed("OPC flow", engine.read_OPC_flow(
+                flow_period, flow_number_measurements, flow_delay), durations, cycle_metrics))
+
+    if flow_sensor_activation and "flow meter" not in sensor_loops:
+        flow_task = asyncio.ensure_future(engine.timed("flow meter", engine.read_flow(), durations,
+                                                       cycle_metrics))
+
+    if GPS_activation:
+        tail_tasks["GPS"] = None
+    if GPS_activation and "GPS" not in sensor_loops:
+        print("Reading GPS in background (data will show up later...)")
+        tail_tasks["GPS"] = asyncio.ensure_future(engine.timed("GPS", engine.read_GPS(), durations,
+                                                               cycle_metrics))
+
+    if OPCN3_activation:
         # Get OPC-N3 sensor data (see 'OPCN3.py')
+        if "OPC-N3" in sensor_loops:
+            # histograms streamed since the previous cycle, the fan and the laser are kept on
+            OPC_data = engine.take_OPCN3_stream()
+        else:
+            OPC_data = await OPC_task
         print("********************* OPC-N3 *********************")
-        OPC_data = OPCN3.get_data(OPC_flushing_time, OPC_sampling_time)
-        to_write += [OPC_data["PM 1"], OPC_data["PM 2.5"], OPC_data["PM 10"],
-                     OPC_data["temperature"], OPC_data["relative humidity"],
-                     OPC_data["sampling time"], OPC_data["sample flow rate"],
-                     OPC_data["bin 0"], OPC_data["bin 1"], OPC_data["bin 2"], OPC_data["bin 3"],
-                     OPC_data["bin 4"], OPC_data["bin 5"], OPC_data["bin 6"], OPC_data["bin 7"],
-                     OPC_data["bin 8"], OPC_data["bin 9"], OPC_data["bin 10"], OPC_data["bin 11"],
-                     OPC_data["bin 12"], OPC_data["bin 13"], OPC_data["bin 14"], OPC_data["bin 15"],
-                     OPC_data["bin 16"], OPC_data["bin 17"], OPC_data["bin 18"], OPC_data["bin 19"],
-                     OPC_data["bin 20"], OPC_data["bin 21"], OPC_data["bin 22"], OPC_data["bin 23"],
-                     OPC_data["bin 1 MToF"], OPC_data["bin 3 MToF"],
-                     OPC_data["bin 5 MToF"], OPC_data["bin 7 MToF"],
-                     OPC_data["reject count glitch"],
-                     OPC_data["reject count long TOF"], OPC_data["reject count ratio"],
-                     OPC_data["reject count out of range"],
-                     OPC_data["fan revolution count"], OPC_data["laser status"]]
+        to_write["OPC-N3"] = store("OPC-N3", slot, OPC_data)
+        if "OPC-N3" in sensor_loops:
+            to_write["OPC-N3 stream"] = store("OPC-N3 stream", slot, OPC_data)
 
         if OPCN3_flow_measurement:
             print("**************** OPC FLOW AVERAGE ****************")
-            print("Finishing reading averaged flow rate...", end='\r')
-            flow_thread.join()  # wait the end of the thread
-            print("                                        ", end='\r')
-            flow_OPC_data = flow.get_averaged_measurement()
-            to_write += [flow_OPC_data['average flow [sccm]'], flow_OPC_data['average flow [slm]'],
-                         flow_OPC_data['average flow [slh]']]
+            flow_OPC_data = await OPC_flow_task
+            to_write["OPC flow"] = store("OPC flow", slot, flow_OPC_data)
 
     if AFE_activation:
-        # Get OPC-N3 sensor data (see 'AFE.py')
+        # Get AFE board data (see 'AFE.py')
         print("****************** AFE BOARD ********************")
-        print("Finishing reading background averaged AFE...", end='\r')
-        AFE_thread.join()  # wait the end of the thread
-        print("                                  ", end='\r')
-        AFE_data = AFE.get_averaged_data()
-        to_write += [AFE_data["temperature"], AFE_data["temperature raw"],
-                     AFE_data["NO2 ppm"], AFE_data["NO2 main"], AFE_data["NO2 aux"],
-                     AFE_data["OX ppm"], AFE_data["OX main"], AFE_data["OX aux"],
-                     AFE_data["SO2 ppm"], AFE_data["SO2 main"], AFE_data["SO2 aux"],
-                     AFE_data["CO ppm"], AFE_data["CO main"], AFE_data["CO aux"]]
+        if "AFE" in sensor_loops:
+            AFE_data = engine.latest_data("AFE", streams.error_data("AFE"))
+        else:
+            AFE_data = await AFE_task
+        to_write["AFE"] = store("AFE", slot, AFE_data)
 
     if flow_sensor_activation:
         # get flow measure
         print("******************* FLOW METER *******************")
-        flow_data = flow.get_data()
-        to_write += [flow_data['flow [sccm]'], flow_data['flow [slm]'], flow_data['flow [slh]']]
+        if "flow meter" in sensor_loops:
+            flow_data = engine.latest_data("flow meter", streams.error_data("flow meter"))
+        else:
+            flow_data = await flow_task
+        to_write["flow meter"] = store("flow meter", slot, flow_data)
 
     if air_pump_activation:
         pump_stop()
         print("Air pump is off (pump has run", round(time.time() - start, 0), "seconds)")
 
-    if GPS_activation:
-        # print("Wait switching from SPI to UART...", end='\r')
-        # time.sleep(1)  # avoid too close communication between SPI of OPC and UART of GPS
-        # Get GPS information
+    # Keep a trace of the scheduling quality of this cycle with the data
+    counters = cycle_scheduler.counters()
+
+    # The GPS, the CO2 sensor and the csv file don't need the pump, the next cycle can start in the meantime
+    return asyncio.ensure_future(finish_cycle(slot, start, reading_start, durations, stages, cycle_metrics, to_write,
+                                              counters, tail_tasks, previous))
+
+
+async def finish_cycle(slot, start, reading_start, durations, stages, cycle_metrics, to_write, counters, tail_tasks,
+                       previous):
+    """
+    End of a sampling cycle: get the GPS and CO2 data and store the whole row in the -data.csv file
+    Can run during the next sampling cycle (see 'Pipelined sampling cycles' in 'seacanairy_settings.yaml')
+    :param slot: time of the slot of this cycle ('time.time()' format, see 'scheduler.py')
+    :param start: time at which the cycle has started
+    :param reading_start: time at which the sensors started to be read
+    :param durations: durations of the sensor coroutines of this cycle (see 'engine.new_cycle()')
+    :param stages: durations of the other steps of this cycle (pump flush)
+    :param cycle_metrics: start, end and counters of each sensor of this cycle (see 'engine.timed()')
+    :param to_write: Dictionary{sensor: values of its columns} of the sensors read during the pumping
+    :param counters: counters of the scheduler at the start of the cycle (see 'scheduler.py')
+    :param tail_tasks: Dictionary{sensor: task reading the GPS or the CO2 sensor, None if read at its own
+                        sampling period}, the sensors which were not activated at the start of the cycle are absent
+    :param previous: end of the previous cycle, waited so that the rows are written in order (None if no waiting)
+    :return: Dictionary{step: duration (seconds)} of the sensors, the pump flush, the csv file and the whole cycle
+    """
+    global metrics_file
+
+    # Get date and time to store in the Excel file
+    # the time of the slot is used, so that the measurements of different Seacanairy have the same date and time
+    # (the effective start for a missed slot caught up, see 'scheduler.DeadlineScheduler.wait()')
+    now = datetime.fromtimestamp(slot)
+    now = now.strftime("%d-%m-%Y %H:%M:%S")  # remove the decimals and change the date order
+
+    if previous is not None:
+        try:
+            await previous  # the rows are stored in the order of the slots
+        except Exception:
+            logger.critical("Previous sampling cycle failed (" + str(sys.exc_info()) + ")")
+
+    if "GPS" in tail_tasks:
+        # Get GPS information (see 'GPS.py')
         print("********************** GPS **********************")
-        GPS_data = GPS.get_position()
-        to_write += [GPS_data["current time"], GPS_data["fix date and time"],
-                     GPS_data["latitude"], GPS_data["longitude"],
-                     GPS_data["SOG"], GPS_data["COG"], GPS_data["horizontal precision"], GPS_data["accuracy"],
-                     GPS_data["altitude"], GPS_data["WGS84 correction"], GPS_data["fix status"], GPS_data["status"]]
+        if tail_tasks["GPS"] is None:
+            GPS_data = engine.latest_data("GPS", streams.error_data("GPS"))
+        else:
+            GPS_data = await tail_tasks["GPS"]
+        to_write["GPS"] = store("GPS", slot, GPS_data)
 
-    if CO2_activation:
+    if "CO2" in tail_tasks:
         # Get CO2 sensor data (see 'CO2.py')
         print("******************* CO2 SENSOR *******************")
-        CO2_data = CO2.get_data()
-        to_write += [CO2_data["relative humidity"], CO2_data["temperature"], CO2_data["pressure"],
-                     CO2_data["average"], CO2_data["instant"]]
+        if tail_tasks["CO2"] is None:
+            CO2_data = engine.latest_data("CO2", streams.error_data("CO2"))
+        else:
+            CO2_data = await tail_tasks["CO2"]
+        to_write["CO2"] = store("CO2", slot, CO2_data)
+
+    engine.report(reading_start, durations)  # log the amount of time saved by reading the sensors at the same time
 
+    if "i2c_bus" in sys.modules:
+        i2c_bus.report()  # latency and NACK of each I²C device
+
+    # Keep a trace of the scheduling quality with the data
+    scheduler_data = [counters["overruns"], counters["skipped slots"], counters["jitter"], counters["max jitter"],
+                      counters["caught up"]]
+    row = [now] + [value for sensor in to_write for value in to_write[sensor]] + scheduler_data
 
     # Store everything in the csv file
-    append_data_to_csv(now, to_write)
+    if write_cycle_row:
+        writing_start = time.time()
+        if data_backend == "sqlite":
+            data_file.append(slot, to_write, scheduler_data)  # one line in the table of each sensor
+        else:
+            data_file.writerow(row, streams.cycle_header(to_write))  # no columns for the sensors not activated
+        stages["csv"] = time.time() - writing_start
 
     # Time at which the sampling finishes
     finish = time.time()  # as previously, expressed in seconds since reference date
@@ -494,5 +592,327 @@ while True:
     # int(...) to delete the remaining 0 behind the coma
     logger.info("Sampling finished in " + str(int(round(finish - start, 0))) + " seconds")
 
-    # Wait that the sampling period is passed
-    wait_timestamp(start)
+    # Duration histograms of the metrics endpoint
+    metrics.observe("cycle", finish - start)
+    for sensor in durations:
+        metrics.observe(sensor, durations[sensor])
+
+    # Keep a trace of the retries and the waiting of each sensor, to find the origin of the slow cycles
+    if write_metrics:
+        if metrics_file is None:
+            metrics_file = metrics.MetricsFile(directory_path, project_name, file_rotation,
+                                               settings.seacanairy.data_flush_rows,
+                                               settings.seacanairy.data_flush_interval,
+                                               settings.seacanairy.data_fsync,
+                                               file_journal(metrics.file_path(directory_path, project_name)))
+        metrics_file.append(slot, start, finish, cycle_metrics)
+
+    return {**durations, **stages, "cycle": finish - start}
+
+
+def store(sensor, slot, data):
+    """
+    Store the reading of a sensor read during the sampling cycle in its own file if there is no cycle row
+    :param sensor: name of the sensor (see 'streams.py')
+    :param slot: time of the slot of the cycle ('time.time()' format)
+    :param data: dictionary returned by the driver
+    :return: List[values of the columns of the sensor in the -data.csv file]
+    """
+    if not write_cycle_row and sensor not in sensor_loops:
+        sensor_stream(sensor).append(slot, data)
+    return streams.row(sensor, data)
+
+
+def sensor_stream(sensor):
+    """
+    Open the dedicated file of a sensor at its first reading, kept open, rotated and journaled like the -data.csv
+    file (same settings)
+    :param sensor: name of the sensor (see 'streams.file_names')
+    :return: rotation.SensorStream
+    """
+    if sensor not in sensor_streams:
+        stream_journal = file_journal(rotation.stream_file(directory_path, project_name, sensor))
+        sensor_streams[sensor] = rotation.SensorStream(directory_path, project_name, sensor, file_rotation,
+                                                       settings.seacanairy.data_flush_rows,
+                                                       settings.seacanairy.data_flush_interval,
+                                                       settings.seacanairy.data_fsync, stream_journal)
+    return sensor_streams[sensor]
+
+
+def close_sensor_streams():
+    """
+    Write the rows kept in memory and close the dedicated files of the sensors (when the Seacanairy stops)
+    :return: nothing
+    """
+    for sensor in list(sensor_streams):
+        sensor_streams.pop(sensor).close()
+
+
+def close_metrics_file():
+    """
+    Write the rows kept in memory and close the -metrics.csv file (when the Seacanairy stops or when the metrics are
+    not written anymore)
+    :return: nothing
+    """
+    global metrics_file
+    if metrics_file is not None:
+        metrics_file.close()
+        metrics_file = None
+
+
+metrics_file = None  # -metrics.csv file kept open (see 'metrics.MetricsFile'), opened at the end of the first cycle
+
+sensor_loops = {}  # {name of the sensor: task reading the sensor at its own sampling period}
+sensor_streams = {}  # {name of the sensor: dedicated file} (see 'sensor_stream()')
+
+
+def update_sensor_loop(sensor):
+    """
+    Start, restart or stop the loop of a sensor having its own sampling period (see 'engine.sensor_loop()')
+    :param sensor: "OPC-N3" (streaming), "CO2", "AFE", "flow meter" or "GPS"
+    :return: nothing
+    """
+    readings = {
+        "OPC-N3": (OPCN3_activation, lambda: engine.read_OPCN3_stream(own_sampling_periods["OPC-N3"]),
+                   (engine.SPI, engine.stop_OPCN3_stream)),
+        "CO2": (CO2_activation, lambda: engine.read_CO2(CO2_startup_delay), None),
+        "AFE": (AFE_activation, lambda: engine.read_AFE(AFE_readings_averaged), None),
+        "flow meter": (flow_sensor_activation, engine.read_flow, None),
+        "GPS": (GPS_activation, lambda: engine.read_GPS(keep_open=True), (engine.UART, engine.close_GPS))
+    }
+    activation, read, stop = readings[sensor]
+
+    if sensor in sensor_loops:
+        sensor_loops.pop(sensor).cancel()
+
+    if activation and own_sampling_periods[sensor] != 0:
+        sensor_loops[sensor] = asyncio.ensure_future(engine.sensor_loop(
+            sensor, own_sampling_periods[sensor], read, sensor_stream(sensor), align_on_clock, stop))
+
+
+# Variable of each setting which is applied as it is when changed while running (see 'apply_settings()')
+setting_variables = {
+    ("seacanairy", "sampling_period"): "sampling_period",
+    ("seacanairy", "piping_flushing_time"): "fresh_air_piping_flushing_time",
+    ("seacanairy", "align_on_clock"): "align_on_clock",
+    ("seacanairy", "overrun_policy"): "overrun_policy",
+    ("seacanairy", "write_cycle_row"): "write_cycle_row",
+    ("seacanairy", "write_metrics"): "write_metrics",
+    ("seacanairy", "pipelined_cycles"): "pipelined_cycles",
+    ("seacanairy", "air_pump_activation"): "air_pump_activation",
+    ("seacanairy", "metrics_port"): "metrics_port",
+    ("seacanairy", "metrics_address"): "metrics_address",
+    ("CO2", "activation"): "CO2_activation",
+    ("CO2", "measurement_delay"): "CO2_startup_delay",
+    ("OPCN3", "activation"): "OPCN3_activation",
+    ("OPCN3", "flushing_time"): "OPC_flushing_time",
+    ("OPCN3", "sampling_time"): "OPC_sampling_time",
+    ("OPCN3", "fan_speed"): "OPC_fan_speed",
+    ("flow", "activation"): "flow_sensor_activation",
+    ("flow", "OPCN3_flow_measurement"): "OPCN3_flow_measurement",
+    ("GPS", "activation"): "GPS_activation",
+    ("AFE", "activation"): "AFE_activation",
+    ("AFE", "readings_averaged"): "AFE_readings_averaged"
+}
+
+# Name of the sensor (see 'streams.py') and of its driver for each section of the settings
+sensor_sections = {
+    "CO2": ("CO2", "CO2"),
+    "OPCN3": ("OPC-N3", "OPCN3"),
+    "flow": ("flow meter", "flow"),
+    "GPS": ("GPS", "GPS"),
+    "AFE": ("AFE", "AFE")
+}
+
+
+async def apply_settings(changes):
+    """
+    Apply the settings modified in 'seacanairy_settings.yaml' without restarting (between two sampling cycles)
+    Only the sensors concerned by the changes are initialized again
+    :param changes: List[(section, setting, old value, new value)] (see 'config.differences()')
+    :return: nothing
+    """
+    global settings, CO2_sampling_period, i2c_bus
+
+    settings = config.load()
+    changed = {}  # {section: [settings changed]}
+    old_CO2_sampling_period = CO2_sampling_period
+
+    for section, setting, old_value, new_value in changes:
+        if (section, setting) == ("seacanairy", "session_name"):
+            logger.warning("Setting " + config.name(section, setting) + " changed to '" + str(new_value) +
+                           "', restart the Seacanairy to store the data in the new folder")
+            continue
+        if (section, setting) == ("seacanairy", "hardware_backend"):
+            logger.warning("Setting " + config.name(section, setting) + " changed to '" + str(new_value) +
+                           "', restart the Seacanairy to use the " + str(new_value) + " sensors")
+            continue
+        if (section, setting) in [("seacanairy", "capture_bus_traffic"), ("seacanairy", "data_backend"),
+                                  ("seacanairy", "data_journal")]:
+            logger.warning("Setting " + config.name(section, setting) + " changed to '" + str(new_value) +
+                           "', restart the Seacanairy to apply it")
+            continue
+        if (section, setting) in setting_variables:
+            globals()[setting_variables[(section, setting)]] = new_value
+        if setting == "sampling_period" and section in sensor_sections:
+            own_sampling_periods[sensor_sections[section][0]] = new_value
+        if (section, setting) == ("OPCN3", "streaming_period"):
+            own_sampling_periods["OPC-N3"] = new_value
+        if (section, setting) == ("OPCN3", "recovery_budget") and "OPCN3" in sys.modules:
+            sys.modules["OPCN3"].SPI_recovery.budget = new_value
+        changed.setdefault(section, []).append(setting)
+        logger.info("Setting " + config.name(section, setting) + " changed from " + str(old_value) + " to " +
+                    str(new_value))
+
+    # Sampling cycle
+    if "seacanairy" in changed:
+        cycle_scheduler.reconfigure(sampling_period, align_on_clock, overrun_policy)
+        if "write_cycle_row" in changed["seacanairy"] and write_cycle_row:
+            initialize_csv_file()
+        elif "write_cycle_row" in changed["seacanairy"]:
+            close_csv_file()
+        if "write_metrics" in changed["seacanairy"] and not write_metrics:
+            close_metrics_file()
+        if {"data_flush_rows", "data_flush_interval", "data_fsync"} & set(changed["seacanairy"]):
+            for writer in [file for file in [data_file, metrics_file] if file is not None] + \
+                    list(sensor_streams.values()):
+                writer.configure(settings.seacanairy.data_flush_rows, settings.seacanairy.data_flush_interval,
+                                 settings.seacanairy.data_fsync)
+        if {"rotation_policy", "rotation_size", "rotation_compression"} & set(changed["seacanairy"]):
+            try:
+                file_rotation.configure(settings.seacanairy.rotation_policy, settings.seacanairy.rotation_size,
+                                        settings.seacanairy.rotation_compression)
+            except ImportError:
+                logger.error("Rotation of the files not changed (" + str(sys.exc_info()[1]) + ")")
+        if "air_pump_activation" in changed["seacanairy"] and air_pump_activation and "GPIO" not in globals():
+            pump_setup()
+        if "metrics_port" in changed["seacanairy"] or "metrics_address" in changed["seacanairy"]:
+            exporter.stop()
+            if metrics_port != 0:
+                exporter.start(metrics_address, metrics_port, cycle_scheduler)
+
+    # Debug messages of the drivers already imported
+    for section in changed:
+        if section in sensor_sections and "store_debug_messages" in changed[section] \
+                and sensor_sections[section][1] in sys.modules:
+            driver = sys.modules[sensor_sections[section][1]]
+            driver.logger.setLevel(logging.DEBUG if getattr(settings, section).store_debug_messages
+                                   else logging.INFO)
+
+    if CO2_activation or AFE_activation or flow_sensor_activation:
+        import i2c_bus  # one I²C bus shared by the CO2 sensor, the AFE board and the flow meter
+
+    # CO2 sensor
+    if settings.CO2.sampling_period != 0:
+        CO2_sampling_period = settings.CO2.sampling_period
+    else:
+        CO2_sampling_period = int(sampling_period / settings.CO2.automatic_sampling_frequency)
+    if "CO2" in changed or CO2_sampling_period != old_CO2_sampling_period:
+        import CO2
+        CO2.measurement_delay = settings.CO2.measurement_delay
+        CO2.max_attempts = settings.CO2.max_attempts
+        if "activation" in changed.get("CO2", []) and CO2_activation:
+            engine.start_initialization({"CO2": engine.initialize_CO2(CO2_sampling_period)})
+        elif "activation" in changed.get("CO2", []):
+            try:
+                # set the internal timestamp to the longest period available to reduce its wear
+                await engine.run_blocking(engine.I2C, CO2.internal_timestamp, 3600)
+            except Exception:
+                logger.error("Failed to set the internal timestamp of the disabled CO2 sensor on 3600 seconds")
+        elif CO2_activation and CO2_sampling_period != old_CO2_sampling_period:
+            await engine.run_blocking(engine.I2C, CO2.internal_timestamp, CO2_sampling_period)
+
+    # OPC-N3
+    if "OPCN3" in changed and OPCN3_activation:
+        import OPCN3
+        OPCN3.OPC_flushing_time = settings.OPCN3.flushing_time
+        OPCN3.OPC_sampling_time = settings.OPCN3.sampling_time
+        OPCN3.take_new_sample_if_checksum_is_wrong = settings.OPCN3.take_new_sample_if_checksum_is_wrong
+        if "activation" in changed["OPCN3"]:
+            engine.start_initialization({"OPC-N3": engine.initialize_OPCN3(OPC_fan_speed)})
+        elif "fan_speed" in changed["OPCN3"]:
+            await engine.run_blocking(engine.SPI, OPCN3.set_fan_speed, OPC_fan_speed)
+
+    # Sensors having their own sampling period
+    for section in ["OPCN3", "CO2", "AFE", "flow", "GPS"]:
+        sensor = sensor_sections[section][0]
+        if "activation" in changed.get(section, []) or "sampling_period" in changed.get(section, []) \
+                or "streaming_period" in changed.get(section, []) \
+                or ("align_on_clock" in changed.get("seacanairy", []) and sensor in sensor_loops):
+            update_sensor_loop(sensor)
+
+
+async def main(cycles=None):
+    """
+    LOOP which will run continuously
+    :param cycles: Optional: number of sampling cycles to execute before stopping (see 'benchmark.py')
+    :return: never, or List[durations of each cycle (see 'finish_cycle()')] once the number of cycles is reached
+    """
+    global cycle_scheduler
+
+    engine.initialize()  # create the bus locks inside the event loop
+
+    # Initialize the sensors at the same time, each sensor is read as soon as it is ready
+    initializations = {}
+    if CO2_activation:
+        # Set the internal timestamp and ask the CO2 sensor to take a new sample
+        initializations["CO2"] = engine.initialize_CO2(CO2_sampling_period)
+    if OPCN3_activation:
+        # Initialize OPCN3 SPI (avoid loosing first communication) and set the desired OPC fan speed
+        initializations["OPC-N3"] = engine.initialize_OPCN3(OPC_fan_speed)
+    engine.start_initialization(initializations)
+    cycle_scheduler = scheduler.DeadlineScheduler(sampling_period, align_on_clock, overrun_policy)
+    if metrics_port != 0:
+        exporter.start(metrics_address, metrics_port, cycle_scheduler)
+
+    # Start the sensors having their own sampling period, each of them is stored in its own file
+    for sensor in ["OPC-N3", "CO2", "AFE", "flow meter", "GPS"]:
+        update_sensor_loop(sensor)
+
+    previous = None  # end of the previous cycle (see 'finish_cycle()')
+    ends = []  # end of each cycle, only if a number of cycles is given
+    while cycles is None or len(ends) < cycles:
+        # Apply the settings modified in 'seacanairy_settings.yaml' since the previous cycle
+        changes = config.reload()
+        if changes:
+            try:
+                await apply_settings(changes)
+            except Exception:
+                # a sensor which fails to be initialized again must not stop the sampling
+                logger.critical("Failed to apply the new settings (" + str(sys.exc_info()) + ")")
+
+        # Wait for the next slot of the clock (see 'scheduler.py')
+        slot = await cycle_scheduler.wait()
+
+        if pipelined_cycles:
+            # Only the pumping part of the cycle is waited, the end of the cycle runs during the next one
+            previous = await sample(slot, previous)
+        else:
+            previous = await sample(slot)
+            await previous
+        if cycles is not None:
+            ends.append(previous)
+
+    loops = [sensor_loops.pop(sensor) for sensor in list(sensor_loops)]
+    for loop in loops:
+        loop.cancel()
+    # the laser and the fan of the OPC-N3 streaming are shut down and the GPS port closed (see 'engine.shut_down()')
+    await asyncio.gather(*loops, return_exceptions=True)
+    exporter.stop()
+    to_return = [await end for end in ends]
+    close_csv_file()
+    close_sensor_streams()
+    close_metrics_file()
+    return to_return
+
+
+if __name__ == '__main__':
+    # SIGTERM ('kill', 'systemctl stop') stops the Seacanairy like CTRL+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(main())  # KeyboardInterrupt cancels the coroutines, the OPC-N3 laser and fan are shut down
+    finally:
+        close_csv_file()  # write the rows kept in memory
+        close_sensor_streams()
+        close_metrics_file()
+        file_rotation.wait(10)  # the files not compressed yet are compressed at the next start
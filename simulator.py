@@ -0,0 +1,634 @@
+"""
+Simulated hardware of the Seacanairy, to run the whole software on a computer without sensors (tests, benchmark)
+Replace the modules 'spidev', 'smbus2', 'serial' and 'RPi.GPIO' by simulated devices following the protocol of
+each sensor (handshakes, frames and checksums of the documentation):
+    - OPC-N3 (SPI): 0x31/0xF3 handshake, power commands, DAC status, 86 bytes histogram with its CRC16
+    - EE894 CO2 sensor (I²C): temperature, humidity, CO2 and pressure framed with their CRC8, custom memory
+    - LTC2497 ADC of the AFE board (I²C): voltage of each channel
+    - Sensirion flow meter (I²C): flow framed with its CRC8, depends on the state of the air pump GPIO
+    - U-BLOX-7 GPS (UART): one set of $GPRMC/$GPGGA lines per second
+Each device has its own latency and error rate (see 'configure()')
+Usage: 'simulator.install()' before importing the drivers (see 'Hardware backend' in 'seacanairy_settings.yaml')
+"""
+
+import errno
+import math
+import random
+import struct
+import sys
+import time
+import types
+import logging  # save logger messages into memory
+from datetime import datetime, timezone
+
+# all further logging must be called by logger.'level' and not logging.'level'
+# if not, the logging will be displayed as 'ROOT' and NOT 'Simulator'
+logger = logging.getLogger('Simulator')
+
+
+# ---------------------------------------------------------------------
+# CHECKSUMS
+# ---------------------------------------------------------------------
+# Same algorithms as the drivers, computed on the side of the sensor
+
+
+def crc16(data):
+    """
+    CRC16 of the OPC-N3 (polynomial 0xA001, initial value 0xFFFF)
+    :param data: List[bytes]
+    :return: checksum (16 bits)
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for bit in range(0, 8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def crc8(data, initial):
+    """
+    CRC8 of the EE894 (initial value 0xFF) and of the Sensirion flow meter (initial value 0x00), polynomial 0x31
+    :param data: List[bytes]
+    :param initial: initial value of the CRC
+    :return: checksum (8 bits)
+    """
+    crc = initial
+    for byte in data:
+        crc ^= byte
+        for bit in range(0, 8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+def NMEA_checksum(sentence):
+    """
+    :param sentence: NMEA sentence without '$' and '*'
+    :return: XOR of all the characters, 2 hexadecimal digits
+    """
+    checksum = 0
+    for character in sentence:
+        checksum ^= ord(character)
+    return "%02X" % checksum
+
+
+# ---------------------------------------------------------------------
+# DEVICES
+# ---------------------------------------------------------------------
+
+
+class Device:
+    """
+    Latency and error rate of a simulated device
+    """
+
+    def __init__(self, name, latency, error_rate=0.0):
+        """
+        :param name: name of the device (see 'devices')
+        :param latency: duration of one transaction (seconds)
+        :param error_rate: probability of an error for each transaction (0 = never, 1 = always)
+        """
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.transactions = 0
+        self.errors = 0  # number of errors injected
+
+    def transaction(self, duration=0.0):
+        """
+        Wait for the duration of the transaction
+        :param duration: additional duration (f-e time to transfer the bytes)
+        :return: nothing
+        """
+        self.transactions += 1
+        if self.latency + duration > 0:
+            time.sleep(self.latency + duration)
+
+    def error(self):
+        """
+        :return: True if an error must be injected (see 'error_rate')
+        """
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+
+def corrupt(data):
+    """
+    Change one byte of a frame, the checksum will be wrong
+    :param data: List[bytes]
+    :return: List[bytes]
+    """
+    data = list(data)
+    if data:
+        data[random.randrange(len(data))] ^= 0xFF
+    return data
+
+
+class OPCN3Device(Device):
+    """
+    Alphasense OPC-N3 on the SPI bus
+    A command byte is answered 0x31 (busy) a few times then 0xF3 (ready), the following bytes are the answer
+    """
+
+    commands = [0x03, 0x13, 0x30, 0x32, 0x42]  # power state, DAC status, histogram, PM, fan potentiometer
+
+    byte_duration = 8 / 307200  # seconds, one byte at the SPI speed of 'OPCN3.py'
+
+    def __init__(self):
+        Device.__init__(self, "OPC-N3", latency=0.0002)
+        self.fan = False
+        self.laser = False
+        self.fan_DAC = 255
+        self.busy = 0  # number of 0x31 still to answer before 0xF3
+        self.answer = []  # bytes still to send for the current command
+        self.handlers = []  # functions receiving the next bytes of the current command (power state, fan speed)
+        self.histogram_start = time.monotonic()
+
+    def xfer(self, data):
+        self.transaction(len(data) * self.byte_duration)
+        return [self.exchange(byte) for byte in data]
+
+    def exchange(self, byte):
+        """
+        Send one byte and receive one byte at the same time
+        :param byte: byte sent by the Raspberry Pi
+        :return: byte sent by the sensor
+        """
+        if self.answer:
+            return self.answer.pop(0)
+        if self.handlers:
+            return self.handlers.pop(0)(byte)
+
+        if byte not in self.commands:
+            return 0x31
+        if self.busy == 0:
+            self.busy = random.choice([0, 0, 1, 2])  # for the next command
+            self.prepare(byte)
+            return 0xF3
+        self.busy -= 1
+        return 0x31
+
+    def prepare(self, command):
+        """
+        Prepare the answer to a command, sent with the following bytes
+        :param command: command byte
+        :return: nothing
+        """
+        if command == 0x03:
+            self.handlers = [self.power]
+        elif command == 0x13:
+            self.answer = [int(self.fan), int(self.laser), self.fan_DAC, 230, int(self.laser), 0x01]
+        elif command == 0x30:
+            self.answer = list(self.histogram())
+        elif command == 0x32:
+            values = struct.pack('<3f', *self.PM())
+            self.answer = list(values) + list(struct.pack('<H', crc16(values)))
+        elif command == 0x42:
+            self.handlers = [lambda byte: 0x42, self.fan_potentiometer]  # [0x00, value]
+        self.inject_fault()
+
+    def inject_fault(self):
+        """
+        Corrupt the answer prepared by 'prepare()' (wrong checksum), with the error rate of the device
+        The commands without answer (power state, fan speed) are never corrupted
+        :return: nothing
+        """
+        if not self.answer:
+            return
+        if not self.error():
+            return
+        self.answer = corrupt(self.answer)
+
+    def power(self, option):
+        """
+        Second byte of the power state command
+        :param option: 0x02 fan off, 0x03 fan on, 0x06 laser off, 0x07 laser on
+        :return: 0x03 (answer of the sensor)
+        """
+        if option in [0x02, 0x03]:
+            self.fan = option == 0x03
+        elif option in [0x06, 0x07]:
+            self.laser = option == 0x07
+        return 0x03
+
+    def fan_potentiometer(self, value):
+        """
+        Value of the fan potentiometer command (second byte after the command)
+        :param value: 0 to 255
+        :return: 0x42
+        """
+        self.fan_DAC = value
+        return 0x42
+
+    def PM(self):
+        if not (self.fan and self.laser):
+            return [0.0, 0.0, 0.0]
+        PM1 = max(random.gauss(4, 1), 0)
+        return [PM1, PM1 * 1.6, PM1 * 2.8]
+
+    def histogram(self):
+        """
+        Histogram since the previous reading (see 'OPCN3.fetch_histogram()' for the order of the bytes)
+        :return: 86 bytes
+        """
+        now = time.monotonic()
+        elapsed = now - self.histogram_start
+        self.histogram_start = now
+        sampling = self.fan and self.laser
+
+        bins = [int(max(random.gauss(80 * 0.7 ** i, 3), 0) * elapsed) if sampling else 0 for i in range(0, 24)]
+        bins = [min(count, 0xFFFF) for count in bins]
+        MToF = [random.randint(20, 60) if sampling else 0 for i in range(0, 4)]
+        temperature = int((random.gauss(22, 0.2) + 45) / 175 * 65535)
+        humidity = int(random.gauss(55, 1) / 100 * 65535)
+        flow_rate = int(random.gauss(5.5, 0.1) * 100) if self.fan else 0
+        fan_revolutions = int(elapsed * 90) if self.fan else 0
+        laser_status = 610 if self.laser else 0
+
+        data = struct.pack('<24H4B4H3f6H', *bins, *MToF, min(int(elapsed * 100), 0xFFFF), flow_rate, temperature,
+                           humidity, *self.PM(), 0, 0, 0, 0, min(fan_revolutions, 0xFFFF), laser_status)
+        return data + struct.pack('<H', crc16(data))
+
+
+class EE894Device(Device):
+    """
+    E+E EE894 CO2 sensor on the I²C bus (address 0x33)
+    """
+
+    address = 0x33
+
+    def __init__(self):
+        Device.__init__(self, "CO2 sensor", latency=0.0005)
+        self.memory = bytearray(256)  # custom memory
+        self.memory[0:2] = (150).to_bytes(2, 'big')  # internal timestamp (15 seconds * 10)
+        self.pointer = 0  # index of the custom memory to read
+        self.command = None  # last command written, the next read returns its answer
+
+    def write(self, data):
+        if data[0:2] == [0x71, 0x54]:  # custom memory
+            index = data[2]
+            if len(data) > 3:  # writing: index, bytes, CRC8
+                if crc8(data[2:-1], 0xFF) != data[-1]:
+                    raise OSError(errno.EIO, "wrong CRC8, custom memory not written")
+                self.memory[index:index + len(data) - 4] = bytes(data[3:-1])
+            self.pointer = index
+            self.command = "memory"
+        else:
+            self.command = tuple(data)
+
+    def read(self, length):
+        if self.command == "memory":
+            return list(self.memory[self.pointer:self.pointer + length])
+        if self.command == (0xE0, 0x00):
+            values = [int((random.gauss(21, 0.1) + 273.15) * 100), int(random.gauss(50, 0.5) * 100)]
+        elif self.command == (0xE0, 0x27):
+            CO2 = int(random.gauss(420, 5))
+            values = [CO2, CO2 + int(random.gauss(0, 3)), int(random.gauss(1013, 0.5) * 10)]
+        else:
+            return [0xFF] * length
+        frame = []
+        for value in values:
+            word = [(value >> 8) & 0xFF, value & 0xFF]
+            frame += word + [crc8(word, 0xFF)]
+        return frame[:length]
+
+    def read_byte_data(self, register):
+        return 0x00  # status, everything OK
+
+
+class LTC2497Device(Device):
+    """
+    LTC2497 ADC of the AFE board on the I²C bus, the channel is selected by 'write_byte()'
+    """
+
+    address = 0b1110110
+
+    def __init__(self):
+        Device.__init__(self, "AFE board (ADC)", latency=0.0005)
+        self.channel = 0xB0
+        # voltage of each channel (see 'AFE.py'), temperature sensor then working/auxiliary electrodes
+        self.voltages = {0xB0: 0.29, 0xB8: 0.23, 0xB1: 0.22, 0xB9: 0.24, 0xB2: 0.23, 0xBA: 0.27, 0xB3: 0.27,
+                         0xBB: 0.32, 0xB4: 0.30}
+
+    def write_byte(self, value):
+        self.channel = value
+
+    def read(self, length):
+        volts = max(random.gauss(self.voltages.get(self.channel, 0.0), 0.0005), 0)
+        value = min(int(volts / 5 * 8388608), 0x3FFFFF)
+        frame = [0x80 | (value >> 16), (value >> 8) & 0xFF, value & 0xE0]  # SIG bit = positive voltage
+        return (frame + [0] * length)[:length]
+
+
+class FlowDevice(Device):
+    """
+    Sensirion mass flow meter on the I²C bus (address 1), the flow depends on the air pump
+    """
+
+    address = 1
+
+    def __init__(self):
+        Device.__init__(self, "flow meter", latency=0.0005)
+        self.flow = 1800  # sccm when the air pump is running
+
+    def read(self, length):
+        if GPIO.pins.get(pump_gpio, GPIO.LOW) == GPIO.HIGH:
+            value = int(max(random.gauss(self.flow, 15), 0))
+        else:
+            value = 0
+        word = [(value >> 8) & 0xFF, value & 0xFF]
+        return word + [crc8(word, 0x00)]
+
+
+class GPSDevice(Device):
+    """
+    U-BLOX-7 GPS on the UART, one set of NMEA lines at each second of the clock
+    """
+
+    def __init__(self):
+        Device.__init__(self, "GPS", latency=0.001)
+        self.latitude = 5113.4521  # ddmm.mmmm, Antwerp
+        self.longitude = 424.1345  # dddmm.mmmm
+        self.last_emission = None  # second of the last set of lines sent
+
+    def lines(self, second):
+        """
+        :param second: time of the fix ('time.time()' format, integer)
+        :return: $GPRMC and $GPGGA lines of this second
+        """
+        fix = datetime.fromtimestamp(second, timezone.utc)
+        self.latitude += random.gauss(0, 0.0005)
+        self.longitude += random.gauss(0, 0.0005)
+        sentences = [
+            "GPRMC," + fix.strftime("%H%M%S") + ".00,A," + "%09.4f" % self.latitude + ",N," +
+            "%010.4f" % self.longitude + ",E,0.1,," + fix.strftime("%d%m%y") + ",,,A",
+            "GPGGA," + fix.strftime("%H%M%S") + ".00," + "%09.4f" % self.latitude + ",N," +
+            "%010.4f" % self.longitude + ",E,1,08,1.1,12.5,M,46.9,M,,"
+        ]
+        return "".join(["$" + sentence + "*" + NMEA_checksum(sentence) + "\r\n" for sentence in sentences])
+
+    def receive(self):
+        """
+        :return: lines sent by the GPS since the previous call
+        """
+        self.transaction()
+        now = math.floor(time.time())
+        if self.last_emission is None:
+            self.last_emission = now
+            return "3,1.3,1.1*0F\r\n"  # end of a line sent before the opening of the port
+        reading = "".join([self.lines(second) for second in range(max(self.last_emission + 1, now - 5), now + 1)])
+        self.last_emission = now
+        if reading and self.error():
+            position = random.randrange(len(reading))
+            reading = reading[:position] + "#" + reading[position + 1:]  # wrong checksum
+        return reading
+
+
+# ---------------------------------------------------------------------
+# SIMULATED MODULES
+# ---------------------------------------------------------------------
+# Same classes and functions as the real libraries, limited to what the drivers use
+
+
+class SpiDev:
+    """
+    spidev.SpiDev
+    """
+
+    def __init__(self):
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.device = None
+
+    def open(self, bus, device):
+        if (bus, device) != (0, 0):
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory: '/dev/spidev" + str(bus) + "." +
+                                    str(device) + "'")
+        self.device = OPCN3
+
+    def xfer(self, data):
+        if self.device is None:
+            raise OSError(errno.EBADF, "SPI device not opened")
+        return self.device.xfer(list(data))
+
+    xfer2 = xfer
+
+    def close(self):
+        self.device = None
+
+
+class i2c_msg:
+    """
+    smbus2.i2c_msg
+    """
+
+    def __init__(self, address, flags, data):
+        self.addr = address
+        self.flags = flags
+        self.buf = data
+        self.len = len(data)
+
+    @staticmethod
+    def write(address, data):
+        return i2c_msg(address, 0, list(data))
+
+    @staticmethod
+    def read(address, length):
+        return i2c_msg(address, 1, [0] * length)
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def __len__(self):
+        return self.len
+
+
+class SMBus:
+    """
+    smbus2.SMBus, the devices are found by their address
+    """
+
+    def __init__(self, bus=None):
+        self.open = bus is not None
+
+    def device(self, address):
+        """
+        :param address: I²C address
+        :return: simulated device, after the latency of the transaction
+        """
+        if not self.open:
+            raise OSError(errno.EBADF, "I2C bus not opened")
+        device = I2C_devices.get(address)
+        if device is None:
+            raise OSError(errno.ENXIO, "No such device or address")
+        device.transaction()
+        return device
+
+    @staticmethod
+    def NACK(device, reading=False):
+        """
+        Inject the errors of the device: NACK, or wrong checksum for the frames read
+        :param device: simulated device
+        :param reading: True if the transaction reads a frame
+        :return: True if the frame read must be corrupted
+        """
+        if not device.error():
+            return False
+        if not reading or random.random() < 0.5:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return True
+
+    def i2c_rdwr(self, *messages):
+        for message in messages:
+            device = self.device(message.addr)
+            if message.flags:
+                wrong = self.NACK(device, reading=True)
+                message.buf = device.read(message.len)
+                if wrong:
+                    message.buf = corrupt(message.buf)
+            else:
+                self.NACK(device)
+                device.write(message.buf)
+
+    def read_byte_data(self, address, register):
+        device = self.device(address)
+        self.NACK(device)
+        return device.read_byte_data(register)
+
+    def write_byte(self, address, value):
+        device = self.device(address)
+        self.NACK(device)
+        device.write_byte(value)
+
+    def read_i2c_block_data(self, address, register, length):
+        device = self.device(address)
+        if self.NACK(device, reading=True):
+            return corrupt(device.read(length))
+        return device.read(length)
+
+    def close(self):
+        self.open = False
+
+
+class Serial:
+    """
+    serial.Serial, only the GPS port exists
+    """
+
+    def __init__(self, port=None, baudrate=9600, **kwargs):
+        if port != '/dev/ttyAMA0':
+            raise OSError(errno.ENOENT, "could not open port " + str(port))
+        self.port = port
+        self.baudrate = baudrate
+        self.is_open = True
+        GPS.last_emission = None
+
+    def read_all(self):
+        if not self.is_open:
+            raise OSError(errno.EBADF, "Attempting to use a port that is not open")
+        return GPS.receive().encode()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class GPIO:
+    """
+    RPi.GPIO, the state of the outputs is kept in 'pins'
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    pins = {}  # {GPIO number: LOW or HIGH}
+
+    @staticmethod
+    def setwarnings(flag):
+        pass
+
+    @staticmethod
+    def setmode(mode):
+        pass
+
+    @staticmethod
+    def setup(channel, direction, initial=LOW, pull_up_down=None):
+        GPIO.pins[channel] = initial
+
+    @staticmethod
+    def output(channel, state):
+        GPIO.pins[channel] = int(bool(state))
+
+    @staticmethod
+    def input(channel):
+        return GPIO.pins.get(channel, GPIO.LOW)
+
+    @staticmethod
+    def cleanup(channel=None):
+        GPIO.pins.clear()
+
+
+pump_gpio = 27  # GPIO of the air pump relay (see 'seacanairy.py')
+
+OPCN3 = OPCN3Device()
+CO2 = EE894Device()
+ADC = LTC2497Device()
+flow = FlowDevice()
+GPS = GPSDevice()
+
+devices = {device.name: device for device in [OPCN3, CO2, ADC, flow, GPS]}
+I2C_devices = {device.address: device for device in [CO2, ADC, flow]}
+
+
+def configure(name, latency=None, error_rate=None):
+    """
+    Change the behaviour of a simulated device
+    :param name: name of the device (see 'devices', f-e "OPC-N3")
+    :param latency: duration of one transaction (seconds), None to keep the current one
+    :param error_rate: probability of an error for each transaction (0 to 1), None to keep the current one
+    :return: nothing
+    """
+    if name not in devices:
+        raise ValueError("Simulated device must be one of " + str(list(devices)) + ", not '" + str(name) + "'")
+    if error_rate is not None and not 0 <= error_rate <= 1:
+        raise ValueError("Error rate must be between 0 and 1, not '" + str(error_rate) + "'")
+    if latency is not None:
+        devices[name].latency = latency
+    if error_rate is not None:
+        devices[name].error_rate = error_rate
+
+
+def install():
+    """
+    Replace the hardware libraries by the simulated devices, must be called before importing the drivers
+    :return: nothing
+    """
+    modules = {
+        "spidev": {"SpiDev": SpiDev},
+        "smbus2": {"SMBus": SMBus, "i2c_msg": i2c_msg},
+        "serial": {"Serial": Serial, "SerialException": OSError},
+        "RPi": {"GPIO": GPIO},
+        "RPi.GPIO": {name: getattr(GPIO, name) for name in dir(GPIO) if not name.startswith("_")}
+    }
+    for name in modules:
+        module = types.ModuleType(name, "Simulated '" + name + "' (see 'simulator.py')")
+        module.__dict__.update(modules[name])
+        sys.modules[name] = module
+    sys.modules["RPi"].GPIO = sys.modules["RPi.GPIO"]
+    logger.warning("Simulated hardware, the data are not real measurements")
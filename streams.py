@@ -0,0 +1,270 @@
+"""
+Data files of the Seacanairy
+Columns of each sensor (declared by the drivers), names of the time-indexed files of the sensors (sensors with their
+own sampling period, see 'rotation.SensorStream') and the aligned cycle row of the -data.csv file
+
+The -data.csv file starts with a schema line (see 'schema_row()'), so that a reader finds each column with
+'read_header()' and 'column_map()' instead of relying on its position (f-e pandas: read_csv(file, skiprows=1))
+"""
+
+import csv  # for storing data in file
+import os  # to be able to create new files/folders
+import time
+from datetime import datetime
+
+# ---------------------------------------------------------------------
+# COLUMNS
+# ---------------------------------------------------------------------
+# Columns of each sensor, declared by its driver when it is imported (see 'register()'): only the sensors used
+# have columns in the -data.csv file
+# For each column: (header of the column in the csv file, item of the dictionary returned by the driver, kind)
+# kind: "number" or "text" (stored as text by the typed storage backends, see 'convert()')
+
+columns = {}
+
+# Order of the sensors in the aligned cycle row
+sensors = ["OPC-N3", "OPC-N3 stream", "OPC flow", "AFE", "flow meter", "GPS", "CO2"]
+
+kinds = {}  # {header of a column: kind}, see 'register()'
+
+# Layout of the -data.csv file: 1 = columns of all the sensors, activated or not (files written before the schema
+# line), 2 = schema line (version and kind of each column) then columns of the sensors used only
+schema_version = 2
+
+# Text columns of the files of version 1 (their kinds are not written in the file)
+legacy_text_columns = {"Date and time (UTC)", "GPS fix date and time (UTC)", "latitude", "longitude", "accuracy",
+                       "altitude (m)", "WGS84 correction (m)", "fix type", "GPS status"}
+
+# Columns of the scheduler at the end of the aligned cycle row
+# 'caught up slot' = 1 if the row is a missed slot started late (catch up policy), dated with its effective start
+# (time of the slot = Date/Time - start jitter)
+scheduler_columns = ["cycle overruns", "skipped slots", "start jitter (ms)", "max start jitter (ms)", "caught up slot"]
+
+# Name of the dedicated file of each sensor: <Sampling session name>-<name>.csv
+file_names = {
+    "OPC-N3": "OPCN3",
+    "OPC-N3 stream": "OPCN3_stream",
+    "OPC flow": "OPC_flow",
+    "AFE": "AFE",
+    "flow meter": "flow",
+    "GPS": "GPS",
+    "CO2": "CO2"
+}
+
+date_format = "%d-%m-%Y %H:%M:%S"  # same format as the Date/Time column of the -data.csv file
+
+# Storage of the aligned cycle rows: csv (-data.csv file), columnar (see 'columnar.py') or sqlite (see 'database.py')
+data_backends = ["csv", "columnar", "sqlite"]
+
+# When the rows written are forced to the SD card (see 'BufferedCSV'):
+# never (the system decides), flush (each time the rows kept in memory are written), close (when the file is closed)
+fsync_policies = ["never", "flush", "close"]
+
+
+def register(sensor, sensor_columns):
+    """
+    Declare the columns of a sensor (called by its driver when it is imported)
+    :param sensor: name of the sensor (see 'sensors')
+    :param sensor_columns: List[(header of the column, item of the dictionary returned by the driver, kind)]
+    :return: nothing
+    """
+    global columns
+    if sensor not in sensors:
+        raise ValueError("Unknown sensor '" + str(sensor) + "', must be one of " + str(sensors))
+    for column in sensor_columns:
+        if column[2] not in ["number", "text"]:
+            raise ValueError("Kind of the column '" + str(column[0]) + "' of the " + str(sensor) +
+                             " must be 'number' or 'text', not '" + str(column[2]) + "'")
+        kinds[column[0]] = column[2]
+    columns[sensor] = list(sensor_columns)
+    columns = {name: columns[name] for name in sensors if name in columns}  # order of the cycle row
+
+
+def header(sensor):
+    """
+    :param sensor: name of the sensor (see 'columns')
+    :return: List[headers of the columns of the sensor]
+    """
+    return [column[0] for column in columns[sensor]]
+
+
+def cycle_header(sensors):
+    """
+    :param sensors: names of the sensors of the row, in the order of 'columns'
+    :return: List[headers of the columns of the aligned cycle row]
+    """
+    return ["Date/Time"] + [name for sensor in sensors for name in header(sensor)] + scheduler_columns
+
+
+def kind(column):
+    """
+    :param column: header of a column of the aligned cycle row
+    :return: "time" (Date/Time), "text" or "number" (see 'register()', 'legacy_text_columns' for the sensors not
+             registered)
+    """
+    if column == "Date/Time":
+        return "time"
+    if column in kinds:
+        return kinds[column]
+    if column in legacy_text_columns:
+        return "text"
+    return "number"
+
+
+def schema_row(cycle_columns):
+    """
+    :param cycle_columns: List[headers of the columns of the aligned cycle row] (see 'cycle_header()')
+    :return: first line of the -data.csv file: "#schema <version>", then the kind of each column
+    """
+    return ["#schema " + str(schema_version)] + [kind(column) for column in cycle_columns]
+
+
+def read_header(reader):
+    """
+    Read the first lines of a -data.csv file, with or without schema line
+    :param reader: csv reader at the start of the file
+    :return: (version of the layout, List[headers], List[kinds]), headers and kinds are empty if the file is empty
+    """
+    first = next(reader, None)
+    if first is None:
+        return schema_version, [], []
+    if first and first[0].startswith("#schema"):
+        cycle_columns = next(reader, [])
+        return int(first[0].split()[1]), cycle_columns, first[1:1 + len(cycle_columns)]
+    return 1, first, [kind(column) for column in first]
+
+
+def column_map(cycle_columns, column_kinds):
+    """
+    :param cycle_columns: List[headers] (see 'read_header()')
+    :param column_kinds: List[kinds]
+    :return: Dictionary{header: (index of the column in the rows, kind)}
+    """
+    return {column: (index, column_kind) for index, (column, column_kind) in enumerate(zip(cycle_columns,
+                                                                                           column_kinds))}
+
+
+def convert(value, column_kind):
+    """
+    Typed value of a column, for the storage backends which are not csv files (see 'columnar.py', 'database.py')
+    :param value: value of the row (number, text, "error"...)
+    :param column_kind: "time", "text" or "number" (see 'kind()')
+    :return: value of the column, None if missing ("error", empty, not a number for a number column)
+    """
+    if value is None or value == "error" or value == "":
+        return None
+    if column_kind == "time":
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.strptime(str(value), date_format)
+        except ValueError:
+            return None
+    if column_kind == "text":
+        return str(value)
+    if isinstance(value, bool):
+        return None  # False returned by a driver which failed
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # f-e "no fix"
+
+
+def row(sensor, data):
+    """
+    :param sensor: name of the sensor (see 'columns')
+    :param data: dictionary returned by the driver
+    :return: List[values in the order of the columns]
+    """
+    return [data[column[1]] for column in columns[sensor]]
+
+
+def error_data(sensor):
+    """
+    :param sensor: name of the sensor (see 'columns')
+    :return: Dictionary with "error" for each item of the sensor (reading failed or not yet available)
+    """
+    return dict.fromkeys([column[1] for column in columns[sensor]], "error")
+
+
+class BufferedCSV:
+    """
+    csv file kept open, the rows are kept in memory and written by batches
+    Avoid opening and closing the file for each row: each of them writes the metadata on the SD card, which can stall
+    for hundreds of milliseconds and wears the card
+    """
+
+    def __init__(self, file, flush_rows=1, flush_interval=0, fsync_policy="never", journal=None):
+        """
+        :param file: path of the csv file, the rows are appended
+        :param flush_rows: rows are written when this number of rows is kept in memory
+        :param flush_interval: Optional: rows are written when the oldest one is kept since this amount of seconds
+                               (checked when a row is added), 0 = no limit
+        :param fsync_policy: see 'fsync_policies'
+        :param journal: Optional: journal of the rows kept in memory, emptied once they are forced in the file
+                        (see 'journal.py')
+        """
+        self.file = file
+        self.journal = journal
+        self.data_file = open(file, mode='a', newline='')
+        self.writer = csv.writer(self.data_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.rows = []  # rows kept in memory
+        self.oldest = None  # time at which the oldest row kept in memory has been added
+        self.configure(flush_rows, flush_interval, fsync_policy)
+
+    def configure(self, flush_rows, flush_interval, fsync_policy):
+        """
+        Change when the rows are written (see '__init__()'), the rows kept in memory are not lost
+        :return: nothing
+        """
+        if fsync_policy not in fsync_policies:
+            raise ValueError("fsync policy must be one of " + str(fsync_policies) + ", not '" + str(fsync_policy) +
+                             "'")
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+
+    def writerow(self, to_write, header=None):
+        """
+        Add a row, written with the others when there are enough rows or when the oldest one is too old
+        :param to_write: List[values]
+        :param header: Optional: List[headers of the columns of the row], kept in the journal (see 'journal.py')
+        :return: nothing
+        """
+        if not self.rows:
+            self.oldest = time.monotonic()
+        if self.journal is not None:
+            self.journal.append(to_write, header)
+        self.rows.append(to_write)
+        if len(self.rows) >= self.flush_rows or \
+                (self.flush_interval > 0 and time.monotonic() - self.oldest >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows kept in memory in the file
+        :return: nothing
+        """
+        journaled = self.journal is not None and len(self.rows) > 0
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+        self.data_file.flush()
+        if self.fsync_policy == "flush" or journaled:
+            os.fsync(self.data_file.fileno())
+        if journaled:
+            self.journal.clear()  # the rows are on the SD card
+
+    def close(self):
+        """
+        Write the rows kept in memory and close the file, can be called several times
+        :return: nothing
+        """
+        if self.data_file.closed:
+            return
+        self.flush()
+        if self.fsync_policy == "close":
+            os.fsync(self.data_file.fileno())
+        self.data_file.close()
+        if self.journal is not None:
+            self.journal.close()